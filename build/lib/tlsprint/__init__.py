@@ -0,0 +1,3 @@
+# The version is stored in `_version.py`, which is generated by
+# `setuptools_scm` when the package is created.
+from ._version import __version__  # noqa: F401
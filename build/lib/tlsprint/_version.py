@@ -0,0 +1 @@
+__version__ = '0.1.dev41+gb49b6a91e.d20261018'
\ No newline at end of file
@@ -0,0 +1,656 @@
+import collections
+import concurrent.futures
+import copy
+import itertools
+import json
+import math
+import pathlib
+
+import numpy
+import pandas
+import seaborn
+from matplotlib import pyplot
+
+from . import util
+from .identify import INPUT_SELECTORS
+from .identify import MODEL_WEIGHTS
+from .identify import BenchmarkConnector
+from .identify import ResponseIndex
+from .identify import identify
+from .simulate import SimulatorConnector
+from .trees import trees
+
+
+def count_inputs(messages):
+    return len(messages) // 2
+
+
+def count_resets(messages):
+    return messages.count("RESET")
+
+
+PATH_VALUES = {
+    "inputs": count_inputs,
+    "resets": count_resets,
+}
+
+
+class LatencyModel:
+    """Model of the wall clock time needed to identify a target, based on the
+    number of inputs and resets.
+
+    Identifying a target costs a single JVM startup and connection (handshake)
+    to TLSAttackerConnector. Every input costs a round trip, of which the
+    duration is log-normally distributed. Every reset costs a round trip plus
+    the time needed by TLSAttackerConnector to set up a new connection with
+    the target.
+    """
+
+    def __init__(
+        self, rtt=0.05, rtt_sigma=0.5, handshake=0.1, reset=0.1, startup=2.0, seed=0
+    ):
+        """Configure the model, all durations are in seconds.
+
+        Args:
+            rtt: Median round trip time of a single input.
+            rtt_sigma: Shape (standard deviation of the logarithm) of the
+                log-normal round trip time distribution.
+            handshake: Time to connect to TLSAttackerConnector.
+            reset: Additional time of a reset compared to a regular input.
+            startup: Time to start TLSAttackerConnector.
+            seed: Seed of the random generator, to make the output
+                reproducible.
+        """
+        self.rtt = rtt
+        self.rtt_sigma = rtt_sigma
+        self.handshake = handshake
+        self.reset = reset
+        self.startup = startup
+        self.random = numpy.random.default_rng(seed)
+
+    @classmethod
+    def from_timings(cls, events, **kwargs):
+        """Fit the model on the events recorded by an instrumentation sink,
+        for example the file written by `identify --timings-log`.
+
+        The round trip time is fitted on the round trips of single messages,
+        the startup and handshake on the mean of the recorded connector
+        startups and connections. The reset cost cannot be separated from the
+        recorded round trips, so it is taken from the keyword arguments like
+        all parameters without recorded events.
+        """
+        round_trips = []
+        startups = []
+        handshakes = []
+        batch_size = None
+        for event in events:
+            if event["name"] == "connector.messages":
+                batch_size = event["value"]
+            elif event["name"] == "connector.round_trip":
+                if batch_size == 1:
+                    round_trips.append(event["value"])
+                batch_size = None
+            elif event["name"] == "connector.start":
+                startups.append(event["value"])
+            elif event["name"] == "connector.connect":
+                handshakes.append(event["value"])
+
+        if round_trips:
+            logs = numpy.log(round_trips)
+            kwargs["rtt"] = float(numpy.exp(logs.mean()))
+            kwargs["rtt_sigma"] = float(logs.std())
+        if startups:
+            kwargs["startup"] = float(numpy.mean(startups))
+        if handshakes:
+            kwargs["handshake"] = float(numpy.mean(handshakes))
+        return cls(**kwargs)
+
+    def parameters(self):
+        return {
+            "rtt": self.rtt,
+            "rtt_sigma": self.rtt_sigma,
+            "handshake": self.handshake,
+            "reset": self.reset,
+            "startup": self.startup,
+        }
+
+    def sample(self, inputs, resets, size):
+        """Return `size` samples of the time needed for an identification with
+        the given number of inputs and resets."""
+        round_trips = int(round(inputs + resets))
+        rtts = self.random.lognormal(
+            numpy.log(self.rtt), self.rtt_sigma, size=(size, round_trips)
+        )
+        fixed = self.startup + self.handshake + resets * self.reset
+        return fixed + rtts.sum(axis=1)
+
+
+def _time_statistics(times, weights=None):
+    if weights is None:
+        weights = numpy.ones(len(times), dtype=int)
+    return {
+        "mean": float(numpy.average(times, weights=weights)),
+        "p50": _weighted_percentile(times, weights, 50),
+        "p95": _weighted_percentile(times, weights, 95),
+    }
+
+
+def benchmark_model(
+    tree,
+    model,
+    selector,
+    weight_function,
+    index=None,
+    simulator=None,
+    confidence=None,
+):
+    tree_copy = copy.deepcopy(tree)
+
+    # Simulate the target using the learned state machine if available,
+    # otherwise use the tree itself.
+    if simulator:
+        connector = SimulatorConnector(simulator, model)
+    else:
+        connector = BenchmarkConnector(model, tree_copy, index)
+
+    models = identify(
+        tree_copy,
+        model,
+        selector=selector,
+        weight_function=weight_function,
+        connector=connector,
+        confidence=confidence,
+    )
+    values = {name: value(connector.messages) for name, value in PATH_VALUES.items()}
+    if confidence is not None:
+        # Stopping early can identify the wrong model, which is measured as
+        # well.
+        values["correct"] = float(bool(models) and model in models)
+    return values
+
+
+def benchmark(
+    tree,
+    selector,
+    weight_function,
+    simulator=None,
+    latency_model=None,
+    samples=100,
+    confidence=None,
+):
+    """Return the inputs and outputs used to identify each model in the
+    tree. If a `Simulator` is passed, the models are simulated using their
+    learned state machines instead of the tree. If a `LatencyModel` is passed,
+    the distribution of the identification time is simulated as well, using
+    `samples` samples per identification. If a `confidence` is passed, the
+    identifications stop at this confidence and the values include whether
+    the identified model was "correct"."""
+    models = tree.models
+    if selector == INPUT_SELECTORS["random"]:
+        iterations = 20
+    else:
+        iterations = 1
+
+    # The responses of every model only depend on the original tree, so the
+    # index is shared by all benchmark runs.
+    index = None if simulator else ResponseIndex(tree)
+
+    results = []
+    for model in sorted(models):
+        path_values = []
+        for _ in range(iterations):
+            path_values.append(
+                benchmark_model(
+                    tree, model, selector, weight_function, index, simulator, confidence
+                )
+            )
+
+        # Compute averages of path values
+        values_sums = collections.defaultdict(int)
+        for values in path_values:
+            for name, value in values.items():
+                values_sums[name] += value
+        averages = {name: sum / len(path_values) for name, sum in values_sums.items()}
+        result = {
+            "model": model,
+            "weight": weight_function(tree.model_mapping[model]),
+            "values": averages,
+        }
+
+        if latency_model:
+            times = numpy.concatenate(
+                [
+                    latency_model.sample(values["inputs"], values["resets"], samples)
+                    for values in path_values
+                ]
+            )
+            result["time"] = _time_statistics(times)
+        results.append(result)
+    return results
+
+
+def benchmark_all(simulators=None, latency_model=None):
+    """Benchmark all bundled trees, selectors and weight functions. The
+    optional `simulators` dictionary maps TLS versions to a `Simulator`, which
+    is then used to simulate the targets for that version. If a
+    `LatencyModel` is passed, the results include the simulated time per
+    target and the resulting targets per hour for a single core."""
+    simulators = simulators or {}
+
+    benchmark_inputs = []
+    for tree_type, tls_versions in trees.items():
+        for version, tree in tls_versions.items():
+            selectors = INPUT_SELECTORS.keys()
+            weight_functions = MODEL_WEIGHTS.keys()
+
+            if tree_type == "adg":
+                # The ADG tree type has no use for different selectors or
+                # weight functions, as there is always only one input
+                # possible.
+                selectors = ("first",)
+
+            for selector, weight in itertools.product(selectors, weight_functions):
+                benchmark_inputs.append(
+                    {
+                        "type": tree_type,
+                        "version": version,
+                        "tree": tree,
+                        "selector": selector,
+                        "weight": weight,
+                    }
+                )
+
+    results = []
+    for info in benchmark_inputs:
+        benchmark_result = benchmark(
+            info["tree"],
+            INPUT_SELECTORS[info["selector"]],
+            MODEL_WEIGHTS[info["weight"]],
+            simulators.get(info["version"]),
+            latency_model,
+        )
+        result = {
+            "type": info["type"],
+            "version": info["version"],
+            "selector": info["selector"],
+            "weight": info["weight"],
+            "benchmark": benchmark_result,
+        }
+
+        if latency_model:
+            # Distribution of the mean time over the (weighted) targets
+            result["time"] = _time_statistics(
+                [item["time"]["mean"] for item in benchmark_result],
+                [item["weight"] for item in benchmark_result],
+            )
+            result["time"]["targets_per_hour"] = 3600 / result["time"]["mean"]
+            result["latency_model"] = latency_model.parameters()
+        results.append(result)
+
+    return results
+
+
+def _weighted_mean(benchmark_result, name, default=None):
+    return float(
+        numpy.average(
+            [item["values"].get(name, default) for item in benchmark_result],
+            weights=[item["weight"] for item in benchmark_result],
+        )
+    )
+
+
+def benchmark_confidence(thresholds, weight="usage", simulators=None):
+    """Benchmark stopping the identification at each of the confidence
+    `thresholds`, for all bundled trees. The ADG trees use the "first"
+    selector, the HDT trees the "gini" selector.
+
+    Returns a list with a dictionary per tree and threshold, containing the
+    weighted mean number of inputs, the fraction of the inputs saved compared
+    to a complete identification and the weighted fraction of correctly
+    identified models.
+    """
+    simulators = simulators or {}
+    weight_function = MODEL_WEIGHTS[weight]
+
+    rows = []
+    for tree_type, tls_versions in sorted(trees.items()):
+        for version, tree in sorted(tls_versions.items()):
+            selector = INPUT_SELECTORS["first" if tree_type == "adg" else "gini"]
+            simulator = simulators.get(version)
+
+            baseline = _weighted_mean(
+                benchmark(tree, selector, weight_function, simulator), "inputs"
+            )
+            for confidence in thresholds:
+                benchmark_result = benchmark(
+                    tree, selector, weight_function, simulator, confidence=confidence
+                )
+                inputs = _weighted_mean(benchmark_result, "inputs")
+                rows.append(
+                    {
+                        "type": tree_type,
+                        "version": version,
+                        "confidence": confidence,
+                        "inputs": inputs,
+                        "inputs_saved": 1 - inputs / baseline if baseline else 0.0,
+                        "accuracy": _weighted_mean(benchmark_result, "correct"),
+                    }
+                )
+    return rows
+
+
+FRAME_COLUMNS = (
+    "type",
+    "version",
+    "selector",
+    "weight",
+    "model",
+    "model_weight",
+    "metric",
+    "value",
+)
+
+
+def results_frame(benchmark_data):
+    """Convert the output of `benchmark_all` to a DataFrame in long format,
+    with a row for every metric of every model in every benchmark. The
+    simulated times are included as the metrics `time_mean`, `time_p50` and
+    `time_p95`."""
+    columns = {column: [] for column in FRAME_COLUMNS}
+    for entry in benchmark_data:
+        for item in entry["benchmark"]:
+            metrics = dict(item["values"])
+            for statistic, value in item.get("time", {}).items():
+                metrics[f"time_{statistic}"] = value
+
+            for metric, value in metrics.items():
+                for key in ("type", "version", "selector", "weight"):
+                    columns[key].append(entry[key])
+                columns["model"].append(item["model"])
+                columns["model_weight"].append(item["weight"])
+                columns["metric"].append(metric)
+                columns["value"].append(value)
+    return pandas.DataFrame(columns, columns=FRAME_COLUMNS)
+
+
+def write_results(benchmark_data, path):
+    """Write the output of `benchmark_all` to a file. If the file name ends
+    with `.npz` the results are stored in columnar format as compressed NumPy
+    arrays, otherwise as JSON."""
+    path = pathlib.Path(path)
+    if path.suffix == ".npz":
+        frame = results_frame(benchmark_data)
+        # Store the strings as fixed width unicode arrays, so the file can be
+        # loaded without pickle.
+        numpy.savez_compressed(
+            path,
+            **{
+                column: frame[column].to_numpy(
+                    dtype=(
+                        None
+                        if pandas.api.types.is_numeric_dtype(frame[column])
+                        else str
+                    )
+                )
+                for column in FRAME_COLUMNS
+            },
+        )
+    else:
+        with open(path, "w") as f:
+            json.dump(benchmark_data, f, indent=4)
+
+
+def read_results(path):
+    """Read the results written by `write_results` as a DataFrame, see
+    `results_frame`."""
+    path = pathlib.Path(path)
+    if path.suffix == ".npz":
+        with numpy.load(path) as data:
+            return pandas.DataFrame({column: data[column] for column in FRAME_COLUMNS})
+
+    with open(path) as f:
+        return results_frame(json.load(f))
+
+
+def _weighted_percentile(values, weights, q):
+    """Return the q-th percentile of the values, where every value counts
+    `weight` times. This is equal to `numpy.percentile(numpy.repeat(values,
+    weights), q)`, without creating the repeated array."""
+    order = numpy.argsort(values, kind="stable")
+    values = numpy.asarray(values)[order]
+    cumulative = numpy.cumsum(numpy.asarray(weights)[order])
+
+    position = q / 100 * (cumulative[-1] - 1)
+    lower, upper = numpy.searchsorted(
+        cumulative, [math.floor(position), math.ceil(position)], side="right"
+    )
+    return float(values[lower] + (values[upper] - values[lower]) * (position % 1))
+
+
+def summarize(frame):
+    """Summarize benchmark results (see `results_frame`) into the weighted
+    mean, 95th percentile and maximum of every metric.
+
+    Returns:
+        A dictionary mapping the name of every benchmark (type, version,
+        selector and weight function) to a dictionary of the form
+        `{metric: {statistic: value}}`.
+
+    Raises:
+        ValueError: If all models of a benchmark have a weight of zero, as
+            there is nothing to summarize.
+    """
+    summary = {}
+    keys = ["type", "version", "selector", "weight"]
+    for key, group in frame.groupby(keys + ["metric"], sort=True):
+        values = group["value"].to_numpy()
+        weights = group["model_weight"].to_numpy()
+        if not (weights > 0).any():
+            raise ValueError(
+                f"All models of benchmark {' '.join(key[:-1])} have a weight of"
+                f" zero, cannot summarize {key[-1]}"
+            )
+        summary.setdefault(" ".join(key[:-1]), {})[key[-1]] = {
+            "mean": float(numpy.average(values, weights=weights)),
+            "p95": _weighted_percentile(values, weights, 95),
+            "max": float(values[weights > 0].max()),
+        }
+    return summary
+
+
+def summarize_perf(perf_data):
+    """Summarize the output of `perf.perf_all` in the same format as
+    `summarize`."""
+    summary = {}
+    for entry in perf_data:
+        name = " ".join(entry[key] for key in ("case", "type", "version") if entry[key])
+        summary[name] = {
+            "wall_time": {
+                "min": entry["wall_time"]["min"],
+                "median": entry["wall_time"]["median"],
+            },
+            "peak_memory": {"value": entry["peak_memory"]},
+        }
+    return summary
+
+
+def _is_perf_data(data):
+    return isinstance(data, list) and bool(data) and "case" in data[0]
+
+
+def _summarize(data):
+    if isinstance(data, pandas.DataFrame):
+        return summarize(data)
+    if _is_perf_data(data):
+        return summarize_perf(data)
+    return summarize(results_frame(data))
+
+
+def compare(baseline, new, threshold=0.05, timing_threshold=0.25):
+    """Compare two benchmark runs, both either from `benchmark_all` (as list
+    or as DataFrame, see `results_frame`) or from `perf.perf_all`.
+
+    Args:
+        baseline: The results of the baseline run.
+        new: The results of the run to compare with the baseline.
+        threshold: Maximum relative increase of an identification metric
+            (for example the number of inputs) that is not a regression.
+        timing_threshold: Maximum relative increase of a timing or memory
+            metric that is not a regression. Measurements are noisy, so this
+            is larger by default.
+
+    Returns:
+        A list with a row for every statistic present in both runs, with the
+        relative change and whether it is a regression. Benchmarks present in
+        only one of the runs are skipped.
+    """
+    if _is_perf_data(baseline) != _is_perf_data(new):
+        raise ValueError("Cannot compare benchmark and perf results")
+
+    if _is_perf_data(baseline):
+        threshold = timing_threshold
+    baseline, new = _summarize(baseline), _summarize(new)
+
+    rows = []
+    for name in sorted(baseline.keys() & new.keys()):
+        for metric in sorted(baseline[name].keys() & new[name].keys()):
+            for statistic, old_value in baseline[name][metric].items():
+                new_value = new[name][metric][statistic]
+                if old_value:
+                    change = (new_value - old_value) / old_value
+                else:
+                    change = math.inf if new_value > 0 else 0.0
+                rows.append(
+                    {
+                        "Benchmark": name,
+                        "Metric": f"{metric} {statistic}",
+                        "Baseline": old_value,
+                        "New": new_value,
+                        "Change": change,
+                        "Regression": change > threshold,
+                    }
+                )
+    return rows
+
+
+def count_inputs(model_info):
+    return len(model_info["path"]) // 2
+
+
+def equal_model_weight(model_info):
+    return 1
+
+
+def implementation_count_weight(model_info):
+    return len(model_info["implementations"])
+
+
+def _weighted_density(values, weights, bw=0.1, cut=2, gridsize=100):
+    """Return a weighted Gaussian kernel density estimate of the values, scaled
+    by the total weight. The bandwidth is `bw` times the weighted standard
+    deviation, the grid extends `cut` bandwidths past the extreme values."""
+    mean = numpy.average(values, weights=weights)
+    std = math.sqrt(numpy.average((values - mean) ** 2, weights=weights))
+    bandwidth = bw * std or bw
+
+    grid = numpy.linspace(
+        values.min() - cut * bandwidth, values.max() + cut * bandwidth, gridsize
+    )
+    kernels = numpy.exp(-0.5 * ((grid[:, None] - values[None, :]) / bandwidth) ** 2)
+    density = kernels @ weights / (bandwidth * math.sqrt(2 * math.pi))
+    return grid, density
+
+
+def visualize(frame, output_path, title):
+    """Plot the distribution of the inputs and resets of every identification
+    method as split violins, with the weighted mean as a point. The models are
+    weighted by their weight, without duplicating any data."""
+    metrics = list(PATH_VALUES)
+    frame = frame[frame["metric"].isin(metrics) & (frame["model_weight"] > 0)]
+    names = list(frame["name"].unique())
+
+    violins = {}
+    for (name, metric), group in frame.groupby(["name", "metric"]):
+        values = group["value"].to_numpy(dtype=float)
+        weights = group["model_weight"].to_numpy(dtype=float)
+        violins[name, metric] = (
+            _weighted_density(values, weights),
+            numpy.average(values, weights=weights),
+        )
+
+    # Like `scale="count"` in seaborn, the width of every violin is relative
+    # to the total weight of its models.
+    max_density = max(density.max() for (_, density), _ in violins.values())
+    scale = 0.4 / max_density
+
+    figure, axes = pyplot.subplots()
+    fills = seaborn.color_palette("pastel")
+    points = seaborn.color_palette("bright")
+    for (name, metric), ((grid, density), mean) in violins.items():
+        position = names.index(name)
+        index = metrics.index(metric)
+        side = -1 if index == 0 else 1
+        axes.fill_betweenx(
+            grid,
+            position,
+            position + side * density * scale,
+            color=fills[index],
+            label=metric,
+        )
+        axes.plot(position, mean, "o", color=points[index])
+
+    # Only show every metric once in the legend
+    handles, labels = axes.get_legend_handles_labels()
+    unique = dict(zip(labels, handles))
+    axes.legend(unique.values(), unique.keys())
+
+    axes.set_xticks(range(len(names)))
+    axes.set_xticklabels(names)
+    axes.set_title(title)
+    axes.set_xlabel("Identification method")
+    axes.set_ylabel("Metric value")
+    figure.savefig(output_path)
+    pyplot.close(figure)
+
+
+def visualize_tls_group(frame, output_directory, version):
+    seaborn.set(style="dark", palette="pastel", color_codes=True)
+    version_string = util.format_tls_string(version)
+    for weight_function, subset in frame.groupby("weight", sort=False):
+        title = f"{version_string} - Model weight: {weight_function.capitalize()}"
+        output_path = output_directory / f"{version} {weight_function}.pdf"
+        visualize(subset, output_path, title)
+
+
+def visualize_all(frame, output_directory, jobs=None):
+    """Plot the benchmark results (see `results_frame`), with a plot per TLS
+    version and weight function. The TLS versions are plotted in parallel
+    using `jobs` processes, by default one per CPU."""
+    if not isinstance(frame, pandas.DataFrame):
+        frame = results_frame(frame)
+    output_directory = pathlib.Path(output_directory)
+    output_directory.mkdir(exist_ok=True)
+
+    # The ADG tree type only uses a single selector, so it is not named
+    frame = frame.assign(
+        name=frame["type"]
+        .str.upper()
+        .where(
+            frame["type"].str.lower() == "adg",
+            frame["type"].str.upper() + " " + frame["selector"],
+        )
+    )
+
+    groups = [(group, version) for version, group in frame.groupby("version")]
+    if jobs == 1 or len(groups) <= 1:
+        for group, version in groups:
+            visualize_tls_group(group, output_directory, version)
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        futures = [
+            executor.submit(visualize_tls_group, group, output_directory, version)
+            for group, version in groups
+        ]
+        for future in futures:
+            future.result()
@@ -0,0 +1,1307 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import copy
+import functools
+import json
+import os
+import pickle
+import socket
+import sys
+from distutils.version import LooseVersion
+from pathlib import Path
+
+import click
+import tabulate
+
+from . import __version__
+from . import instrument
+from . import probe
+from . import profiling
+from . import stats
+from . import util
+from .benchmark import LatencyModel
+from .benchmark import benchmark_all
+from .benchmark import benchmark_confidence
+from .benchmark import compare
+from .benchmark import read_results
+from .benchmark import visualize_all
+from .benchmark import write_results
+from .identify import MODEL_WEIGHTS
+from .identify import STATUS_FAILED
+from .identify import STATUS_TIMEOUT
+from .identify import identify_target
+from .identify import identify_target_versions
+from .learn import SUPPORTED_TREE_TYPES
+from .learn import _dot_to_networkx
+from .learn import construct_tree_from_dedup
+from .learn import render_dot_files
+from .perf import perf_all
+from .scan import ScanClient
+from .scan import ScanCoordinator
+from .scan import ScanQueue
+from .scan import identifier
+from .scan import parse_target
+from .scan import run_worker
+from .serve import IdentifyServer
+from .simulate import Simulator
+from .simulate import SimulatorServer
+from .stats.context import StatsContext
+from .stats.context import default_cache_file
+from .store import ResultStore
+
+
+@click.group()
+@click.version_option(__version__)
+@click.option(
+    "--profile",
+    "profile_directory",
+    help=(
+        "Profile the command (cProfile, sampling and memory) and write the"
+        " results to this directory. This slows down the command."
+    ),
+    type=click.Path(file_okay=False, writable=True),
+)
+@click.pass_context
+def main(ctx, profile_directory):
+    if profile_directory and ctx.invoked_subcommand:
+        profiler = profiling.Profiler(profile_directory, ctx.invoked_subcommand)
+        # Nested groups add their subcommand, see `_profile_subcommand`
+        ctx.meta["profiler"] = profiler
+        profiler.start()
+        ctx.call_on_close(profiler.stop)
+
+
+def _profile_subcommand(ctx):
+    """Add the subcommand invoked by a nested group to the profiled command,
+    so for example `benchmark generate` and `benchmark perf` are written to
+    different directories."""
+    profiler = ctx.meta.get("profiler")
+    if profiler and ctx.invoked_subcommand:
+        profiler.add_subcommand(ctx.invoked_subcommand)
+
+
+@main.command("construct")
+@click.argument("dedup_directory", type=click.Path(exists=True))
+@click.argument("output", type=click.File("wb"))
+@click.option("--tree-type", default="adg", type=click.Choice(SUPPORTED_TREE_TYPES))
+def learn_command(dedup_directory, output, tree_type):
+    """Construct a tree for the identification, based on the output of the
+    `dedup` command. Write the resulting tree to 'output' as a pickled
+    object."""
+    tree = construct_tree_from_dedup(dedup_directory, tree_type=tree_type)
+    pickle.dump(tree, output)
+
+
+@main.command("identify")
+@click.argument("target")
+@click.option("-p", "--target-port", default=443)
+@click.option(
+    "--tree",
+    help=(
+        "Optional custom tree to use (output from `learn`),"
+        " defaults to tree included in the distribution."
+    ),
+    type=click.File("rb"),
+)
+@click.option(
+    "--tls-version",
+    type=click.Choice(sorted(probe.VERSIONS)),
+    help=(
+        "TLS version to use, this selects the included tree and the version"
+        " used by the connector. By default the highest version supported by"
+        " the target is used."
+    ),
+)
+@click.option(
+    "--probe/--no-probe",
+    "probe_target",
+    default=True,
+    show_default=True,
+    help=(
+        "Probe the TLS versions supported by the target (cached per target),"
+        " to select the tree. Without probing, TLS 1.2 is used."
+    ),
+)
+@click.option(
+    "--joint",
+    help=(
+        "Use the trees of all TLS versions supported by the target together,"
+        " picking the most distinguishing input of all versions at every step."
+        " This starts a connector per TLS version."
+    ),
+    is_flag=True,
+)
+@click.option(
+    "--graph-dir",
+    help="Directory to store intermediate graphs, if desired.",
+    type=click.Path(file_okay=False, writable=True),
+)
+@click.option(
+    "--render/--no-render",
+    default=True,
+    show_default=True,
+    help=(
+        "Render the graphs in --graph-dir to SVG after the identification."
+        " Without rendering only the DOT files are written, these can be"
+        " rendered later using `tlsprint render`."
+    ),
+)
+@click.option(
+    "--connector",
+    "connector_address",
+    help=(
+        "Use an already running connector listening on HOST:PORT (for example"
+        " `tlsprint simulate`), instead of starting TLSAttackerConnector."
+    ),
+)
+@click.option(
+    "--speculative",
+    help=(
+        "Send the predicted inputs along the most likely path in a single"
+        " batch, reducing the number of round trips."
+    ),
+    is_flag=True,
+)
+@click.option(
+    "--stop-at-confidence",
+    "confidence",
+    help=(
+        "Stop as soon as a single model holds at least this share of the"
+        " weight of the remaining models, and report the remaining candidates."
+    ),
+    type=click.FloatRange(min=0, max=1, min_open=True),
+)
+@click.option(
+    "--weights",
+    "weight",
+    default="usage",
+    show_default=True,
+    help="Weight of the models, used to select inputs and by --stop-at-confidence.",
+    type=click.Choice(sorted(MODEL_WEIGHTS)),
+)
+@click.option(
+    "--timeout",
+    type=float,
+    help="Maximum number of seconds to wait for a single response.",
+)
+@click.option(
+    "--deadline",
+    type=float,
+    help="Maximum number of seconds for the whole identification.",
+)
+@click.option(
+    "--timings",
+    help="Print the time spent in every phase of the identification.",
+    is_flag=True,
+)
+@click.option(
+    "--timings-log",
+    help="Write every timing event as a line of JSON to this file.",
+    type=click.File("a"),
+)
+def identify_command(
+    target,
+    target_port,
+    tree,
+    tls_version,
+    probe_target,
+    joint,
+    graph_dir,
+    render,
+    connector_address,
+    speculative,
+    confidence,
+    weight,
+    timeout,
+    deadline,
+    timings,
+    timings_log,
+):
+    """Uses the learned tree to identify the implementation running on the
+    target. By default this will use the tree provided with the distribution,
+    but a custom tree can be supplied.
+    """
+    if connector_address:
+        host, port = connector_address.rsplit(":", maxsplit=1)
+        connector_address = (host, int(port))
+
+    if joint and (tree or tls_version or connector_address or graph_dir or confidence):
+        click.echo(
+            "--joint cannot be combined with --tree, --tls-version, --connector,"
+            " --graph-dir or --stop-at-confidence"
+        )
+        sys.exit(1)
+
+    if joint:
+        joint_trees = _select_trees(target, target_port, probe_target)
+    else:
+        # A running connector might not talk to the target itself, so there is
+        # nothing to probe.
+        tree, tls_version = _select_tree(
+            target,
+            target_port,
+            tree,
+            tls_version,
+            probe_target and not connector_address,
+        )
+
+    sinks = []
+    if timings:
+        sinks.append(instrument.MemorySink())
+    if timings_log:
+        sinks.append(instrument.JSONLinesSink(timings_log))
+
+    with contextlib.ExitStack() as stack:
+        for sink in sinks:
+            stack.enter_context(instrument.recording(sink))
+
+        if joint:
+            result = identify_target_versions(
+                joint_trees, target, target_port, timeout=timeout, deadline=deadline
+            )
+        else:
+            tree.condense()
+            result = identify_target(
+                tree,
+                target,
+                target_port,
+                connector_address=connector_address,
+                timeout=timeout,
+                deadline=deadline,
+                graph_dir=graph_dir,
+                speculative=speculative,
+                protocol_version=tls_version,
+                confidence=confidence,
+                weight_function=MODEL_WEIGHTS[weight],
+            )
+
+    # The graphs are rendered after the identification, so the slow Graphviz
+    # processes do not stall the connection with the target.
+    if graph_dir and render:
+        render_dot_files(graph_dir)
+
+    if timings:
+        click.echo(tabulate.tabulate(sinks[0].summary(), headers="keys"))
+        click.echo()
+
+    _echo_result(tree, result)
+
+
+def _select_tree(target, target_port, tree_file, tls_version, probe_target):
+    """Return the tree to use and the TLS version for the connector. Unless a
+    tree or version is given, the highest version supported by the target is
+    used if `probe_target` is set."""
+    from . import trees
+
+    if tree_file:
+        return pickle.load(tree_file), tls_version
+
+    available = trees.trees["adg"]
+    if not tls_version and probe_target:
+        tls_version = probe.select_version(
+            _probe_target(target, target_port), available
+        )
+        click.echo(f"Using the {util.format_tls_string(tls_version)} tree")
+
+    # Without probing, default to TLS 1.2
+    tls_version = tls_version or "TLS12"
+    return available[tls_version], tls_version
+
+
+def _select_trees(target, target_port, probe_target):
+    """Return copies of the trees for `identify_target_versions`, of all
+    versions supported by the target if `probe_target` is set."""
+    from . import trees
+
+    available = trees.trees["adg"]
+    versions = sorted(available)
+    if probe_target:
+        versions = [
+            version
+            for version in _probe_target(target, target_port)
+            if version in available
+        ]
+    click.echo(
+        "Using the {} trees".format(
+            ", ".join(util.format_tls_string(version) for version in versions)
+        )
+    )
+
+    joint_trees = {version: copy.deepcopy(available[version]) for version in versions}
+    for tree in joint_trees.values():
+        tree.condense()
+    return joint_trees
+
+
+def _probe_target(target, target_port):
+    """Return the TLS versions supported by the target that have a tree, exits
+    with status 1 if there are none."""
+    from . import trees
+
+    try:
+        supported = probe.supported_versions(target, target_port, probe.ProbeCache())
+    except OSError as e:
+        click.echo(f"Probing the target failed: {e}")
+        sys.exit(1)
+
+    supported = [version for version in supported if version in trees.trees["adg"]]
+    if not supported:
+        click.echo("Target does not support any TLS version with a tree")
+        sys.exit(1)
+    return supported
+
+
+def _echo_result(tree, result):
+    """Print the implementations matching the result of `identify_target`,
+    exits with status 1 if the identification did not succeed."""
+    if result["status"] == STATUS_TIMEOUT:
+        click.echo(f"Identification timed out: {result['error']}")
+        sys.exit(1)
+    elif result["status"] == STATUS_FAILED:
+        click.echo(f"Identification failed: {result['error']}")
+        sys.exit(1)
+
+    if "implementations" in result:
+        version_info = result["implementations"]
+    elif result["models"]:
+        version_info = tree.model_mapping[list(result["models"])[0]]
+    else:
+        version_info = None
+
+    if version_info:
+        click.echo("Target has one of the following implementations:")
+        click.echo(_format_implementations(version_info))
+    else:
+        click.echo("Failed to identify implementation")
+        sys.exit(1)
+
+    if len(result.get("candidates", ())) > 1:
+        click.echo("\nStopped early, the remaining candidates are:")
+        for model, share in result["candidates"]:
+            implementations = _format_implementations(
+                tree.model_mapping[model], separator=", "
+            )
+            click.echo(f"{share:6.1%}  {implementations}")
+
+
+def _format_implementations(version_info, separator="\n"):
+    version_info = sorted(version_info, key=lambda x: LooseVersion(x[1]))
+    return separator.join(" ".join(info) for info in version_info)
+
+
+def _convert_file(path, name, add_resets):
+    if path == "-":
+        graph = _dot_to_networkx(click.get_text_stream("stdin").read())
+    else:
+        with open(path) as f:
+            graph = _dot_to_networkx(f.read())
+
+    # If a name is specified, prefix all nodes with that name
+    prefix = f"{name}_" if name else None
+    return util.convert_graph(graph, add_resets=add_resets, prefix=prefix)
+
+
+@main.command("convert")
+@click.argument(
+    "inputs",
+    metavar="INPUT...",
+    nargs=-1,
+    required=True,
+    type=click.Path(exists=True, allow_dash=True),
+)
+@click.argument("output_file", metavar="OUTPUT", type=click.File("w"))
+@click.option("--name", help="Prefix every node with this name")
+@click.option(
+    "--add-resets",
+    help="Add a 'RESET / -' edge from every sinkhole to the start state.",
+    is_flag=True,
+)
+@click.option(
+    "--indent",
+    type=click.IntRange(min=0),
+    help="Pretty print the JSON of a single input with this indentation.",
+)
+@click.option(
+    "--jobs",
+    "-j",
+    help="Number of processes used to convert multiple inputs.",
+    type=click.IntRange(min=1),
+)
+def convert_command(inputs, output_file, name, add_resets, indent, jobs):
+    """Convert a graph from DOT to JSON.
+
+    This is tailored to convert DOT output from LearnLib to the JSON files used
+    by adg-finder. As such, it makes certain assumptions about the structure of
+    the graph. For example, it assumes there is a dummy state called (often
+    called `__start`), which is the only state without any incoming edges. This
+    state is used to find the start state and will then be removed.
+
+    A single INPUT file (or `-` for stdin) is written as a JSON object. If
+    multiple files or a directory (containing `.dot` and `.gv` files) are
+    given, these are converted in parallel and written as JSON lines, with an
+    object `{"path": ..., "graph": ...}` per input.
+    """
+    if "-" in inputs and len(inputs) > 1:
+        raise click.UsageError("- (stdin) can only be converted as the only INPUT")
+
+    if len(inputs) == 1 and (inputs[0] == "-" or Path(inputs[0]).is_file()):
+        converted = _convert_file(inputs[0], name, add_resets)
+        json.dump(converted, output_file, indent=indent)
+        output_file.write("\n")
+        return
+
+    paths = []
+    for path in map(Path, inputs):
+        if path.is_dir():
+            paths += sorted(
+                p
+                for p in path.rglob("*")
+                if p.suffix in (".dot", ".gv") and p.is_file()
+            )
+        else:
+            paths.append(path)
+
+    # Stream the results in the order of the inputs, as soon as they are
+    # available.
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        results = executor.map(
+            functools.partial(_convert_file, name=name, add_resets=add_resets),
+            paths,
+            chunksize=16,
+        )
+        for path, converted in zip(paths, results):
+            output_file.write(json.dumps({"path": str(path), "graph": converted}))
+            output_file.write("\n")
+
+
+@main.command("dedup")
+@click.argument("model_directory", type=click.Path(exists=True))
+@click.argument("output_directory", type=click.Path())
+def dedup_command(model_directory, output_directory):
+    """Deduplicate the models directory.
+
+    This reads the directory and assumes the path format
+    `implementation/version/tls_version/learnedModel.dot` for every model. For
+    every TLS protocol version, it groups together models which are the same.
+    It then creates a directory for each TLS version, containing a directory
+    for every unique model. Each model directory then contains the model in
+    both Graphviz and JSON format, and a JSON file which lists the
+    corresponding implementations and versions.
+
+    Reruns are incremental, using the manifest in the output directory: only
+    new and changed models are processed and existing models keep their name.
+    """
+    counts = util.dedup_incremental(
+        model_directory, output_directory, _write_dedup_model
+    )
+    click.echo(
+        "{added} models added, {updated} updated, {removed} removed".format(**counts)
+    )
+
+
+def _write_dedup_model(model_dir, model_name, model):
+    # Write the model to this directory, both in Graphviz and JSON format.
+    with open(model_dir / "model.gv", "w") as f:
+        f.write(model)
+
+    graph = _dot_to_networkx(model)
+    converted = util.convert_graph(graph, add_resets=True, prefix=f"{model_name}_")
+    with open(model_dir / "model.json", "w") as f:
+        json.dump(converted, f, indent=4)
+
+
+@main.command("simulate")
+@click.argument("model_file", metavar="MODEL", type=click.File("r"))
+@click.option("--host", default="localhost", help="Address to listen on.")
+@click.option("-p", "--port", default=6666, help="Port to listen on.")
+@click.option(
+    "--latency", default=0.0, help="Artificial delay in seconds for every response."
+)
+@click.option(
+    "--jitter",
+    default=0.0,
+    help="Additional random delay in seconds, between 0 and this value.",
+)
+@click.option(
+    "--concurrency",
+    type=int,
+    help="Maximum number of sessions served at the same time.",
+)
+def simulate_command(model_file, host, port, latency, jitter, concurrency):
+    """Simulate TLSAttackerConnector, answering from a learned model.
+
+    The MODEL is a DOT file as written by StateLearner (`learnedModel.dot`) or
+    the `dedup` command (`model.gv`). The server speaks the same protocol as
+    TLSAttackerConnector, which makes it possible to test and load test the
+    identification without a JVM or a live target.
+    """
+    simulator = Simulator.from_dot({"model": model_file.read()})
+    server = SimulatorServer(
+        simulator, "model", latency=latency, jitter=jitter, concurrency=concurrency
+    )
+
+    async def serve():
+        listener = await server.start(host, port)
+
+        # Like TLSAttackerConnector, print a line when ready to accept
+        # connections.
+        click.echo(f"Listening on {host}:{port}")
+        async with listener:
+            await listener.serve_forever()
+
+    asyncio.run(serve())
+
+
+@main.command("draw")
+@click.argument("graph", type=click.File("rb"))
+@click.argument("output", type=click.File("wb"))
+@click.option("--format", "fmt", default="svg")
+def daw_command(graph, output, fmt):
+    graph = pickle.load(graph)
+    drawing = graph.draw(fmt=fmt)
+    output.write(drawing)
+
+
+@main.command("render")
+@click.argument("graph_dir", type=click.Path(exists=True, file_okay=False))
+@click.option("--format", "fmt", default="svg", show_default=True)
+@click.option(
+    "--jobs",
+    "-j",
+    help="Number of graphs to render in parallel.",
+    type=click.IntRange(min=1),
+)
+def render_command(graph_dir, fmt, jobs):
+    """Render the DOT files written by `identify --graph-dir` using
+    Graphviz."""
+    for path in render_dot_files(graph_dir, fmt=fmt, jobs=jobs):
+        click.echo(path)
+
+
+@main.command("stats")
+@click.option(
+    "--type",
+    "stats_type",
+    multiple=True,
+    type=click.Choice(stats.TYPES),
+    help="Stats type to print.",
+)
+@click.option(
+    "--model-directory",
+    default="models/models",
+    type=click.Path(exists=True),
+    help="Directory where the models are stored.",
+)
+@click.option(
+    "--dedup-directory",
+    default="dedup",
+    type=click.Path(exists=True),
+    help="Directory where the deduplicated model are stored.",
+)
+@click.option("--format", "fmt", type=click.Choice(["table", "json"]), default="table")
+@click.option(
+    "--cache-file",
+    default=default_cache_file,
+    show_default="~/.cache/tlsprint/stats.json",
+    type=click.Path(dir_okay=False, writable=True),
+    help="File to cache the parsed models in.",
+)
+@click.option("--no-cache", is_flag=True, help="Do not use the cache file.")
+@click.option(
+    "--jobs",
+    "-j",
+    help="Number of processes used to parse the models.",
+    type=click.IntRange(min=1),
+)
+def stats_command(
+    stats_type, model_directory, dedup_directory, fmt, cache_file, no_cache, jobs
+):
+    """Provide statistics about the available models (number of
+    implementations, unique models, etc.).
+    """
+    # The directories are only scanned once, for all requested types
+    context = StatsContext(
+        models_dir=model_directory,
+        dedup_dir=dedup_directory,
+        cache_file=None if no_cache else cache_file,
+        jobs=jobs,
+    )
+    for type_ in stats_type:
+        summary = stats.TYPE_HANDLERS[type_](context)
+
+        if fmt == "table":
+            click.echo(tabulate.tabulate(summary, headers="keys"))
+        else:
+            click.echo(json.dumps(summary))
+        click.echo()
+
+
+@main.group("benchmark")
+@click.pass_context
+def benchmark_group(ctx):
+    _profile_subcommand(ctx)
+
+
+@benchmark_group.command("generate")
+@click.argument("output", type=click.Path(dir_okay=False, writable=True))
+@click.option(
+    "--simulate",
+    "dedup_directory",
+    help=(
+        "Simulate the targets using the learned models in this dedup"
+        " directory, instead of the tree itself."
+    ),
+    type=click.Path(exists=True, file_okay=False),
+)
+@click.option(
+    "--rtt",
+    default=0.05,
+    show_default=True,
+    help="Median round trip time of an input in seconds.",
+    type=click.FloatRange(min=0, min_open=True),
+)
+@click.option(
+    "--rtt-sigma",
+    default=0.5,
+    show_default=True,
+    help="Shape of the log-normal round trip time distribution.",
+    type=click.FloatRange(min=0),
+)
+@click.option(
+    "--handshake",
+    default=0.1,
+    show_default=True,
+    help="Time in seconds to connect to TLSAttackerConnector.",
+    type=click.FloatRange(min=0),
+)
+@click.option(
+    "--reset-cost",
+    default=0.1,
+    show_default=True,
+    help="Additional time in seconds of a reset compared to an input.",
+    type=click.FloatRange(min=0),
+)
+@click.option(
+    "--startup",
+    default=2.0,
+    show_default=True,
+    help="Time in seconds to start TLSAttackerConnector.",
+    type=click.FloatRange(min=0),
+)
+@click.option(
+    "--fit",
+    "timings_log",
+    help=(
+        "Fit the latency model on the events written by `identify"
+        " --timings-log`, overriding the options above where possible."
+    ),
+    type=click.File("r"),
+)
+def benchmark_generate_command(
+    output, dedup_directory, rtt, rtt_sigma, handshake, reset_cost, startup, timings_log
+):
+    """Benchmark the identification of every model in the bundled trees and
+    write the results to OUTPUT. Besides the number of inputs and resets, the
+    results contain the wall clock time simulated by a latency model.
+
+    If OUTPUT ends with `.npz`, the results are stored in a columnar format
+    (compressed NumPy arrays), otherwise as JSON.
+    """
+    simulators = {}
+    if dedup_directory:
+        for path in Path(dedup_directory).iterdir():
+            if path.is_dir():
+                simulators[path.name] = Simulator.from_dedup(path)
+
+    parameters = {
+        "rtt": rtt,
+        "rtt_sigma": rtt_sigma,
+        "handshake": handshake,
+        "reset": reset_cost,
+        "startup": startup,
+    }
+    if timings_log:
+        events = [json.loads(line) for line in timings_log if line.strip()]
+        latency_model = LatencyModel.from_timings(events, **parameters)
+    else:
+        latency_model = LatencyModel(**parameters)
+
+    results = benchmark_all(simulators, latency_model)
+    write_results(results, output)
+
+
+@benchmark_group.command("visualize")
+@click.argument("benchmark_file", type=click.Path(exists=True, dir_okay=False))
+@click.argument("output_directory", type=click.Path())
+@click.option(
+    "--jobs",
+    "-j",
+    help="Number of TLS versions to plot in parallel, by default one per CPU.",
+    type=click.IntRange(min=1),
+)
+def benchmark_visualize_command(benchmark_file, output_directory, jobs):
+    visualize_all(read_results(benchmark_file), output_directory, jobs=jobs)
+
+
+@benchmark_group.command("perf")
+@click.argument("output", type=click.File("w"))
+@click.option(
+    "--dedup-directory",
+    help=(
+        "Also benchmark tree construction and simulated identification on the"
+        " learned models in this dedup directory."
+    ),
+    type=click.Path(exists=True, file_okay=False),
+)
+@click.option(
+    "--repeat",
+    default=5,
+    show_default=True,
+    help="Number of timed runs per case.",
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--filter",
+    "name_filter",
+    help="Only run the cases containing this string in their name.",
+)
+def benchmark_perf_command(output, dedup_directory, repeat, name_filter):
+    """Measure the wall time and memory usage of the main operations of
+    tlsprint, and write the results as JSON to OUTPUT."""
+    results = perf_all(dedup_directory, repeat=repeat, name_filter=name_filter)
+    json.dump(results, output, indent=4)
+
+
+@benchmark_group.command("confidence")
+@click.option(
+    "--threshold",
+    "thresholds",
+    multiple=True,
+    default=(0.5, 0.8, 0.9, 0.95, 0.99, 1.0),
+    show_default=True,
+    help="Confidence to stop at, can be given multiple times.",
+    type=click.FloatRange(min=0, max=1, min_open=True),
+)
+@click.option(
+    "--weights",
+    "weight",
+    default="usage",
+    show_default=True,
+    help="Weight of the models.",
+    type=click.Choice(sorted(MODEL_WEIGHTS)),
+)
+@click.option(
+    "--simulate",
+    "dedup_directory",
+    help=(
+        "Simulate the targets using the learned models in this dedup"
+        " directory, instead of the tree itself."
+    ),
+    type=click.Path(exists=True, file_okay=False),
+)
+@click.option(
+    "--output",
+    help="Also write the results as JSON to this file.",
+    type=click.File("w"),
+)
+def benchmark_confidence_command(thresholds, weight, dedup_directory, output):
+    """Show the inputs saved and the accuracy lost by `identify
+    --stop-at-confidence`, for every bundled tree and threshold."""
+    simulators = {}
+    if dedup_directory:
+        for path in Path(dedup_directory).iterdir():
+            if path.is_dir():
+                simulators[path.name] = Simulator.from_dedup(path)
+
+    rows = benchmark_confidence(sorted(thresholds), weight, simulators)
+    click.echo(tabulate.tabulate(rows, headers="keys", floatfmt=".4g"))
+    if output:
+        json.dump(rows, output, indent=4)
+
+
+def _read_benchmark_file(path):
+    # Only the results of `benchmark generate` can be stored in columnar
+    # format, the results of `benchmark perf` are always JSON.
+    if Path(path).suffix == ".npz":
+        return read_results(path)
+    with open(path) as f:
+        return json.load(f)
+
+
+@benchmark_group.command("compare")
+@click.argument("baseline_file", type=click.Path(exists=True, dir_okay=False))
+@click.argument("new_file", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "--threshold",
+    default=0.05,
+    show_default=True,
+    help=(
+        "Maximum relative increase of an identification metric (mean, P95 and"
+        " maximum of inputs and resets) before it counts as a regression."
+    ),
+    type=click.FloatRange(min=0),
+)
+@click.option(
+    "--timing-threshold",
+    default=0.25,
+    show_default=True,
+    help=(
+        "Maximum relative increase of a timing or memory metric of `benchmark"
+        " perf` before it counts as a regression."
+    ),
+    type=click.FloatRange(min=0),
+)
+@click.option(
+    "--all",
+    "show_all",
+    is_flag=True,
+    help="Show all compared metrics, not only the regressions.",
+)
+def benchmark_compare_command(
+    baseline_file, new_file, threshold, timing_threshold, show_all
+):
+    """Compare the results of `benchmark generate` or `benchmark perf` with a
+    baseline, exits with status 1 if there are regressions."""
+    try:
+        rows = compare(
+            _read_benchmark_file(baseline_file),
+            _read_benchmark_file(new_file),
+            threshold=threshold,
+            timing_threshold=timing_threshold,
+        )
+    except ValueError as e:
+        raise click.UsageError(str(e)) from e
+
+    regressions = [row for row in rows if row["Regression"]]
+    shown = rows if show_all else regressions
+    if shown:
+        click.echo(tabulate.tabulate(shown, headers="keys", floatfmt=".4g"))
+
+    if regressions:
+        click.echo(f"\n{len(regressions)} regression(s) found", err=True)
+        sys.exit(1)
+    click.echo(f"No regressions in {len(rows)} compared metrics")
+
+
+@main.group("scan")
+@click.pass_context
+def scan_group(ctx):
+    """Scan many targets, spread over workers on one or more hosts."""
+    _profile_subcommand(ctx)
+
+
+@scan_group.command("coordinator", context_settings={"ignore_unknown_options": True})
+@click.argument("queue_file", metavar="QUEUE", type=click.Path(dir_okay=False))
+@click.argument("output", type=click.Path(dir_okay=False, allow_dash=True))
+@click.argument("worker_args", nargs=-1, type=click.UNPROCESSED)
+@click.option(
+    "--targets",
+    "targets_file",
+    help="File with a target per line (HOST or HOST:PORT), added to the queue.",
+    type=click.File("r"),
+)
+@click.option(
+    "--shard-size",
+    default=16,
+    show_default=True,
+    help="Number of targets per shard.",
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--lease-time",
+    default=600.0,
+    show_default=True,
+    help=(
+        "Seconds after which the targets of an unresponsive worker are handed"
+        " out again, this should exceed the deadline of an identification."
+    ),
+    type=click.FloatRange(min=0, min_open=True),
+)
+@click.option("--host", default="localhost", help="Address to listen on.")
+@click.option(
+    "-p", "--port", default=0, help="Port to listen on, by default a free port."
+)
+@click.option(
+    "--workers",
+    default=0,
+    show_default=True,
+    help="Number of local worker processes to start.",
+    type=click.IntRange(min=0),
+)
+@click.option(
+    "--store",
+    "store_file",
+    help=(
+        "SQLite results store (see `tlsprint results`) to write the results to."
+        " Targets with a result in the store are not added to the queue."
+    ),
+    type=click.Path(dir_okay=False),
+)
+@click.option(
+    "--retry-failed",
+    is_flag=True,
+    help="Add targets of which the stored identification failed or timed out.",
+)
+def scan_coordinator_command(
+    queue_file,
+    output,
+    worker_args,
+    targets_file,
+    shard_size,
+    lease_time,
+    host,
+    port,
+    workers,
+    store_file,
+    retry_failed,
+):
+    """Hand out the targets in the QUEUE to workers, and write the results to
+    OUTPUT as JSON lines.
+
+    The QUEUE is an SQLite database, created if it does not exist. It keeps
+    track of the progress, so an interrupted scan continues where it left off
+    when the coordinator is started again, appending to the OUTPUT. Targets
+    that are already in the QUEUE are not added again. Any arguments after
+    `--` are passed to the local workers, for example `-- --deadline 300`.
+    """
+    output, output_results = _open_output(output, os.path.exists(queue_file))
+    queue = ScanQueue(queue_file, lease_time)
+    store = ResultStore(store_file) if store_file else None
+    if targets_file:
+        targets = [parse_target(line) for line in targets_file if line.strip()]
+        if store is not None:
+            targets = store.remaining(targets, retry_failed)
+        queue.add(targets, shard_size)
+
+    coordinator = ScanCoordinator(queue, output, store, output_results)
+
+    async def serve():
+        server = await coordinator.start(host, port)
+        listen_port = server.sockets[0].getsockname()[1]
+        click.echo(f"Listening on {host}:{listen_port}", err=True)
+
+        processes = [
+            await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-m",
+                "tlsprint",
+                "scan",
+                "worker",
+                f"{host}:{listen_port}",
+                "--name",
+                f"local-{i}",
+                *worker_args,
+            )
+            for i in range(workers)
+        ]
+        async with server:
+            await coordinator.wait_finished()
+            # The local workers stop when they see the scan is finished
+            for process in processes:
+                await process.wait()
+
+    asyncio.run(serve())
+    counts = queue.counts()
+    queue.close()
+    if store is not None:
+        store.close()
+    if output is not sys.stdout:
+        output.close()
+    click.echo(f"Scanned {counts['done']} targets", err=True)
+
+
+def _open_output(path, resume):
+    """Open the output of the coordinator, and return it with the number of
+    results it holds. When resuming a scan, the results written by the
+    earlier run are kept, except for a partly written last line."""
+    if path == "-":
+        return sys.stdout, 0
+    if not resume or not os.path.exists(path):
+        return open(path, "w"), 0
+
+    results = 0
+    complete = 0
+    with open(path, "rb+") as f:
+        for line in f:
+            if line.endswith(b"\n"):
+                results += 1
+                complete += len(line)
+        f.truncate(complete)
+    return open(path, "a"), results
+
+
+@scan_group.command("worker")
+@click.argument("coordinator_address", metavar="COORDINATOR")
+@click.option(
+    "--name",
+    help="Unique name of this worker, by default the hostname and process ID.",
+)
+@click.option(
+    "--tree",
+    help="Custom tree to use (output from `learn`), instead of the included trees.",
+    type=click.File("rb"),
+)
+@click.option(
+    "--probe/--no-probe",
+    "probe_target",
+    default=True,
+    show_default=True,
+    help=(
+        "Probe the TLS versions supported by every target to select the tree."
+        " Without probing, TLS 1.2 is used."
+    ),
+)
+@click.option(
+    "--connector",
+    "connector_address",
+    help=(
+        "Use an already running connector listening on HOST:PORT (for example"
+        " `tlsprint simulate`), instead of starting TLSAttackerConnector."
+    ),
+)
+@click.option(
+    "--timeout",
+    type=float,
+    help="Maximum number of seconds to wait for a single response.",
+)
+@click.option(
+    "--deadline",
+    type=float,
+    help="Maximum number of seconds for the identification of a target.",
+)
+@click.option(
+    "--transcript",
+    "record_transcript",
+    is_flag=True,
+    help="Include the inputs sent and the outputs received in the results.",
+)
+def scan_worker_command(
+    coordinator_address,
+    name,
+    tree,
+    probe_target,
+    connector_address,
+    timeout,
+    deadline,
+    record_transcript,
+):
+    """Identify the targets handed out by the COORDINATOR (HOST:PORT), until
+    the scan is finished."""
+    if tree:
+        tree = pickle.load(tree)
+    if connector_address:
+        host, port = connector_address.rsplit(":", maxsplit=1)
+        connector_address = (host, int(port))
+
+    identify_function = identifier(
+        tree,
+        # A running connector might not talk to the target itself
+        probe_target and not connector_address,
+        connector_address=connector_address,
+        timeout=timeout,
+        deadline=deadline,
+        record_transcript=record_transcript,
+    )
+
+    host, port = coordinator_address.rsplit(":", maxsplit=1)
+    client = ScanClient((host, int(port)))
+    name = name or f"{socket.gethostname()}-{os.getpid()}"
+    try:
+        identified = run_worker(client, name, identify_function)
+    except ConnectionError as e:
+        click.echo(f"Lost the connection to the coordinator: {e}", err=True)
+        sys.exit(1)
+    finally:
+        client.close()
+    click.echo(f"Worker {name} identified {identified} targets", err=True)
+
+
+@main.group("results")
+@click.pass_context
+def results_group(ctx):
+    """Query and import the results of scans, stored in an SQLite results
+    store."""
+    _profile_subcommand(ctx)
+
+
+@results_group.command("query")
+@click.argument("store_file", metavar="STORE", type=click.Path(exists=True))
+@click.option("--target", help="Only results of this host, on any port.")
+@click.option("--model", help="Only results identified as this model.")
+@click.option(
+    "--tls-version",
+    type=click.Choice(sorted(probe.VERSIONS)),
+    help=(
+        "Only results of this TLS version. The models are numbered per TLS"
+        " version, so use this with --model to select a single model."
+    ),
+)
+@click.option(
+    "--candidates",
+    is_flag=True,
+    help="With --model, include results that have the model as a candidate.",
+)
+@click.option("--status", help="Only results with this status.")
+@click.option(
+    "--hosts",
+    "hosts_only",
+    is_flag=True,
+    help="Only print the targets (HOST:PORT) instead of the results.",
+)
+def results_query_command(
+    store_file, target, model, tls_version, candidates, status, hosts_only
+):
+    """Print the results in the STORE as JSON lines."""
+    with ResultStore(store_file) as store:
+        if hosts_only and model and not (target or status):
+            # Only reads the index of the models
+            for host, port in store.hosts(model, tls_version, candidates):
+                click.echo(f"{host}:{port}")
+            return
+
+        for result in store.query(target, model, tls_version, status, candidates):
+            if hosts_only:
+                click.echo(f"{result['target']}:{result['port']}")
+            else:
+                click.echo(json.dumps(result))
+
+
+@results_group.command("import")
+@click.argument("store_file", metavar="STORE", type=click.Path(dir_okay=False))
+@click.argument("results_file", metavar="RESULTS", type=click.File("r"))
+def results_import_command(store_file, results_file):
+    """Add the RESULTS, JSON lines as written by `scan coordinator`, to the
+    STORE, which is created if it does not exist."""
+    with ResultStore(store_file) as store:
+        for line in results_file:
+            if line.strip():
+                store.write(json.loads(line))
+        store.flush()
+        click.echo(f"The store holds {len(store)} results", err=True)
+
+
+@main.command("serve")
+@click.option(
+    "--host", default="localhost", show_default=True, help="Address to listen on."
+)
+@click.option(
+    "-p", "--port", default=8443, show_default=True, help="Port to listen on."
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    help="Listen on this Unix socket instead of TCP.",
+    type=click.Path(dir_okay=False),
+)
+@click.option(
+    "--concurrency",
+    default=4,
+    show_default=True,
+    help="Maximum number of identifications (connectors) running at the same time.",
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--tree",
+    help="Custom tree to use (output from `learn`), instead of the included trees.",
+    type=click.File("rb"),
+)
+@click.option(
+    "--probe/--no-probe",
+    "probe_target",
+    default=True,
+    show_default=True,
+    help=(
+        "Probe the TLS versions supported by every target to select the tree."
+        " Without probing, TLS 1.2 is used."
+    ),
+)
+@click.option(
+    "--connector",
+    "connector_address",
+    help=(
+        "Use an already running connector listening on HOST:PORT (for example"
+        " `tlsprint simulate`), instead of starting TLSAttackerConnector."
+    ),
+)
+@click.option(
+    "--timeout",
+    type=float,
+    help="Maximum number of seconds to wait for a single response.",
+)
+@click.option(
+    "--deadline",
+    type=float,
+    help="Maximum number of seconds for the identification of a target.",
+)
+@click.option(
+    "--stop-at-confidence",
+    "confidence",
+    help="Stop every identification at this confidence, see `identify`.",
+    type=click.FloatRange(min=0, max=1, min_open=True),
+)
+@click.option(
+    "--weights",
+    "weight",
+    default="usage",
+    show_default=True,
+    help="Weight of the models, used to select inputs and by --stop-at-confidence.",
+    type=click.Choice(sorted(MODEL_WEIGHTS)),
+)
+def serve_command(
+    host,
+    port,
+    socket_path,
+    concurrency,
+    tree,
+    probe_target,
+    connector_address,
+    timeout,
+    deadline,
+    confidence,
+    weight,
+):
+    """Keep the trees loaded and identify the targets submitted over HTTP, see
+    the README for the API."""
+    # Load the included trees before accepting requests
+    from . import trees  # noqa: F401
+
+    if tree:
+        tree = pickle.load(tree)
+    if connector_address:
+        connector_host, connector_port = connector_address.rsplit(":", maxsplit=1)
+        connector_address = (connector_host, int(connector_port))
+
+    server = IdentifyServer(
+        identifier(
+            tree,
+            # A running connector might not talk to the target itself
+            probe_target and not connector_address,
+            connector_address=connector_address,
+            timeout=timeout,
+            deadline=deadline,
+            confidence=confidence,
+            weight_function=MODEL_WEIGHTS[weight],
+        ),
+        concurrency,
+    )
+
+    async def serve():
+        if socket_path:
+            listener = await server.start_unix(socket_path)
+            click.echo(f"Listening on {socket_path}", err=True)
+        else:
+            listener = await server.start(host, port)
+            listen_port = listener.sockets[0].getsockname()[1]
+            click.echo(f"Listening on http://{host}:{listen_port}", err=True)
+        async with listener:
+            await listener.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
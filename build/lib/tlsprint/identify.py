@@ -0,0 +1,1397 @@
+"""Identification components, to be used after learning the model tree."""
+
+import abc
+import asyncio
+import math
+import operator
+import os
+import pathlib
+import random
+import select
+import socket
+import subprocess
+import time
+from distutils.version import LooseVersion
+
+import networkx
+import pkg_resources
+
+from . import instrument
+
+
+def _tree_weight(tree, model_mapping, weight_function):
+    return sum([weight_function(model_mapping[model]) for model in tree.models])
+
+
+def _subtree_models(tree):
+    """Return the models in the subtree of every node, collected in a single
+    pass from the leaves up to the root."""
+    subtree_models = {}
+    for node in reversed(list(networkx.topological_sort(tree))):
+        children = list(tree[node])
+        if children:
+            subtree_models[node] = set().union(
+                *(subtree_models[child] for child in children)
+            )
+        else:
+            subtree_models[node] = set(tree.nodes[node].get("models", ()))
+    return subtree_models
+
+
+def equal_model_weight(_):
+    return 1
+
+
+def implementation_count_model_weight(implementations):
+    return len(implementations)
+
+
+def recent_implementation_model_weight(implementations):
+    return sum([implementation_usage_weight(x) for x in implementations])
+
+
+def implementation_usage_weight(implementation):
+    """This is an example usage weight for an implementation, it does not
+    reflect real world usage."""
+    weight = 1
+    name, number = implementation
+    version = LooseVersion(number)
+
+    if "openssl" in name:
+        weight *= 5
+        if version >= LooseVersion("1.1"):
+            weight *= 5
+        elif version >= LooseVersion("1.0"):
+            weight *= 2
+
+    elif "mbedtls" in name:
+        if version >= LooseVersion("2.7"):
+            weight *= 5
+        elif version >= LooseVersion("2.0"):
+            weight *= 2
+
+    return weight
+
+
+MODEL_WEIGHTS = {
+    "equal": equal_model_weight,
+    "count": implementation_count_model_weight,
+    "usage": recent_implementation_model_weight,
+}
+
+
+def random_selector(tree, current_node, weight_function):
+    return random.choice(list(tree[current_node]))
+
+
+def always_first_selector(tree, current_node, weight_function):
+    return list(tree[current_node])[0]
+
+
+def gini_selector(tree, current_node, weight_function):
+    """Use the Gini Impurity to compute with inputs leads to the most
+    distinguishing outputs.
+    More information here: https://en.wikipedia.org/wiki/Decision_tree_learning#Metrics
+    """
+    total_weight = _tree_weight(
+        tree.subtree(current_node), tree.model_mapping, weight_function
+    )
+    input_info = [{"node": node} for node in tree[current_node]]
+    for info in input_info:
+        output_nodes = list(tree[info["node"]])
+        weights = [
+            _tree_weight(tree.subtree(output_node), tree.model_mapping, weight_function)
+            for output_node in output_nodes
+        ]
+        info["metric"] = 1 - sum([(x / total_weight) ** 2 for x in weights])
+
+    return max(input_info, key=operator.itemgetter("metric"))["node"]
+
+
+def entropy_selector(tree, current_node, weight_function):
+    """Use the Information Gain, based on entropy, to compute with inputs leads
+    to the most distinguishing outputs.
+    More information here: https://en.wikipedia.org/wiki/Decision_tree_learning#Metrics
+    """
+    total_weight = _tree_weight(
+        tree.subtree(current_node), tree.model_mapping, weight_function
+    )
+    input_info = [{"node": node} for node in tree[current_node]]
+    for info in input_info:
+        output_nodes = list(tree[info["node"]])
+        weights = [
+            _tree_weight(tree.subtree(output_node), tree.model_mapping, weight_function)
+            for output_node in output_nodes
+        ]
+        info["metric"] = -1 * sum(
+            [(x / total_weight) * math.log(x / total_weight) for x in weights]
+        )
+
+    return max(input_info, key=operator.itemgetter("metric"))["node"]
+
+
+INPUT_SELECTORS = {
+    "random": random_selector,
+    "first": always_first_selector,
+    "gini": gini_selector,
+    # The entropy selector yields the same decision results as the gini
+    # selector, but is more expensive to compute (due to the log). It is
+    # therefore included as a reference, but not enabled by default.
+    # "entropy": entropy_selector,
+}
+
+
+class AbastractConnector(abc.ABC):
+    def close(self):
+        pass
+
+    @abc.abstractmethod
+    def send(self, message):
+        pass
+
+    def send_sequence(self, messages):
+        """Send a sequence of messages and return the list of responses.
+        Connectors that support pipelining can override this to reduce the
+        number of round trips."""
+        return [self.send(message) for message in messages]
+
+    def replay(self, messages):
+        """Reset the connection and send a sequence of messages, returning the
+        responses."""
+        self.reset()
+        return self.send_sequence(messages)
+
+    def descent(self, tree, selector, weight_function, graph_dir=None):
+        """Descent the tree until a leaf node is reached."""
+        return self.run(_descent(tree, selector, weight_function))
+
+    def speculative_descent(self, tree, selector, weight_function, graph_dir=None):
+        """Descent the tree until a leaf node is reached, sending the inputs in
+        batches. See `_speculative_descent` for details."""
+        return self.run(_speculative_descent(tree, selector, weight_function))
+
+    def run(self, steps):
+        """Perform the requests of an identification generator (such as
+        `_descent`) and return its result."""
+        try:
+            reset, messages = next(steps)
+            while True:
+                if reset:
+                    responses = self.replay(messages)
+                else:
+                    responses = self.send_sequence(messages)
+                reset, messages = steps.send(responses)
+        except StopIteration as stop:
+            return stop.value
+
+
+def _deadline(timeout):
+    """Return the `time.monotonic` deadline for a timeout in seconds, or None
+    if there is no timeout."""
+    return time.monotonic() + timeout if timeout else None
+
+
+def _earliest(*deadlines):
+    """Return the earliest of the deadlines that are set, or None."""
+    deadlines = [deadline for deadline in deadlines if deadline]
+    return min(deadlines) if deadlines else None
+
+
+def _remaining(deadline):
+    """Return the number of seconds left until the deadline, or None if there
+    is no deadline. Raises `socket.timeout` if the deadline has passed."""
+    if deadline is None:
+        return None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise socket.timeout("Deadline expired")
+    return remaining
+
+
+def _backoff_delays(retries, backoff, deadline):
+    """Yield the delays before each retry, doubling every time. Stops early
+    when the deadline would be exceeded."""
+    for attempt in range(retries):
+        delay = backoff * 2**attempt
+        if deadline and time.monotonic() + delay >= deadline:
+            return
+        yield delay
+
+
+def _retry(function, retries, backoff, deadline):
+    """Call the function, retrying on connection errors."""
+    for delay in _backoff_delays(retries, backoff, deadline):
+        try:
+            return function()
+        except socket.timeout:
+            raise
+        except OSError:
+            time.sleep(delay)
+    return function()
+
+
+async def _retry_async(function, retries, backoff, deadline):
+    """Await the coroutine function, retrying on connection errors."""
+    for delay in _backoff_delays(retries, backoff, deadline):
+        try:
+            return await function()
+        except (socket.timeout, asyncio.TimeoutError):
+            raise
+        except OSError:
+            await asyncio.sleep(delay)
+    return await function()
+
+
+def _connector_command(target, target_port, listen_port=None, protocol_version=None):
+    """Return the command to start TLSAttackerConnector for the target. The
+    connector listens on port 6666, unless a `listen_port` is given. The
+    connector uses TLS 1.2, unless a `protocol_version` (for example "TLS10")
+    is given."""
+    connector_path = pkg_resources.resource_filename(
+        __name__, os.path.join("connector", "TLSAttackerConnector2.0.jar")
+    )
+    messages_path = pkg_resources.resource_filename(
+        __name__, os.path.join("connector", "messages")
+    )
+
+    command = [
+        "java",
+        "-jar",
+        connector_path,
+        "--targetHost",
+        target,
+        "--targetPort",
+        str(target_port),
+        "--messageDir",
+        messages_path,
+        "--merge-application",
+    ]
+    if listen_port:
+        command += ["--listen", str(listen_port)]
+    if protocol_version:
+        command += ["--protocolVersion", protocol_version]
+
+    return command
+
+
+class TLSAttackerConnector(AbastractConnector):
+    def __init__(
+        self,
+        target,
+        target_port=443,
+        connector_address=None,
+        timeout=None,
+        deadline=None,
+        retries=3,
+        backoff=0.5,
+        protocol_version=None,
+    ):
+        """Start TLSAttackerConnector. Returns a handler to both the process and
+        the socket.
+
+        If a `connector_address` (host and port) is given, no process is
+        started. Instead, the socket connects to the connector already
+        listening on this address, for example `tlsprint simulate`.
+
+        The `timeout` is the maximum number of seconds to wait for the
+        response to a single message. The `deadline` is the `time.monotonic`
+        value at which all work for this target (starting the connector,
+        connecting to it and every message) should be finished.
+        `socket.timeout` is raised when either of these expires. By default,
+        there is no timeout or deadline.
+
+        Failing connections to the connector are retried `retries` times,
+        with an exponential backoff starting at `backoff` seconds.
+
+        The `protocol_version` (for example "TLS10") is the TLS version used
+        by a started connector, by default TLS 1.2.
+        """
+        self.timeout = timeout
+        self.deadline = deadline
+        self.process = None
+        self.socket = None
+        self._buffer = b""
+
+        try:
+            if connector_address is None:
+                # Listen on a free port, so multiple connectors (for example
+                # one per TLS version) can run at the same time.
+                listen_port = _free_port()
+                self.process = self._start_process(
+                    target, target_port, deadline, protocol_version, listen_port
+                )
+                connector_address = ("localhost", listen_port)
+
+            # Connect to the connector socket
+            with instrument.timer("connector.connect"):
+                self.socket = _retry(
+                    lambda: socket.create_connection(
+                        connector_address, timeout=_remaining(deadline)
+                    ),
+                    retries,
+                    backoff,
+                    deadline,
+                )
+        except BaseException:
+            # Do not leave the process running if the connector is unusable
+            self.close()
+            raise
+
+    @staticmethod
+    @instrument.timed("connector.start")
+    def _start_process(
+        target, target_port, deadline=None, protocol_version=None, listen_port=None
+    ):
+        process = subprocess.Popen(
+            _connector_command(target, target_port, listen_port, protocol_version),
+            stdout=subprocess.PIPE,
+        )
+
+        # Wait until the first line to stdout is written, this means the connector
+        # is initialized.
+        ready, _, _ = select.select([process.stdout], [], [], _remaining(deadline))
+        if not ready:
+            process.terminate()
+            raise socket.timeout("Timed out waiting for the connector to start")
+        process.stdout.readline()
+
+        return process
+
+    def close(self):
+        if self.socket:
+            self.socket.close()
+        if self.process:
+            self.process.terminate()
+            self.process.wait()
+
+    def send(self, message):
+        """Send the message to TLSAttackerConnector and return the result.
+
+        This function does a few things:
+            - Append a newline to the message
+            - Encode the message
+            - Read the response up to the next newline
+            - Decodes the resulting response
+            - Strips the response of the trailing newline
+        """
+        return self.send_sequence([message])[0]
+
+    def send_sequence(self, messages):
+        """Send all messages in a single write and read the responses as they
+        arrive. This pipelines the messages, so a known input sequence only
+        costs a single round trip."""
+        instrument.count("connector.messages", len(messages))
+        with instrument.timer("connector.round_trip"):
+            self.socket.sendall(
+                "".join(message + "\n" for message in messages).encode()
+            )
+            return [self._readline() for _ in messages]
+
+    def replay(self, messages):
+        """Reset the connection and send the messages, pipelined with the
+        reset itself."""
+        return self.send_sequence(["RESET"] + messages)[1:]
+
+    def _readline(self):
+        """Read a single response line from the socket. Data received after
+        the newline is buffered for the next response."""
+        deadline = _earliest(self.deadline, _deadline(self.timeout))
+        while b"\n" not in self._buffer:
+            self.socket.settimeout(_remaining(deadline))
+            data = self.socket.recv(4096)
+            if not data:
+                raise ConnectionError("Connector closed the connection")
+            self._buffer += data
+
+        line, self._buffer = self._buffer.split(b"\n", maxsplit=1)
+        return line.decode().strip()
+
+    def reset(self):
+        self.send("RESET")
+
+
+class AsyncConnector(abc.ABC):
+    """Asynchronous counterpart of `AbastractConnector`, all I/O is
+    performed by coroutines."""
+
+    async def close(self):
+        pass
+
+    @abc.abstractmethod
+    async def send(self, message):
+        pass
+
+    async def send_sequence(self, messages):
+        """Send a sequence of messages and return the list of responses."""
+        return [await self.send(message) for message in messages]
+
+    async def reset(self):
+        await self.send("RESET")
+
+    async def replay(self, messages):
+        """Reset the connection and send a sequence of messages, returning the
+        responses."""
+        await self.reset()
+        return await self.send_sequence(messages)
+
+    async def descent(self, tree, selector, weight_function, graph_dir=None):
+        """Descent the tree until a leaf node is reached."""
+        return await self.run(_descent(tree, selector, weight_function))
+
+    async def speculative_descent(
+        self, tree, selector, weight_function, graph_dir=None
+    ):
+        """Descent the tree until a leaf node is reached, sending the inputs in
+        batches. See `_speculative_descent` for details."""
+        return await self.run(_speculative_descent(tree, selector, weight_function))
+
+    async def run(self, steps):
+        """Perform the requests of an identification generator (such as
+        `_descent`) and return its result."""
+        try:
+            reset, messages = next(steps)
+            while True:
+                if reset:
+                    responses = await self.replay(messages)
+                else:
+                    responses = await self.send_sequence(messages)
+                reset, messages = steps.send(responses)
+        except StopIteration as stop:
+            return stop.value
+
+
+class AsyncTLSAttackerConnector(AsyncConnector):
+    def __init__(self, reader, writer, process=None, timeout=None, deadline=None):
+        """Use `start` to create the connector, this wraps the streams of an
+        established connection."""
+        self.reader = reader
+        self.writer = writer
+        self.process = process
+        self.timeout = timeout
+        self.deadline = deadline
+
+    @classmethod
+    async def start(
+        cls,
+        target,
+        target_port=443,
+        connector_address=None,
+        timeout=None,
+        deadline=None,
+        retries=3,
+        backoff=0.5,
+        protocol_version=None,
+    ):
+        """Start TLSAttackerConnector and connect to it, see
+        `TLSAttackerConnector` for the arguments.
+
+        Every started connector listens on its own free port, so many of them
+        can run at the same time.
+        """
+        process = None
+        try:
+            if connector_address is None:
+                listen_port = _free_port()
+                process = await asyncio.create_subprocess_exec(
+                    *_connector_command(
+                        target, target_port, listen_port, protocol_version
+                    ),
+                    stdout=subprocess.PIPE,
+                )
+
+                # Wait until the first line to stdout is written, this means
+                # the connector is initialized.
+                await asyncio.wait_for(process.stdout.readline(), _remaining(deadline))
+                connector_address = ("localhost", listen_port)
+
+            reader, writer = await _retry_async(
+                lambda: asyncio.wait_for(
+                    asyncio.open_connection(*connector_address), _remaining(deadline)
+                ),
+                retries,
+                backoff,
+                deadline,
+            )
+        except BaseException:
+            # Do not leave the process running if the connector is unusable,
+            # this includes cancellation.
+            if process:
+                process.terminate()
+                await process.wait()
+            raise
+
+        return cls(reader, writer, process, timeout, deadline)
+
+    async def close(self):
+        self.writer.close()
+        if self.process:
+            self.process.terminate()
+            await self.process.wait()
+
+    async def send(self, message):
+        """Send the message to TLSAttackerConnector and return the result."""
+        return (await self.send_sequence([message]))[0]
+
+    async def send_sequence(self, messages):
+        """Send all messages in a single write and read the responses as they
+        arrive."""
+        instrument.count("connector.messages", len(messages))
+        with instrument.timer("connector.round_trip"):
+            self.writer.write("".join(message + "\n" for message in messages).encode())
+            await self.writer.drain()
+            return [await self._readline() for _ in messages]
+
+    async def _readline(self):
+        deadline = _earliest(self.deadline, _deadline(self.timeout))
+        line = await asyncio.wait_for(self.reader.readline(), _remaining(deadline))
+        if not line:
+            raise ConnectionError("Connector closed the connection")
+        return line.decode().strip()
+
+    async def replay(self, messages):
+        """Reset the connection and send the messages, pipelined with the
+        reset itself."""
+        return (await self.send_sequence(["RESET"] + messages))[1:]
+
+
+def _free_port():
+    """Return a TCP port on localhost that is currently not in use."""
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+class ResponseIndex:
+    def __init__(self, tree):
+        """Index of the tree, to simulate the models with a
+        `BenchmarkConnector` without walking the tree:
+
+            -   children: Maps every (node, message) pair to the child
+                reached by the message.
+            -   responses: Maps every (input node, model) pair to the
+                response that model gives to this input.
+
+        The index is computed in a single bottom-up pass over the tree, which
+        makes it cheap to build once and share between many benchmark runs on
+        (copies of) the same tree, as copies keep the node ids.
+        """
+        subtree_models = _subtree_models(tree)
+
+        self.children = {}
+        for node, child in tree.edges:
+            self.children[node, tree.label(child)] = child
+
+        # Input nodes are at an odd depth in the tree, their children are the
+        # possible responses.
+        self.responses = {}
+        depths = networkx.shortest_path_length(tree, tree.root) if len(tree) else {}
+        for node, depth in depths.items():
+            if depth % 2 == 0:
+                continue
+            for response_node in tree[node]:
+                response = tree.label(response_node)
+                for model in subtree_models[response_node]:
+                    self.responses.setdefault((node, model), response)
+
+
+class BenchmarkConnector(AbastractConnector):
+    def __init__(self, target, tree, index=None):
+        """Simulate a target using the model tree itself. A precomputed
+        `ResponseIndex` of the tree can be passed to avoid rebuilding it for
+        every target."""
+        self.target = target
+        self.tree = tree
+        self.index = index if index is not None else ResponseIndex(tree)
+
+        # Initialize a list to keep track of the messages send and received
+        self.messages = []
+        self.current_node = tree.root
+
+    def send(self, message):
+        self.messages.append(message)
+        self.current_node = self.index.children.get((self.current_node, message))
+
+        output = self.index.responses.get((self.current_node, self.target))
+        if output is not None:
+            self.messages.append(output)
+            self.current_node = self.index.children[self.current_node, output]
+        return output
+
+    def reset(self):
+        self.messages += ["RESET", ""]
+        self.current_node = self.tree.root
+
+
+def _color_path(tree, endpoint, color):
+    """Color the nodes and edges in the tree, from the root of the up to the
+    given node.
+
+    Args:
+        tree: Tree that in which the path will be colored.
+        endpoint: Node that indicates the end of the path to be colored.
+        color: Color to give to the path. If color is False, the color
+                attribute will be removed from the path instead.
+    """
+    # Create a list of all nodes and all edges to be colored.
+    node_names = tree.path_nodes(endpoint)
+    edge_names = tuple(zip(node_names, node_names[1:]))
+
+    nodes = [tree.nodes[name] for name in node_names]
+    edges = [tree.edges[name] for name in edge_names]
+
+    for target in nodes + edges:
+        if color:
+            # If the color is set, we apply this to the target node or edge
+            target["color"] = color
+        else:
+            # If the color is not set, we remove the color attribute
+            try:
+                del target["color"]
+            except KeyError:
+                pass
+
+
+def _descent(tree, selector, weight_function, stop=None):
+    """Descent the tree until a leaf node is reached.
+
+    This, and the other identification generators, contain the logic of the
+    identification without performing any I/O. They yield requests in the
+    form `(reset, messages)`, to which the driver (`AbastractConnector.run`
+    or `AsyncConnector.run`) replies with the list of responses. If `reset`
+    is True, the connection is reset before sending the messages. The
+    generator returns the result of the identification step.
+
+    If `stop` is given, it is called with the models below every response
+    node. The descent ends at this node if it returns True.
+    """
+    # Start at the root of the tree
+    current_node = tree.root
+
+    leaves = tree.leaves
+    descending = True
+    while descending:
+        # Pick a random node (message to send)
+        send_node = selector(tree, current_node, weight_function)
+
+        # Send this message and read the response
+        (response,) = yield False, [tree.label(send_node)]
+
+        # Check if this leads to an existing node, and if this node is a
+        # leaf node.
+        response_node = tree.child(send_node, response)
+        if response_node is None:
+            print("No model with this path:")
+            print(tree.path(send_node) + (response,))
+            return
+
+        if response_node in leaves:
+            descending = False
+        elif stop and stop(tree.subtree(response_node).models):
+            return response_node
+        else:
+            current_node = response_node
+
+    return response_node
+
+
+def _speculative_descent(tree, selector, weight_function, stop=None):
+    """Descent the tree until a leaf node is reached, sending the inputs in
+    batches.
+
+    Starting at the current node, the inputs along the path of the most
+    likely responses are predicted and sent as a single sequence. The
+    responses are followed until the first unexpected one, after which the
+    connection is reset and the path up to this point is replayed, together
+    with the next predicted sequence. When the predictions are right, this
+    reaches a leaf in a single round trip.
+    """
+    leaves = set(tree.leaves)
+    subtree_models = _subtree_models(tree)
+
+    def node_weight(node):
+        return sum(
+            weight_function(tree.model_mapping[model]) for model in subtree_models[node]
+        )
+
+    current_node = tree.root
+    while True:
+        # Predict the path from the current node to a leaf, following the
+        # response with the highest weight.
+        inputs = []
+        expected = []
+        node = current_node
+        while node not in leaves:
+            send_node = selector(tree, node, weight_function)
+            node = max(tree[send_node], key=node_weight)
+            inputs.append(tree.label(send_node))
+            expected.append(tree.label(node))
+
+        # The current node is reached by replaying its inputs, the responses
+        # are known.
+        path = tree.path(current_node)
+        inputs = list(path[0::2]) + inputs
+        expected = list(path[1::2]) + expected
+        responses = yield current_node != tree.root, inputs
+
+        # Follow the responses until a leaf or the first unexpected response.
+        node = tree.root
+        for message, response, prediction in zip(inputs, responses, expected):
+            next_node = tree.find((message, response), node)
+            if next_node is None:
+                print("No model with this path:")
+                print(tree.path(node) + (message, response))
+                return
+            node = next_node
+            if node in leaves:
+                return node
+            if stop and stop(subtree_models[node]):
+                return node
+            if response != prediction:
+                break
+        current_node = node
+
+
+def _write_snapshot(tree, path):
+    """Write the DOT source of the tree to the path. Rendering the graph with
+    Graphviz is slow, so this is left to `learn.render_dot_files`."""
+    with open(path, "w") as f:
+        f.write(tree.to_dot())
+
+
+def candidate_weights(tree, models, weight_function):
+    """Return a dictionary mapping every model to its share of the total
+    weight of the models."""
+    weights = {model: weight_function(tree.model_mapping[model]) for model in models}
+    total_weight = sum(weights.values())
+    if not total_weight:
+        return {}
+    return {model: weight / total_weight for model, weight in weights.items()}
+
+
+def _leading_model(tree, models, weight_function, confidence):
+    """Return the model with the largest share of the weight of the models,
+    if this share is at least `confidence`. Returns None otherwise."""
+    shares = candidate_weights(tree, models, weight_function)
+    if shares:
+        model = max(sorted(shares), key=shares.get)
+        if shares[model] >= confidence:
+            return model
+    return None
+
+
+def _identification(
+    tree, selector, weight_function, graph_dir, speculative, confidence=None
+):
+    """Identify the target by repeatedly descending the tree and pruning it,
+    until a single leaf remains. Returns the models in this leaf, or None if
+    the target does not match any model. See `_descent` for the protocol of
+    this generator.
+
+    If a `confidence` is given, the identification stops as soon as a single
+    model holds at least this share of the weight of the remaining models,
+    and returns a set with only this model. The tree is then left with the
+    remaining models, see `candidate_weights`."""
+    # Create output directory if required
+    if graph_dir:
+        graph_dir = pathlib.Path(graph_dir)
+        graph_dir.mkdir(exist_ok=True)
+
+    descent = _speculative_descent if speculative else _descent
+
+    stop = _confidence_stop(tree, weight_function, confidence)
+    # No inputs are needed if the tree is dominated by a single model
+    if stop and stop(tree.models):
+        return {_leading_model(tree, tree.models, weight_function, confidence)}
+
+    identifing = True
+    iteration = 1
+    while identifing:
+
+        # Descent to a leaf node
+        instrument.count("identify.descents")
+        leaf_node = yield from descent(tree, selector, weight_function, stop)
+
+        # If the descent does not return a leaf node, there is no model
+        # matched.
+        if not leaf_node:
+            return
+
+        leaf_models = _prune_to_node(tree, leaf_node, graph_dir, iteration)
+
+        if stop and stop(leaf_models):
+            return {_leading_model(tree, leaf_models, weight_function, confidence)}
+
+        # Condense the tree
+        tree.condense()
+
+        # If the tree is empty after condensing, the result was one of the
+        # models in the last leaf node. This can be more then one model, as
+        # some might not be distinguishable.
+        if len(tree) == 0:
+            # The generator returns the result to the driver, which is
+            # intended.
+            return leaf_models  # noqa: B901
+
+        if graph_dir:
+            _write_snapshot(
+                tree, graph_dir / "iteration-{}.3-condensed.dot".format(iteration)
+            )
+
+        iteration += 1
+
+        # Reset the connector
+        yield True, []
+
+
+def _recorded(steps, transcript):
+    """Pass the requests of an identification generator through, appending
+    every step to the `transcript` as a list [reset, inputs, outputs,
+    seconds], where seconds is the time the connector took. The result of
+    the generator is returned unchanged."""
+    responses = None
+    while True:
+        try:
+            reset, messages = steps.send(responses)
+        except StopIteration as stop:
+            return stop.value
+        start = time.monotonic()
+        responses = yield reset, messages
+        transcript.append(
+            [reset, list(messages), list(responses), time.monotonic() - start]
+        )
+
+
+def _confidence_stop(tree, weight_function, confidence):
+    """Return the `stop` function of the descents for the confidence, or None
+    if no confidence is given."""
+    if confidence is None:
+        return None
+
+    def stop(models):
+        return _leading_model(tree, models, weight_function, confidence) is not None
+
+    return stop
+
+
+def _prune_to_node(tree, node, graph_dir, iteration):
+    """Prune the models that are not below the node reached by a descent,
+    usually a leaf, and return the remaining models. Snapshots before and
+    after pruning are written to the `graph_dir` if given."""
+    if graph_dir:
+        # Color the path leading to the final response node.
+        _color_path(tree, node, "red")
+        _write_snapshot(
+            tree, graph_dir / "iteration-{}.1-pre-prune.dot".format(iteration)
+        )
+
+    models = tree.subtree(node).models
+    tree.prune_models(tree.models - models)
+
+    if graph_dir:
+        _write_snapshot(
+            tree, graph_dir / "iteration-{}.2-post-prune.dot".format(iteration)
+        )
+        # Clear the path color after drawing this graph
+        _color_path(tree, node, False)
+
+    return models
+
+
+def _implementations(tree, models):
+    """Return the union of the implementations of the models."""
+    return set().union(*(tree.model_mapping[model] for model in models))
+
+
+class _VersionState:
+    """State of a single tree during `_joint_identification`."""
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.current_node = tree.root
+        self.reset = False
+        self.update()
+
+    def update(self):
+        """Recompute the implementations in the subtree of every node, after
+        the tree has been pruned."""
+        subtree_models = _subtree_models(self.tree)
+        self.subtree_implementations = {
+            node: _implementations(self.tree, models)
+            for node, models in subtree_models.items()
+        }
+
+
+def _expected_elimination(parts, weight):
+    """Expected weight of the candidates that are eliminated, when the
+    candidates end up in one of the parts. The probability of every part is
+    proportional to its weight."""
+    weights = [sum(map(weight, part)) for part in parts]
+    total_weight = sum(weights)
+    if not total_weight:
+        return 0
+    return sum(
+        (x / total_weight) * (total_weight - x) for x in weights if x != total_weight
+    )
+
+
+def _input_metrics(state, candidates, weight):
+    """Yield every input at the current node of the tree, together with the
+    expected elimination of the response to the input and of the leaf below
+    the input, see `_joint_identification`."""
+    tree = state.tree
+    for input_node in tree[state.current_node]:
+        responses = [
+            candidates & state.subtree_implementations[response_node]
+            for response_node in tree[input_node]
+        ]
+        leaves = [
+            candidates & _implementations(tree, tree.nodes[node]["models"])
+            for node in networkx.descendants(tree, input_node)
+            if tree.out_degree(node) == 0
+        ]
+        yield input_node, (
+            _expected_elimination(responses, weight),
+            _expected_elimination(leaves, weight),
+        )
+
+
+def _joint_identification(trees, weight_function):
+    """Identify the target using the trees of multiple TLS versions together.
+
+    Instead of a set of models, a set of candidate implementations is
+    narrowed down. The trees only contain the implementations supporting
+    their TLS version, so the trees should be those of the versions supported
+    by the target, and the candidates start as the implementations present in
+    all of them. For every input, in the current node of every tree, the
+    expected weight of the candidates eliminated by the response is computed.
+    The input with the highest expectation is sent, and the candidates are
+    restricted to the implementations consistent with the response. The
+    inputs of different trees can be interleaved, as every TLS version uses
+    its own connection.
+
+    When no single response can eliminate candidates, the elimination by the
+    leaf below the input is used instead, continuing a descent that takes
+    more than one input to distinguish the candidates. If this is not
+    possible either, the candidates cannot be narrowed any further.
+
+    Reaching a leaf prunes the tree of that version, the trees that are at
+    their root are pruned to the remaining candidates as well.
+
+    Unlike `_identification`, this generator yields requests in the form
+    `(version, reset, messages)`. It returns the candidate implementations,
+    or None if the target does not match any model.
+    """
+    states = {version: _VersionState(tree) for version, tree in trees.items()}
+    candidates = set.intersection(
+        *(_implementations(tree, tree.models) for tree in trees.values())
+    )
+
+    def weight(implementation):
+        return weight_function({implementation})
+
+    while True:
+        choices = [
+            (metric, version, input_node)
+            for version, state in sorted(states.items())
+            if len(state.tree)
+            for input_node, metric in _input_metrics(state, candidates, weight)
+        ]
+        if not choices:
+            return candidates
+        metric, version, send_node = max(choices, key=operator.itemgetter(0))
+        if not metric[1]:
+            return candidates
+
+        state = states[version]
+        instrument.count("identify.joint_inputs")
+        (response,) = yield version, state.reset, [state.tree.label(send_node)]
+        state.reset = False
+
+        response_node = state.tree.child(send_node, response)
+        if response_node is None:
+            print("No model with this path:")
+            print(version, state.tree.path(send_node) + (response,))
+            return
+        candidates &= state.subtree_implementations[response_node]
+
+        if state.tree.out_degree(response_node) == 0:
+            # Prune the models of the other leaves, the descent in this tree
+            # starts at the root again.
+            leaf_models = state.tree.nodes[response_node]["models"]
+            state.tree.prune_models(state.tree.models - leaf_models)
+            state.current_node = state.tree.root
+            state.reset = True
+        else:
+            state.current_node = response_node
+
+        if not candidates:
+            return
+
+        # Prune the models without candidates from the trees at their root,
+        # the other trees are still descending.
+        for state in states.values():
+            if state.current_node != state.tree.root or not len(state.tree):
+                continue
+            state.tree.prune_models(
+                model
+                for model in state.tree.models
+                if not candidates & state.tree.model_mapping[model]
+            )
+            state.tree.condense()
+            state.update()
+
+
+def identify(
+    tree,
+    target,
+    target_port=443,
+    graph_dir=None,
+    selector=always_first_selector,
+    weight_function=equal_model_weight,
+    benchmark=False,
+    connector=None,
+    speculative=False,
+    confidence=None,
+    transcript=None,
+):
+    # A custom connector is used as is, for example to simulate the target.
+    if connector is None:
+        connector = (
+            BenchmarkConnector(target, tree)
+            if benchmark
+            else TLSAttackerConnector(target, target_port)
+        )
+
+    steps = _identification(
+        tree, selector, weight_function, graph_dir, speculative, confidence
+    )
+    if transcript is not None:
+        steps = _recorded(steps, transcript)
+    try:
+        with instrument.timer("identify.total"):
+            models = connector.run(steps)
+    finally:
+        connector.close()
+
+    if models and benchmark:
+        return connector.messages
+    return models
+
+
+async def identify_async(
+    tree,
+    target,
+    target_port=443,
+    graph_dir=None,
+    selector=always_first_selector,
+    weight_function=equal_model_weight,
+    connector=None,
+    speculative=False,
+    confidence=None,
+    transcript=None,
+):
+    """Coroutine version of `identify`, using an `AsyncConnector`. This
+    allows a single process to run many identifications concurrently, each
+    with their own (copy of the) tree."""
+    if connector is None:
+        connector = await AsyncTLSAttackerConnector.start(target, target_port)
+
+    steps = _identification(
+        tree, selector, weight_function, graph_dir, speculative, confidence
+    )
+    if transcript is not None:
+        steps = _recorded(steps, transcript)
+    try:
+        with instrument.timer("identify.total"):
+            return await connector.run(steps)
+    finally:
+        await connector.close()
+
+
+class VersionConnectors:
+    def __init__(self, connector_factory):
+        """Connectors for multiple TLS versions of the same target, as used by
+        `identify_versions`. The `connector_factory` is called with the TLS
+        version, the connector of a version is only created when the first
+        message for this version is sent."""
+        self.connector_factory = connector_factory
+        self.connectors = {}
+
+    def __getitem__(self, version):
+        if version not in self.connectors:
+            self.connectors[version] = self.connector_factory(version)
+        return self.connectors[version]
+
+    def close(self):
+        for connector in self.connectors.values():
+            connector.close()
+
+    def run(self, steps):
+        """Perform the requests of `_joint_identification` and return its
+        result, like `AbastractConnector.run`."""
+        try:
+            version, reset, messages = next(steps)
+            while True:
+                connector = self[version]
+                if reset:
+                    responses = connector.replay(messages)
+                else:
+                    responses = connector.send_sequence(messages)
+                version, reset, messages = steps.send(responses)
+        except StopIteration as stop:
+            return stop.value
+
+
+def identify_versions(
+    trees,
+    target,
+    target_port=443,
+    weight_function=equal_model_weight,
+    connector_factory=None,
+):
+    """Identify the target using the trees of multiple TLS versions in a
+    single session, picking the most distinguishing input of all versions at
+    every step. See `_joint_identification` for details.
+
+    Args:
+        trees: Dictionary mapping TLS versions (for example "TLS10") to their
+            trees, these are modified in place.
+        target: Hostname of the target.
+        target_port: Port of the target.
+        weight_function: Weight of an implementation, called with a set
+            containing the implementation (like a model weight).
+        connector_factory: Called with a TLS version, returns the connector
+            for this version. By default TLSAttackerConnector is started.
+
+    Returns:
+        The set of implementations matching the target, or None if the
+        target does not match any model.
+    """
+    if connector_factory is None:
+
+        def connector_factory(version):
+            return TLSAttackerConnector(target, target_port, protocol_version=version)
+
+    connectors = VersionConnectors(connector_factory)
+    try:
+        with instrument.timer("identify.total"):
+            return connectors.run(_joint_identification(trees, weight_function))
+    finally:
+        connectors.close()
+
+
+STATUS_FINISHED = "finished"
+STATUS_TIMEOUT = "timeout"
+STATUS_FAILED = "failed"
+
+
+def _target_result(target, target_port, start, status, models=None, error=None):
+    """Create a result for `identify_target`, models are stored as a sorted
+    list (None if no model matched)."""
+    return {
+        "target": target,
+        "port": target_port,
+        "status": status,
+        "models": sorted(models) if models else None,
+        "error": error,
+        "duration": time.monotonic() - start,
+    }
+
+
+def _add_candidates(result, tree, models, kwargs):
+    """Add the remaining "candidates" to the result, if the identification
+    stopped at a confidence, as a list of [model, share of the weight]
+    pairs, in decreasing order of weight."""
+    if kwargs.get("confidence") is None or not models:
+        return result
+
+    # After stopping early the candidates remain in the tree
+    candidates = tree.models if len(tree) else models
+    shares = candidate_weights(
+        tree, candidates, kwargs.get("weight_function", equal_model_weight)
+    )
+    result["candidates"] = [
+        [model, shares[model]]
+        for model in sorted(shares, key=lambda x: (-shares[x], x))
+    ]
+    return result
+
+
+def identify_target(
+    tree,
+    target,
+    target_port=443,
+    *,
+    connector_address=None,
+    timeout=None,
+    deadline=None,
+    retries=3,
+    backoff=0.5,
+    protocol_version=None,
+    record_transcript=False,
+    **kwargs,
+):
+    """Identify the target with TLSAttackerConnector, bounding the time spent
+    on it. Instead of raising errors, the outcome is recorded in the returned
+    dictionary, which makes this suitable for scanning many targets.
+
+    Args:
+        tree: The tree to use, this is modified in place.
+        target: Hostname of the target.
+        target_port: Port of the target.
+        connector_address: Optional address of a running connector.
+        timeout: Maximum number of seconds to wait for a single response.
+        deadline: Maximum number of seconds for the whole identification.
+        retries: Number of retries when connecting to the connector fails.
+        backoff: Delay before the first retry, doubled for every next retry.
+        protocol_version: TLS version used by the connector, this should
+            match the tree. See `probe.probe_versions` to find the supported
+            versions of a target.
+        record_transcript: Include the "transcript" of the inputs sent and
+            the outputs received in the result, see `_recorded`.
+        kwargs: Passed to `identify`.
+
+    Returns:
+        A dictionary with the target, port, status (one of STATUS_FINISHED,
+        STATUS_TIMEOUT or STATUS_FAILED), the list of models (None if no
+        model matched), an error message and the duration in seconds. If a
+        `confidence` is passed, the remaining "candidates" and their share of
+        the weight are included as well.
+    """
+    start = time.monotonic()
+    # A failed identification keeps the transcript up to the failure
+    transcript = [] if record_transcript else None
+    try:
+        connector = TLSAttackerConnector(
+            target,
+            target_port,
+            connector_address=connector_address,
+            timeout=timeout,
+            deadline=_deadline(deadline),
+            retries=retries,
+            backoff=backoff,
+            protocol_version=protocol_version,
+        )
+        models = identify(
+            tree,
+            target,
+            target_port,
+            connector=connector,
+            transcript=transcript,
+            **kwargs,
+        )
+    except socket.timeout as error:
+        result = _target_result(
+            target, target_port, start, STATUS_TIMEOUT, error=str(error)
+        )
+    except Exception as error:
+        result = _target_result(
+            target, target_port, start, STATUS_FAILED, error=repr(error)
+        )
+    else:
+        result = _target_result(target, target_port, start, STATUS_FINISHED, models)
+        result = _add_candidates(result, tree, models, kwargs)
+
+    if transcript is not None:
+        result["transcript"] = transcript
+    return result
+
+
+def identify_target_versions(
+    trees,
+    target,
+    target_port=443,
+    *,
+    timeout=None,
+    deadline=None,
+    retries=3,
+    backoff=0.5,
+    **kwargs,
+):
+    """Identify the target with `identify_versions`, bounding the time spent
+    on it like `identify_target`. The deadline is shared by the connectors of
+    all TLS versions.
+
+    Returns:
+        A dictionary like `identify_target`, with the sorted list of
+        "implementations" instead of the models.
+    """
+    start = time.monotonic()
+    absolute_deadline = _deadline(deadline)
+
+    def connector_factory(version):
+        return TLSAttackerConnector(
+            target,
+            target_port,
+            timeout=timeout,
+            deadline=absolute_deadline,
+            retries=retries,
+            backoff=backoff,
+            protocol_version=version,
+        )
+
+    try:
+        implementations = identify_versions(
+            trees, target, target_port, connector_factory=connector_factory, **kwargs
+        )
+    except socket.timeout as error:
+        result = _target_result(
+            target, target_port, start, STATUS_TIMEOUT, error=str(error)
+        )
+    except Exception as error:
+        result = _target_result(
+            target, target_port, start, STATUS_FAILED, error=repr(error)
+        )
+    else:
+        result = _target_result(
+            target, target_port, start, STATUS_FINISHED, implementations
+        )
+    result["implementations"] = result.pop("models")
+    return result
+
+
+async def identify_target_async(
+    tree,
+    target,
+    target_port=443,
+    *,
+    connector_address=None,
+    timeout=None,
+    deadline=None,
+    retries=3,
+    backoff=0.5,
+    protocol_version=None,
+    **kwargs,
+):
+    """Coroutine version of `identify_target`. The deadline also cancels the
+    identification, which closes the connector and stops the process."""
+    start = time.monotonic()
+    absolute_deadline = _deadline(deadline)
+
+    async def run():
+        connector = await AsyncTLSAttackerConnector.start(
+            target,
+            target_port,
+            connector_address=connector_address,
+            timeout=timeout,
+            deadline=absolute_deadline,
+            retries=retries,
+            backoff=backoff,
+            protocol_version=protocol_version,
+        )
+        return await identify_async(
+            tree, target, target_port, connector=connector, **kwargs
+        )
+
+    try:
+        models = await asyncio.wait_for(run(), deadline)
+    except (socket.timeout, asyncio.TimeoutError) as error:
+        return _target_result(
+            target, target_port, start, STATUS_TIMEOUT, error=str(error)
+        )
+    except Exception as error:
+        return _target_result(
+            target, target_port, start, STATUS_FAILED, error=repr(error)
+        )
+    result = _target_result(target, target_port, start, STATUS_FINISHED, models)
+    return _add_candidates(result, tree, models, kwargs)
@@ -0,0 +1,194 @@
+"""Timers and counters for the hot paths of tlsprint.
+
+Instrumented code reports events to the registered sinks. When no sink is
+registered, the timers and counters do (almost) nothing, so the
+instrumentation can stay in place permanently. A sink is any object with a
+`record(event)` method, where the event is a dictionary with the keys:
+
+    -   type: Either "timer" or "counter".
+    -   name: Name of the measured phase, for example "tree.condense".
+    -   value: Duration in seconds for timers, increment for counters.
+    -   time: Wall clock time (`time.time`) at which the event was recorded.
+"""
+
+import collections
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+
+import numpy
+
+_sinks = []
+
+
+def add_sink(sink):
+    """Register a sink, it receives all events from now on."""
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    """Unregister a sink."""
+    _sinks.remove(sink)
+
+
+@contextlib.contextmanager
+def recording(sink):
+    """Register the sink for the duration of the context."""
+    add_sink(sink)
+    try:
+        yield sink
+    finally:
+        remove_sink(sink)
+
+
+def _emit(event_type, name, value):
+    event = {"type": event_type, "name": name, "value": value, "time": time.time()}
+    for sink in _sinks:
+        sink.record(event)
+
+
+@contextlib.contextmanager
+def timer(name):
+    """Time the duration of the context."""
+    start = time.perf_counter() if _sinks else None
+    try:
+        yield
+    finally:
+        if start is not None:
+            _emit("timer", name, time.perf_counter() - start)
+
+
+def timed(name):
+    """Decorator version of `timer`."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, value=1):
+    """Increment the counter with the given name."""
+    if _sinks:
+        _emit("counter", name, value)
+
+
+class MemorySink:
+    """Collect all events in memory, to summarize them afterwards."""
+
+    def __init__(self):
+        self.events = []
+
+    def record(self, event):
+        self.events.append(event)
+
+    def timers(self):
+        """Return a dictionary mapping every timer to its list of durations."""
+        timers = collections.defaultdict(list)
+        for event in self.events:
+            if event["type"] == "timer":
+                timers[event["name"]].append(event["value"])
+        return dict(timers)
+
+    def counters(self):
+        """Return a dictionary mapping every counter to its total."""
+        counters = collections.Counter()
+        for event in self.events:
+            if event["type"] == "counter":
+                counters[event["name"]] += event["value"]
+        return dict(counters)
+
+    def summary(self):
+        """Return a per phase breakdown of the timers, as a list of
+        dictionaries sorted by the total time spent."""
+        summary = []
+        for name, durations in self.timers().items():
+            durations = numpy.array(durations)
+            summary.append(
+                {
+                    "Phase": name,
+                    "Count": len(durations),
+                    "Total (s)": float(durations.sum()),
+                    "Mean (s)": float(durations.mean()),
+                    "P50 (s)": float(numpy.percentile(durations, 50)),
+                    "P95 (s)": float(numpy.percentile(durations, 95)),
+                    "Max (s)": float(durations.max()),
+                }
+            )
+        return sorted(summary, key=lambda x: x["Total (s)"], reverse=True)
+
+    def histogram(self, name, bins=10):
+        """Return the histogram (counts and bin edges) of a timer, see
+        `numpy.histogram`."""
+        return numpy.histogram(self.timers().get(name, []), bins=bins)
+
+
+class AggregateSink:
+    """Keep running totals of the events, using constant memory. Unlike
+    `MemorySink`, this is suitable for long running processes. Events can be
+    recorded from multiple threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timers = {}
+        self._counters = collections.Counter()
+
+    def record(self, event):
+        with self._lock:
+            if event["type"] == "counter":
+                self._counters[event["name"]] += event["value"]
+                return
+
+            timer = self._timers.setdefault(
+                event["name"], {"count": 0, "total": 0.0, "max": 0.0}
+            )
+            timer["count"] += 1
+            timer["total"] += event["value"]
+            timer["max"] = max(timer["max"], event["value"])
+
+    def timers(self):
+        """Return a dictionary mapping every timer to its count, total, mean
+        and maximum duration."""
+        with self._lock:
+            return {
+                name: dict(timer, mean=timer["total"] / timer["count"])
+                for name, timer in self._timers.items()
+            }
+
+    def counters(self):
+        """Return a dictionary mapping every counter to its total."""
+        with self._lock:
+            return dict(self._counters)
+
+
+class LogSink:
+    """Write every event to a logger."""
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = level
+
+    def record(self, event):
+        self.logger.log(
+            self.level, "%s %s: %s", event["type"], event["name"], event["value"]
+        )
+
+
+class JSONLinesSink:
+    """Write every event as a line of JSON to a file."""
+
+    def __init__(self, file):
+        self.file = file
+
+    def record(self, event):
+        self.file.write(json.dumps(event) + "\n")
+        self.file.flush()
@@ -0,0 +1,577 @@
+"""The learning component of tlsprint. The functions in this module can learn
+from the output of StateLearning and create a model of all TLS implementations
+in order to perform fingerprinting.
+"""
+
+import ast
+import concurrent.futures
+import json
+import subprocess
+from pathlib import Path
+
+import networkx
+import pydot
+from networkx.algorithms.traversal.depth_first_search import dfs_tree
+
+from . import instrument
+
+
+class ModelTree(networkx.DiGraph):
+    """Data structure to store an ADG or HDT created from LearnLib models.
+
+    Nodes are integers, the root is `ModelTree.root`. Every other node has the
+    attribute "message": the id of the input or output leading to the node,
+    in the interned alphabet `messages`. Use `label`, `child`, `path` and
+    `find` to go from nodes to messages and back.
+    """
+
+    root = 0
+
+    def __init__(self, incoming_graph_data=None, **attr):
+        super().__init__(incoming_graph_data, **attr)
+        # The alphabet is stored in the graph attributes, so it is shared
+        # with the subgraph views returned by `subtree`.
+        self.graph.setdefault("messages", [])
+        self.graph.setdefault("message_ids", {})
+        self.graph.setdefault("next_node", self.root + 1)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Trees pickled before the nodes were integers use the paths of
+        # messages as nodes, these are converted when loaded.
+        if "messages" not in self.graph:
+            model_mapping = getattr(self, "model_mapping", None)
+            self.__dict__ = ModelTree.from_paths(self).__dict__
+            if model_mapping is not None:
+                self.model_mapping = model_mapping
+
+    @classmethod
+    def from_paths(cls, graph):
+        """Convert a tree of which the nodes are the paths (tuples of
+        messages) leading to them, the format of trees created by older
+        versions. Node and edge attributes are kept."""
+        tree = cls()
+        if () not in graph:
+            return tree
+
+        tree.add_node(tree.root, **graph.nodes[()])
+        nodes = {(): tree.root}
+        for parent, child in networkx.bfs_edges(graph, ()):
+            nodes[child] = tree.add_child(nodes[parent], child[-1])
+            tree.nodes[nodes[child]].update(graph.nodes[child])
+            tree.edges[nodes[parent], nodes[child]].update(graph.edges[parent, child])
+        return tree
+
+    @property
+    def messages(self):
+        """List of all messages in the tree, indexed by their id."""
+        return self.graph["messages"]
+
+    def intern(self, message):
+        """Return the id of the message, adding it to `messages` if new."""
+        message_ids = self.graph["message_ids"]
+        if message not in message_ids:
+            message_ids[message] = len(self.messages)
+            self.messages.append(message)
+        return message_ids[message]
+
+    def label(self, node):
+        """Return the message leading to the node, None for the root."""
+        message = self.nodes[node].get("message")
+        return None if message is None else self.messages[message]
+
+    def child(self, node, message):
+        """Return the child of the node reached by the message, or None if
+        the tree has no such node."""
+        message = self.graph["message_ids"].get(message)
+        if message is None or node not in self:
+            return None
+        for child in self[node]:
+            if self.nodes[child]["message"] == message:
+                return child
+        return None
+
+    def add_child(self, node, message):
+        """Return the child of the node reached by the message, adding it
+        (with an edge labeled with the message) if it does not exist yet."""
+        child = self.child(node, message)
+        if child is None:
+            child = self.graph["next_node"]
+            self.graph["next_node"] += 1
+            self.add_node(child, message=self.intern(message))
+            self.add_edge(node, child, label=message)
+        return child
+
+    def add_path(self, path, node=None):
+        """Add the messages of the path below the node (by default the root),
+        reusing the existing nodes. Returns the last node of the path."""
+        node = self.root if node is None else node
+        self.add_node(node)
+        for message in path:
+            node = self.add_child(node, message)
+        return node
+
+    def find(self, path, node=None):
+        """Return the node reached by following the messages of the path from
+        the node (by default the root), or None if the tree has no such
+        node."""
+        node = self.root if node is None else node
+        if node not in self:
+            return None
+        for message in path:
+            node = self.child(node, message)
+            if node is None:
+                return None
+        return node
+
+    def path_nodes(self, node):
+        """Return the nodes from the root up to and including the node."""
+        nodes = [node]
+        predecessors = list(self.predecessors(node))
+        while predecessors:
+            nodes.append(predecessors[0])
+            predecessors = list(self.predecessors(predecessors[0]))
+        return nodes[::-1]
+
+    def path(self, node):
+        """Return the messages leading from the root to the node, for example
+        to display the node."""
+        return tuple(self.label(x) for x in self.path_nodes(node)[1:])
+
+    def merge(self, tree):
+        """Merge another tree into this tree, nodes with the same path are
+        combined. Returns a dictionary mapping the nodes of the other tree to
+        the nodes of this tree."""
+        self.add_node(self.root)
+        nodes = {tree.root: self.root}
+        for parent, child in networkx.bfs_edges(tree, tree.root):
+            nodes[child] = self.add_child(nodes[parent], tree.label(child))
+        return nodes
+
+    def parent(self, node):
+        """Return the parent of the specified node."""
+        # This uses the `predecessors` function, with the assumption that
+        # each node has at most one predecessors, it's parent.
+        return list(self.predecessors(node))[0]
+
+    @property
+    def leaves(self):
+        return [node for node in self.nodes if self.out_degree(node) == 0]
+
+    @property
+    def models(self):
+        return {
+            _models for leaf in self.leaves for _models in self.nodes[leaf]["models"]
+        }
+
+    def subtree(self, node):
+        """Return the subtree where `node` is the root, as a ModelTree."""
+        subtree_nodes = dfs_tree(self, node).nodes
+        return self.subgraph(subtree_nodes)
+
+    def prune_node(self, node):
+        """Cut a node from the tree, pruning the predecessors away as far as
+        possible.
+        """
+        # If this node has a redundant parent (one that is only connected to
+        # this node), prune that one first.
+        try:
+            parent = self.parent(node)
+            if self.out_degree(parent) == 1:
+                self.prune_node(parent)
+
+        except IndexError:
+            pass  # The node has no parent to prune
+
+        # Remove the node from the tree
+        self.remove_node(node)
+
+    @instrument.timed("tree.prune_models")
+    def prune_models(self, models):
+        """Prune the specified models from the tree, removing redundant nodes
+        from the tree."""
+        models = set(models)
+
+        for leaf in self.leaves:
+            # Start by removing the models from every leaf node
+            self.nodes[leaf]["models"] -= models
+
+            # If the set is non empty, we can remove it and also their
+            # predecessors if they are only connected to this leaf.
+            if not self.nodes[leaf]["models"]:
+                self.prune_node(leaf)
+
+    @instrument.timed("tree.condense")
+    def condense(self):
+        """Make the tree more compact by removing redundant information:
+        -   Remove the paths that contains 100% of the models.
+        -   Remove inputs that no longer provide distinguishing information.
+        """
+        self._condense()
+
+    def _condense(self):
+        """Recursive implementation of `condense`."""
+        # Remove the leaves (and their parents) that contain 100% of the
+        # models
+        models = self.models
+        for leaf in self.leaves:
+            if self.nodes[leaf]["models"] == models:
+                self.prune_node(leaf)
+
+        # Next, we want to remove input messages that do no longer provide
+        # distinguishing information. We do this bottom up, starting at the
+        # leaf nodes and going two parents up. This is the layer where the
+        # previous input messages are located. We create a set of these
+        # ancestors. We do not check if the "leaf has no parent" condition,
+        # because that would mean we only have a single leaf, being the root
+        # node.
+        ancestors = {self.parent(self.parent(leaf)) for leaf in self.leaves}
+
+        # Now for every ancestor we will remove the redundant inputs.
+        tree_start_size = len(self)
+        for node in ancestors:
+            # We take the subtree of this ancestor, which corresponds with
+            # a set of leaves and models that is different from the larger
+            # tree.
+            subtree = self.subtree(node)
+            leaves = subtree.leaves
+            models = subtree.models
+
+            # For every available input, we check if it is redundant. This is
+            # the case when:
+            # - The input only has one possible output.
+            # - This output leads to a leaf node.
+            redundant_nodes = set()
+            for input_node in subtree[node]:
+                output_nodes = list(subtree.neighbors(input_node))
+                if len(output_nodes) == 1 and output_nodes[0] in leaves:
+                    # If this is the case, these nodes as redundant
+                    redundant_nodes.update([input_node, output_nodes[0]])
+
+            # Remove the redundant nodes
+            self.remove_nodes_from(redundant_nodes)
+
+            # After (possibly) removing some paths, we now check if the
+            # ancestor has any paths lefts in the original tree.
+            if self.out_degree(node) == 0:
+                # If not, we move the information about the models to this
+                # node.
+                self.nodes[node]["models"] = models
+
+        # If the tree has changed, condense it again
+        if len(self) != tree_start_size:
+            self._condense()
+
+    def _to_pydot(self):
+        """Convert this tree to a pydot graph, slightly modifying the tree in
+        order to improve the output:
+        -   Set the label of all non leafs nodes to blank, as the information
+            is already captured by the edges.
+        -   Set the label of all leaf nodes to the list of servers, including
+            the percentage of how much servers are contained in this leaf,
+            compared to all present in the tree.
+        """
+        try:
+            model_count = len(self.models)
+        except KeyError:
+            pass
+
+        # Relabel all the nodes, the path leading to the node is shown as
+        # tooltip.
+        for node in self.nodes:
+            self.nodes[node]["tooltip"] = " / ".join(self.path(node))
+            if self.out_degree(node) == 0:
+                # Leaf node
+                try:
+                    models = sorted(self.nodes[node]["models"])
+                    model_share = "{:.2f}%".format(100 * len(models) / model_count)
+                    self.nodes[node]["label"] = "\n".join([model_share] + models)
+                except KeyError:
+                    self.nodes[node]["label"] = ""
+                self.nodes[node]["shape"] = "rectangle"
+            else:
+                # Not a leaf node
+                self.nodes[node]["label"] = ""
+        return networkx.drawing.nx_pydot.to_pydot(self)
+
+    @instrument.timed("tree.to_dot")
+    def to_dot(self):
+        """Return the DOT source of this tree, labeled like `draw` does, without
+        running Graphviz. Use `render_dot_files` to render it later."""
+        return self._to_pydot().to_string()
+
+    @instrument.timed("tree.draw")
+    def draw(self, fmt="dot", path=None):
+        """Draw this tree using Graphviz in a desired output format, see
+        `_to_pydot` for the changes made to the tree.
+
+        Args:
+            tree: The tree to modify and draw.
+            fmt: Any format supported by Graphviz in which to draw to graph.
+        """
+        result = self._to_pydot().create(format=fmt)
+
+        if path:
+            with open(path, "wb") as file:
+                file.write(result)
+
+        return result
+
+
+@instrument.timed("tree.render")
+def render_dot_files(directory, fmt="svg", jobs=None):
+    """Render every DOT file in the directory using Graphviz, writing the
+    result next to the DOT file. As the work is done by Graphviz processes,
+    the files are rendered in parallel using `jobs` threads.
+
+    Returns:
+        The list of rendered files.
+    """
+
+    def render(path):
+        output = path.with_suffix(f".{fmt}")
+        subprocess.run(["dot", f"-T{fmt}", "-o", str(output), str(path)], check=True)
+        return output
+
+    paths = sorted(Path(directory).glob("*.dot"))
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        return list(executor.map(render, paths))
+
+
+def normalize_graph(dot_graph: str, *, max_depth=10) -> ModelTree:
+    """Normalizes an input graph into a ModelTree. It is possible that an input
+    graph has multiple DOT representations (think of whitespace differences,
+    but also graphs that have the same structure but different node names. In
+    order to see if these are identical, we normalize them by unwrapping them
+    as a tree.
+
+    Args:
+        dot_graph: The DOT representation of the input graph
+        max_depth: The maximum depth of the tree, especially relevant when the
+            graph contains cycles.
+
+    Returns:
+        A normalized ModelTree which represents the input graph.
+    """
+    graph = _dot_to_networkx(dot_graph)
+
+    # Assumes there is a node called '__start0', which is connected a single
+    # node in the graph (the entry point)
+    graph_root = list(graph["__start0"])[0]
+
+    # Create the ModelTree that will contain the normalized graph
+    tree = ModelTree()
+    tree.add_node(tree.root)
+
+    # Normalize the graph by recursively merging into the tree
+    return _merge_subgraph(tree, tree.root, graph, graph_root, 0, max_depth)
+
+
+def _merge_subgraph(
+    tree: ModelTree,
+    root: int,
+    graph: networkx.DiGraph,
+    current_node: str,
+    current_depth: int,
+    max_depth: int,
+) -> ModelTree:
+    """Recursively merge a directed graph into the passed ModelTree. This is an
+    internal function that is called from `normalize_graph`.
+
+    Args:
+        tree: The tree that is being constructed, and into which the graph will
+            be merged.
+        root: The current root node of the tree, the graph will be merged
+            beginning at this node.
+        graph: The graph to merge into the tree
+        current_node: The current node of the graph to merge
+        current_depth: The current recursion depth, this function aborts when
+            depth > max_depth.
+        max_depth: The maximum recursion depth, primaraly useful to escape
+            cycles, so it should be higher than the valid depth of the tree.
+    """
+    # If we exceeded the max depth, we stop
+    if current_depth > max_depth:
+        return tree
+
+    neighbors = list(graph[current_node])
+
+    # If a node has no neighbors, there is nothing to do and this function
+    # returns immediately.
+    if not neighbors:
+        return tree
+
+    # A node can have multiple neighbors
+    for neighbor in neighbors:
+
+        # There can be multiple edges between two nodes, each with
+        # a different label. Each edge is numbered, but we ignore this
+        # number.
+        for _, edge in graph[current_node][neighbor].items():
+            received_node = _merge_path_from_label(tree, root, edge["label"])
+
+            # If the received message contains 'ConnectionClosed', this
+            # path can be stopped here. This greatly reduces the number
+            # of redundant nodes, because of 'ConnectionClosed' edges
+            # go to the final node, which always contains many self loops.
+            if "ConnectionClosed" in tree.label(received_node):
+                # Do not recurse
+                continue
+
+            # If a node only has itself as a neighbor, this is a sink state and
+            # we do not recurse
+            if neighbors == [current_node]:
+                continue
+
+            # Recurse with new root and current node
+            tree = _merge_subgraph(
+                tree, received_node, graph, neighbor, current_depth + 1, max_depth
+            )
+
+    return tree
+
+
+def _merge_path_from_label(tree: ModelTree, root: int, label: str) -> int:
+    """Merge a path into the passed tree from a label. The label is assumed to
+    have the format "{{ sent }} / {{ received }}", since this is the format
+    that StateLearner outputs. The nodes will be added as
+
+        root -> sent -> received
+
+    with the appropriate edge labels.
+
+    Args:
+        tree: The path will be added to this graph.
+        root: Point in the tree where the nodes will be added.
+        label: String of the format "{{ sent }} / {{ received }}"
+
+    Returns:
+        The "received" node, so the caller knows the endpoint of the added
+        path.
+    """
+    # We start by extracting the sent and received messages. Split the label
+    # in the sent and received message. Remove the double quotes and the excess
+    # whitespace.
+    sent, received = [
+        message.replace('"', "").strip() for message in label.split("/", maxsplit=1)
+    ]
+
+    # Append the sent and received messages to the tree
+    return tree.add_path((sent, received), root)
+
+
+def _dot_to_networkx(dot_graph):
+    """Convert a DOT string to a networkx graph."""
+    # Read the input graph using `graph_from_dot_data()`. This function returns
+    # a list but StateLearner only puts a single graph in a file. We assume
+    # this this graph is present and do not check the length. A KeyError will
+    # notify us in case of an error.
+    pydot_graph = pydot.graph_from_dot_data(dot_graph)[0]
+
+    # Convert to networkx graph
+    return networkx.drawing.nx_pydot.from_pydot(pydot_graph)
+
+
+def construct_tree_from_dedup(directory: str, tree_type: str) -> ModelTree:
+    """Given a directory output from the dedup command, construct a ModelTree.
+
+    Args:
+        directory: The path to the dedup directory
+        tree_type: The desired output tree type, can be any from
+            SUPPORTED_TREE_TYPES.
+    """
+    try:
+        handler = _tree_type_handlers[tree_type]
+    except KeyError:
+        raise ValueError(f"Not a valid tree type: {tree_type}")
+
+    path = Path(directory)
+
+    # Build the tree using the specified tree type handler
+    tree = handler(path)
+
+    # Add the model mapping information to the tree
+    tree.model_mapping = {}
+
+    model_directories = sorted([item for item in path.iterdir() if item.is_dir()])
+    for model_dir in model_directories:
+        with open(model_dir / "versions.json") as f:
+            version_info = json.load(f)
+
+            # Convert to set with tuples and add to model_mapping
+            version_info = {tuple(x) for x in version_info}
+            tree.model_mapping[model_dir.name] = version_info
+
+    return tree
+
+
+def _construct_adg(path: Path) -> ModelTree:
+    """Construct the ADG (output from adg-finder) and add metadata from the
+    dedup directory.
+    """
+    adg_path = path / "adg.gv"
+    with open(adg_path) as f:
+        adg = _dot_to_networkx(f.read())
+    adg_root = [node for node in adg.nodes if adg.in_degree(node) == 0][0]
+
+    tree = ModelTree()
+    tree.add_node(tree.root)
+
+    return _merge_subadg(tree, tree.root, adg, adg_root)
+
+
+def _merge_subadg(tree, root, adg, current_node):
+    neighbors = list(adg[current_node])
+
+    if not neighbors:
+        node = adg.nodes[current_node]
+
+        # Fix adg-finder output (add brackets, remove quotes, remove "_s0"
+        # suffixes).
+        models = f"[{node['models']}]"
+        models = models.replace('"', "")
+        models = models.replace("_s0", "")
+
+        # Parse as Python list
+        models = ast.literal_eval(models)
+
+        # Add as attribute to node
+        tree.nodes[root]["models"] = set(models)
+
+        return tree
+
+    for neighbor in neighbors:
+        for _, edge in adg[current_node][neighbor].items():
+            label = edge["label"].replace('"', "")
+            new_node = tree.add_child(root, label)
+
+            # Recurse
+            tree = _merge_subadg(tree, new_node, adg, neighbor)
+
+    return tree
+
+
+def _construct_hdt(path: Path) -> ModelTree:
+    """Construct the HDT (heuristic decision tree) from the dedup
+    directory.
+    """
+    tree = ModelTree()
+    tree.add_node(tree.root)
+
+    model_directories = sorted([item for item in path.iterdir() if item.is_dir()])
+    for model_dir in model_directories:
+        with open(model_dir / "model.gv") as f:
+            graph = normalize_graph(f.read())
+            nodes = tree.merge(graph)
+            for leaf in graph.leaves:
+                try:
+                    tree.nodes[nodes[leaf]]["models"].add(model_dir.name)
+                except KeyError:
+                    tree.nodes[nodes[leaf]]["models"] = {model_dir.name}
+
+    tree.condense()
+    return tree
+
+
+_tree_type_handlers = {"adg": _construct_adg, "hdt": _construct_hdt}
+SUPPORTED_TREE_TYPES = list(_tree_type_handlers.keys())
@@ -0,0 +1,196 @@
+"""Find the TLS versions supported by a target.
+
+Every version is probed with a single ClientHello, sent directly over a TCP
+connection. This is a lot cheaper than starting TLSAttackerConnector, which
+only supports a single TLS version per process. The result is used to select
+the tree (and connector version) matching the target.
+"""
+
+import concurrent.futures
+import ipaddress
+import json
+import os
+import socket
+import tempfile
+import time
+
+from . import instrument
+from . import util
+
+# Protocol version numbers as used on the wire
+VERSIONS = {"TLS10": (3, 1), "TLS11": (3, 2), "TLS12": (3, 3)}
+
+# Common RSA, DHE and ECDHE cipher suites, supported by all versions
+CIPHER_SUITES = (
+    0xC02F,  # TLS_ECDHE_RSA_WITH_AES_128_GCM_SHA256
+    0xC02B,  # TLS_ECDHE_ECDSA_WITH_AES_128_GCM_SHA256
+    0xC013,  # TLS_ECDHE_RSA_WITH_AES_128_CBC_SHA
+    0xC014,  # TLS_ECDHE_RSA_WITH_AES_256_CBC_SHA
+    0xC009,  # TLS_ECDHE_ECDSA_WITH_AES_128_CBC_SHA
+    0x009C,  # TLS_RSA_WITH_AES_128_GCM_SHA256
+    0x0033,  # TLS_DHE_RSA_WITH_AES_128_CBC_SHA
+    0x0039,  # TLS_DHE_RSA_WITH_AES_256_CBC_SHA
+    0x002F,  # TLS_RSA_WITH_AES_128_CBC_SHA
+    0x0035,  # TLS_RSA_WITH_AES_256_CBC_SHA
+    0x000A,  # TLS_RSA_WITH_3DES_EDE_CBC_SHA
+)
+
+CONTENT_TYPE_ALERT = 0x15
+CONTENT_TYPE_HANDSHAKE = 0x16
+HANDSHAKE_SERVER_HELLO = 0x02
+
+
+def _vector(data, length_size):
+    return len(data).to_bytes(length_size, "big") + data
+
+
+def _extension(extension_type, data):
+    return extension_type.to_bytes(2, "big") + _vector(data, 2)
+
+
+def _is_ip_address(host):
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return True
+
+
+def client_hello(version, server_name=None):
+    """Return a TLS record containing a ClientHello for the given version
+    (for example "TLS12")."""
+    extensions = b""
+    if server_name and not _is_ip_address(server_name):
+        name = b"\x00" + _vector(server_name.encode(), 2)
+        extensions += _extension(0x0000, _vector(name, 2))
+    # Supported groups: secp256r1, secp384r1 and secp521r1
+    extensions += _extension(0x000A, _vector(bytes.fromhex("001700180019"), 2))
+    # EC point formats: uncompressed
+    extensions += _extension(0x000B, _vector(b"\x00", 1))
+    # Signature algorithms: SHA-256, SHA-384 and SHA-1 with RSA and ECDSA
+    extensions += _extension(
+        0x000D, _vector(bytes.fromhex("040105010201040305030203"), 2)
+    )
+
+    body = bytes(VERSIONS[version]) + os.urandom(32)
+    body += _vector(b"", 1)  # Session ID
+    body += _vector(b"".join(x.to_bytes(2, "big") for x in CIPHER_SUITES), 2)
+    body += _vector(b"\x00", 1)  # Compression methods: null
+    body += _vector(extensions, 2)
+
+    handshake = bytes([0x01]) + _vector(body, 3)
+    # Like most clients, use TLS 1.0 as record layer version
+    return bytes([CONTENT_TYPE_HANDSHAKE, 3, 1]) + _vector(handshake, 2)
+
+
+def _receive(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed by the target")
+        data += chunk
+    return data
+
+
+def _server_version(sock):
+    """Read the first record sent by the server. Returns the version from the
+    ServerHello, or None if the server responds with anything else (usually
+    an alert)."""
+    header = _receive(sock, 5)
+    record = _receive(sock, int.from_bytes(header[3:5], "big"))
+    if header[0] != CONTENT_TYPE_HANDSHAKE or record[0] != HANDSHAKE_SERVER_HELLO:
+        return None
+    return tuple(record[4:6])
+
+
+def probe_version(target, target_port, version, timeout=5.0):
+    """Return True if the target accepts a handshake with the given TLS
+    version. Errors while connecting, like an unreachable target, are raised.
+    """
+    with socket.create_connection((target, target_port), timeout=timeout) as sock:
+        try:
+            sock.sendall(client_hello(version, target))
+            return _server_version(sock) == VERSIONS[version]
+        except (ConnectionError, socket.timeout):
+            # Many implementations close the connection instead of sending
+            # an alert when the version is not supported.
+            return False
+
+
+@instrument.timed("probe.versions")
+def probe_versions(target, target_port=443, versions=None, timeout=5.0):
+    """Probe all versions (by default all of `VERSIONS`) at the same time and
+    return the sorted list of versions supported by the target."""
+    versions = sorted(versions or VERSIONS)
+    with concurrent.futures.ThreadPoolExecutor(len(versions)) as executor:
+        results = executor.map(
+            lambda version: probe_version(target, target_port, version, timeout),
+            versions,
+        )
+        return [version for version, supported in zip(versions, results) if supported]
+
+
+def select_version(supported, available):
+    """Return the highest version that is both supported by the target and
+    available (for example as tree), or None if there is no such version."""
+    versions = sorted(set(supported) & set(available), key=VERSIONS.get)
+    return versions[-1] if versions else None
+
+
+class ProbeCache:
+    def __init__(self, path=None, ttl=24 * 60 * 60):
+        """Cache of probe results per target, stored as JSON.
+
+        Args:
+            path: Path of the cache file, by default in the cache directory of
+                tlsprint.
+            ttl: Number of seconds a result stays valid.
+        """
+        self.path = path or util.cache_directory() / "probes.json"
+        self.ttl = ttl
+
+    def _read(self):
+        # A missing, unreadable or corrupt cache is treated as empty, it is
+        # only a cache.
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def get(self, target, target_port):
+        """Return the cached versions of the target, None if not cached or
+        expired."""
+        entry = self._read().get(f"{target}:{target_port}")
+        if entry and time.time() - entry["time"] < self.ttl:
+            return entry["versions"]
+        return None
+
+    def set(self, target, target_port, versions):
+        entries = self._read()
+        entries[f"{target}:{target_port}"] = {"versions": versions, "time": time.time()}
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        # The cache is replaced atomically, so concurrent or interrupted runs
+        # never leave a partly written file behind.
+        descriptor, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "w") as f:
+                json.dump(entries, f, indent=4)
+            os.replace(temporary, self.path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+
+def supported_versions(target, target_port=443, cache=None, timeout=5.0):
+    """Return the versions supported by the target, using and updating the
+    `ProbeCache` if given."""
+    versions = cache.get(target, target_port) if cache else None
+    if versions is None:
+        versions = probe_versions(target, target_port, timeout=timeout)
+        if cache:
+            cache.set(target, target_port, versions)
+    return versions
@@ -0,0 +1,144 @@
+"""Profile the commands of tlsprint.
+
+A `Profiler` combines three views of a single run:
+
+    -   A deterministic profile using cProfile.
+    -   A statistical profile, sampling the call stack of the main thread at
+        a fixed interval, in the folded format used by flame graph tools.
+    -   The peak memory usage and top allocation sites, using tracemalloc.
+
+The text output does not contain absolute paths or timestamps and is sorted
+deterministically, so it can be compared between releases using `diff`.
+"""
+
+import collections
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+
+class _Sampler(threading.Thread):
+    """Periodically sample the call stack of a thread."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame:
+                code = frame.f_code
+                module = os.path.splitext(os.path.basename(code.co_filename))[0]
+                stack.append(f"{module}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class Profiler:
+    def __init__(self, output_directory, name, interval=0.005, top=25):
+        """Profile a run and write the results to
+        `output_directory/name`.
+
+        Args:
+            output_directory: Directory to write the results to.
+            name: Name of the profiled command, used as subdirectory. The
+                words of a nested command (for example "benchmark perf")
+                are nested subdirectories, see `add_subcommand`.
+            interval: Seconds between two samples of the statistical
+                profiler.
+            top: Number of functions and allocation sites to include in the
+                text output.
+        """
+        self.output_directory = Path(output_directory)
+        self.name = name
+        self.interval = interval
+        self.top = top
+
+    @property
+    def path(self):
+        return self.output_directory.joinpath(*self.name.split())
+
+    def add_subcommand(self, name):
+        """Add the subcommand invoked by a group to the name of the profiled
+        command, before the profile is written."""
+        self.name = f"{self.name} {name}"
+
+    def start(self):
+        tracemalloc.start()
+        self._sampler = _Sampler(threading.get_ident(), self.interval)
+        self._sampler.start()
+        self._profile = cProfile.Profile()
+        self._start_time = time.perf_counter()
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+        wall_time = time.perf_counter() - self._start_time
+        self._sampler.stop()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._write_cprofile()
+        self._write_samples()
+        self._write_memory(snapshot, peak_memory)
+
+        summary = {
+            "command": self.name,
+            "wall_time": wall_time,
+            "peak_memory": peak_memory,
+            "samples": sum(self._sampler.stacks.values()),
+        }
+        with open(self.path / "summary.json", "w") as f:
+            json.dump(summary, f, indent=4, sort_keys=True)
+
+    def _write_cprofile(self):
+        # The raw profile can be inspected with tools like snakeviz
+        self._profile.dump_stats(self.path / "cprofile.prof")
+
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=stream)
+        stats.strip_dirs().sort_stats("cumulative", "name").print_stats(self.top)
+
+        # Skip the header, which contains a timestamp and the total time
+        text = stream.getvalue()
+        text = text[max(text.find("   Ordered by"), 0) :]
+        with open(self.path / "cprofile.txt", "w") as f:
+            f.write(text)
+
+    def _write_samples(self):
+        # Folded stacks, sorted by stack so runs can be compared
+        with open(self.path / "samples.folded", "w") as f:
+            for stack, count in sorted(self._sampler.stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+    def _write_memory(self, snapshot, peak_memory):
+        statistics = snapshot.statistics("lineno")[: self.top]
+        with open(self.path / "memory.txt", "w") as f:
+            f.write(f"Peak memory: {peak_memory} bytes\n\n")
+            f.write(f"Top {self.top} allocation sites:\n")
+            for statistic in statistics:
+                frame = statistic.traceback[0]
+                filename = os.path.basename(frame.filename)
+                f.write(
+                    f"{filename}:{frame.lineno}: {statistic.size} bytes"
+                    f" in {statistic.count} blocks\n"
+                )
@@ -0,0 +1,271 @@
+"""Simulate TLS implementations using their learned state machines.
+
+The models are compiled into NumPy transition and output tables, indexed by
+(state, input id). This allows identification to be tested against the actual
+state machines, without the limitations of the (depth limited) model tree,
+and without a live target.
+"""
+
+import asyncio
+import random
+from pathlib import Path
+
+import numpy
+
+from . import util
+from .identify import AbastractConnector
+from .learn import _dot_to_networkx
+
+RESET = "RESET"
+RESET_OUTPUT = ""
+
+
+class Simulator:
+    """Collection of Mealy machines, compiled into shared transition and
+    output tables.
+
+    All machines share a single input and output alphabet, and the states of
+    all machines are numbered globally. This way sessions of different
+    machines can be advanced together in a single `step`.
+    """
+
+    def __init__(self, machines):
+        """Compile the machines into tables.
+
+        Args:
+            machines: Dictionary mapping model names to a converted graph, in
+                the format returned by `util.convert_graph`.
+        """
+        self.models = sorted(machines)
+
+        # The RESET input is handled by the simulator itself, it is not part
+        # of the transition table.
+        self.inputs = sorted(
+            {sent for machine in machines.values() for sent in machine["inputs"]}
+            - {RESET}
+        )
+        self.outputs = sorted(
+            {
+                received
+                for machine in machines.values()
+                for received in machine["outputs"]
+            }
+            | {RESET_OUTPUT}
+        )
+        self.input_ids = {name: index for index, name in enumerate(self.inputs)}
+        self.output_ids = {name: index for index, name in enumerate(self.outputs)}
+
+        # Number the states of all machines globally
+        state_ids = {}
+        self.initial_states = {}
+        for model in self.models:
+            machine = machines[model]
+            for state in machine["states"]:
+                state_ids[(model, state)] = len(state_ids)
+            self.initial_states[model] = state_ids[(model, machine["initial_state"])]
+
+        # Undefined transitions are marked with -1
+        shape = (len(state_ids), len(self.inputs))
+        self.transitions = numpy.full(shape, -1, dtype=numpy.int32)
+        self.output_table = numpy.full(shape, -1, dtype=numpy.int32)
+        for model in self.models:
+            for (source, sent), (received, destination) in machines[model][
+                "transitions"
+            ]:
+                if sent == RESET:
+                    continue
+                state = state_ids[(model, source)]
+                input_id = self.input_ids[sent]
+                self.transitions[state, input_id] = state_ids[(model, destination)]
+                self.output_table[state, input_id] = self.output_ids[received]
+
+    @classmethod
+    def from_dot(cls, dot_graphs):
+        """Create a simulator from a dictionary mapping model names to DOT
+        strings, as written by StateLearner."""
+        return cls(
+            {
+                name: util.convert_graph(_dot_to_networkx(dot_graph))
+                for name, dot_graph in dot_graphs.items()
+            }
+        )
+
+    @classmethod
+    def from_dedup(cls, directory):
+        """Create a simulator from a single TLS version directory, as written
+        by the dedup command."""
+        dot_graphs = {}
+        for model_dir in sorted(p for p in Path(directory).iterdir() if p.is_dir()):
+            with open(model_dir / "model.gv") as f:
+                dot_graphs[model_dir.name] = f.read()
+        return cls.from_dot(dot_graphs)
+
+    def initial(self, models):
+        """Return an array with the initial state of each of the models."""
+        return numpy.array(
+            [self.initial_states[model] for model in models], dtype=numpy.int32
+        )
+
+    def step(self, states, input_ids):
+        """Advance a batch of sessions with one input each.
+
+        Args:
+            states: Array with the current state of every session.
+            input_ids: Array with the input id to send in every session.
+
+        Returns:
+            A tuple with the next states and the output ids. For undefined
+            transitions the session stays in its state and the output is -1.
+        """
+        next_states = self.transitions[states, input_ids]
+        output_ids = self.output_table[states, input_ids]
+        return numpy.where(next_states >= 0, next_states, states), output_ids
+
+    def run(self, models, sequences):
+        """Run an input sequence for every model in a batch.
+
+        Args:
+            models: List of model names, one per session.
+            sequences: List of input sequences, one per session. The sequences
+                can have different lengths and can contain RESET inputs.
+
+        Returns:
+            A list with the output sequence of every session. Outputs of
+            undefined transitions are None.
+        """
+        states = self.initial(models)
+        initial_states = states.copy()
+
+        # Encode the sequences as a matrix of input ids, where -1 is used as
+        # padding and -2 as the RESET input.
+        length = max((len(sequence) for sequence in sequences), default=0)
+        input_ids = numpy.full((len(models), length), -1, dtype=numpy.int32)
+        for row, sequence in enumerate(sequences):
+            input_ids[row, : len(sequence)] = [
+                -2 if message == RESET else self.input_ids[message]
+                for message in sequence
+            ]
+
+        output_ids = numpy.full((len(models), length), -1, dtype=numpy.int32)
+        for column in range(length):
+            column_ids = input_ids[:, column]
+            active = column_ids >= 0
+            states[active], output_ids[active, column] = self.step(
+                states[active], column_ids[active]
+            )
+
+            reset = column_ids == -2
+            states[reset] = initial_states[reset]
+            output_ids[reset, column] = self.output_ids[RESET_OUTPUT]
+
+        return [
+            [
+                self.outputs[output_id] if output_id >= 0 else None
+                for output_id in output_ids[row, : len(sequence)]
+            ]
+            for row, sequence in enumerate(sequences)
+        ]
+
+
+class SimulatorConnector(AbastractConnector):
+    def __init__(self, simulator, model):
+        """Simulate a target running the given model. Like the
+        BenchmarkConnector, it keeps track of the messages send and received.
+        """
+        self.simulator = simulator
+        self.model = model
+        self.state = simulator.initial_states[model]
+
+        self.messages = []
+
+    def send(self, message):
+        self.messages.append(message)
+
+        if message == RESET:
+            self.state = self.simulator.initial_states[self.model]
+            output = RESET_OUTPUT
+        else:
+            try:
+                input_id = self.simulator.input_ids[message]
+            except KeyError:
+                raise ValueError(f"Unknown input: {message}") from None
+
+            next_state = self.simulator.transitions[self.state, input_id]
+            output_id = self.simulator.output_table[self.state, input_id]
+            if next_state >= 0:
+                self.state = next_state
+            output = self.simulator.outputs[output_id] if output_id >= 0 else None
+
+        self.messages.append(output)
+        return output
+
+    def reset(self):
+        self.messages += ["RESET", ""]
+        self.state = self.simulator.initial_states[self.model]
+
+
+class SimulatorServer:
+    """Local stand-in for TLSAttackerConnector, answering from a simulated
+    model.
+
+    The server speaks the same newline delimited protocol as the connector,
+    including RESET, so the socket handling of the identification can be
+    tested without a JVM or a live target. Every connection is an independent
+    session of the model.
+    """
+
+    def __init__(self, simulator, model, *, latency=0, jitter=0, concurrency=None):
+        """Configure the server, call `start` to start listening.
+
+        Args:
+            simulator: The `Simulator` containing the model.
+            model: Name of the model to answer from.
+            latency: Artificial delay in seconds, added to every response.
+            jitter: Additional random delay in seconds, uniformly distributed
+                between 0 and this value.
+            concurrency: Maximum number of sessions served at the same time,
+                other connections wait until a session closes. Unlimited if
+                None.
+        """
+        self.simulator = simulator
+        self.model = model
+        self.latency = latency
+        self.jitter = jitter
+        self.concurrency = concurrency
+        self.sessions = 0
+
+    async def handle(self, reader, writer):
+        """Serve a single session until the client closes the connection."""
+        async with self._semaphore:
+            self.sessions += 1
+            connector = SimulatorConnector(self.simulator, self.model)
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+
+                    output = connector.send(line.decode().strip())
+                    # The transcript is not needed for a long running session
+                    connector.messages.clear()
+
+                    delay = self.latency + random.uniform(0, self.jitter)
+                    if delay:
+                        await asyncio.sleep(delay)
+
+                    # Undefined transitions are answered with an empty line
+                    writer.write(((output or "") + "\n").encode())
+                    await writer.drain()
+            except (ValueError, ConnectionError):
+                # Unknown inputs or a disconnecting client end the session
+                pass
+            finally:
+                self.sessions -= 1
+                writer.close()
+
+    async def start(self, host="localhost", port=6666):
+        """Start listening and return the `asyncio.Server`."""
+        # The semaphore is created here, as it has to be bound to the running
+        # event loop.
+        self._semaphore = asyncio.Semaphore(self.concurrency or 2**31)
+        return await asyncio.start_server(self.handle, host, port)
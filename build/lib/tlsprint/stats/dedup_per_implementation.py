@@ -0,0 +1,44 @@
+import collections
+import operator
+
+
+def _count_models_per_implementation(models):
+    counts = collections.Counter()
+
+    # For each model, use the list of corresponding implementations and
+    # version from the "versions.json"
+    for model in models:
+        # We are only interested in implementation names, not in version
+        # numbers, so we use a set for this.
+        implementations = set([name for name, _ in model["versions"]])
+
+        # Add the names to the counter
+        counts += collections.Counter(implementations)
+
+    return counts
+
+
+def summary(context):
+    """Return a summary of the number of unique models per implementation and
+    TLS version as a dictionary. This uses the directory output from the
+    deduplication step.
+    """
+    # The dedup directory is grouped by TLS version, but in this summary we
+    # want to group by implementation. This means we have to invert this
+    # grouping, and keeping track of the counts.
+    counts = collections.defaultdict(dict)
+    for tls_version, models in sorted(context.dedup.items()):
+        # For each TLS version, extract the number of models per implementation
+        for implementation, model_count in _count_models_per_implementation(
+            models
+        ).items():
+            # For each implementation, add the counts to the corresponding TLS
+            # version
+            counts[implementation][tls_version] = model_count
+
+    summary = [
+        {"Name": implementation, **values} for implementation, values in counts.items()
+    ]
+
+    # Return the results, sorted by implementation name
+    return sorted(summary, key=operator.itemgetter("Name"))
@@ -0,0 +1,25 @@
+def _tls_summary(tls_version, models):
+    summary = {"TLS version": tls_version}
+
+    # Count the number of unique models for this TLS version
+    summary["Unique models"] = len(models)
+
+    # Add some statistics about the models sizes
+    model_sizes = [model["nodes"] for model in models]
+    summary["Average model size"] = round(sum(model_sizes) / len(model_sizes), 1)
+    summary["Largest model"] = max(model_sizes)
+    summary["Smallest model"] = min(model_sizes)
+
+    return summary
+
+
+def summary(context):
+    """Return a summary of the number of unique models per TLS version and as
+    a dictionary, it also includes some information about the size of the
+    models. This uses the directory output from the deduplication step.
+    """
+    summary = []
+    for tls_version, models in sorted(context.dedup.items()):
+        summary.append(_tls_summary(tls_version, models))
+
+    return summary
@@ -0,0 +1,30 @@
+import collections
+
+
+def _implementation_summary(name, versions):
+    summary = {"Name": name}
+
+    # To count the number of models for a given implementation, we need a list
+    # of the supported TLS versions for each implementation version.
+    tls_versions = [x for tls_versions in versions.values() for x in tls_versions]
+    tls_counts = collections.Counter(tls_versions)
+
+    # Merge the counts with the existing summary info
+    summary = {**summary, **tls_counts}
+
+    # Add a total count column
+    summary["Total"] = sum(tls_counts.values())
+
+    return summary
+
+
+def summary(context):
+    """Return a summary of the number of learned models per implementation and
+    TLS version as a dictionary. This uses the directory containing the raw
+    models.
+    """
+    summary = []
+    for name, versions in sorted(context.models.items()):
+        summary.append(_implementation_summary(name, versions))
+
+    return summary
@@ -0,0 +1,8 @@
+def summary(context):
+    summary = []
+    for tree_type, tls_tree_dict in context.trees.items():
+        details = {"Type": tree_type}
+        for tls_version, tree in sorted(tls_tree_dict.items()):
+            details[tls_version] = len(tree)
+        summary.append(details)
+    return summary
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import shutil
+from collections import defaultdict
+from pathlib import Path
+
+import networkx
+
+
+def prefix_nodes(graph, prefix, *, copy=True):
+    """Prefix every node of the graph with the specified prefix. If `copy` is
+    False, the graph is relabeled in place instead of returning a copy."""
+    mapping = {node: f"{prefix}{node}" for node in graph.nodes}
+    return networkx.relabel_nodes(graph, mapping, copy=copy)
+
+
+def add_resets_edges(graph, start):
+    """Add a "RESET / -" edge from every sinkhole to the start state."""
+    for node in graph.nodes:
+        neighbors = list(graph[node])
+        if neighbors == [node]:
+            graph.add_edge(node, start, label="RESET / ")
+
+
+def convert_graph(graph, *, add_resets=False, prefix=None):
+    """Convert a graph from LearnLib DOT output to dict, with the structure
+    required by adg-finder. This modifies the graph, if a `prefix` is given
+    the nodes are prefixed in place, without the copy made by default by
+    `prefix_nodes`.
+    # """
+    if prefix:
+        graph = prefix_nodes(graph, prefix, copy=False)
+
+    converted = {}
+
+    # The first (and only) state connected to the dummy_start, is the actual
+    # start state.
+    dummy_start = [node for node in graph.nodes if graph.in_degree(node) == 0][0]
+    converted["initial_state"] = [node for node in graph[dummy_start]][0]
+
+    # Remove the dummy start node
+    graph.remove_node(dummy_start)
+
+    # Include a sorted list of states
+    converted["states"] = sorted(graph.nodes)
+
+    # If requested, add reset edges
+    if add_resets:
+        add_resets_edges(graph, converted["initial_state"])
+
+    # Convert all transitions to tuple format
+    converted["transitions"] = []
+    inputs = set()
+    outputs = set()
+    for edge in graph.edges:
+        label = graph.edges[edge]["label"]
+        sent, received = (x.replace('"', "").strip() for x in label.split("/"))
+
+        source, destination, _ = edge
+        transition = [(source, sent), (received, destination)]
+        converted["transitions"].append(transition)
+
+        inputs.add(sent)
+        outputs.add(received)
+
+    converted["inputs"] = sorted(inputs)
+    converted["outputs"] = sorted(outputs)
+
+    return converted
+
+
+DEDUP_MANIFEST = "manifest.json"
+
+
+def _scan_sources(root, previous_sources):
+    """Return the hash of every `learnedModel.dot` in the models directory,
+    keyed by its path relative to `root`. Files with the same size and mtime
+    as in `previous_sources` are not read again."""
+    sources = {}
+    for path in sorted(root.glob("*/*/*/learnedModel.dot")):
+        key = path.relative_to(root).as_posix()
+        stat = path.stat()
+        previous = previous_sources.get(key)
+        if (
+            previous
+            and previous["mtime"] == stat.st_mtime
+            and previous["size"] == stat.st_size
+        ):
+            sources[key] = previous
+        else:
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()
+            sources[key] = {
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "hash": digest,
+            }
+    return sources
+
+
+def _update_model(model_dir, name, versions, source_path, write_model):
+    """Write the model directory if it is new, or its versions if these have
+    changed. Returns "added", "updated" or None if nothing changed."""
+    versions_path = model_dir / "versions.json"
+    if not versions_path.exists():
+        # The versions are written last, so a partially written model is
+        # written again on the next run.
+        model_dir.mkdir(parents=True, exist_ok=True)
+        write_model(model_dir, name, source_path.read_text())
+        status = "added"
+    else:
+        with open(versions_path) as f:
+            if json.load(f) == versions:
+                return None
+        status = "updated"
+
+    with open(versions_path, "w") as f:
+        json.dump(versions, f, indent=4)
+    return status
+
+
+def dedup_incremental(model_directory, output_directory, write_model):
+    """Deduplicate the models directory into the output directory, only
+    processing the models that changed since the previous run.
+
+    A manifest in the output directory records the size, mtime and hash of
+    every source file, and the name of the model directory for every unique
+    model. Unique models keep their name across runs, new models get a number
+    that was never used before and models that no longer occur are removed.
+
+    Args:
+        model_directory: Directory with the path format
+            `implementation/version/tls_version/learnedModel.dot`.
+        output_directory: Output directory, with a directory per TLS version
+            containing a directory per unique model.
+        write_model: Function called with the model directory, the model name
+            and the contents of the DOT file, to write a new model.
+
+    Returns:
+        A dictionary with the number of "added", "updated" (versions changed)
+        and "removed" models.
+    """
+    root = Path(model_directory)
+    output_path = Path(output_directory)
+    manifest_path = output_path / DEDUP_MANIFEST
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        manifest = {"sources": {}, "models": {}, "next_index": {}}
+
+    sources = _scan_sources(root, manifest["sources"])
+
+    # Group the sources by protocol and hash, keeping track of a source path
+    # for every hash to read new models from.
+    versions = defaultdict(lambda: defaultdict(list))
+    source_paths = {}
+    for key, source in sources.items():
+        implementation, version, protocol, _ = key.split("/")
+        versions[protocol][source["hash"]].append([implementation, version])
+        source_paths[source["hash"]] = root / key
+
+    counts = {"added": 0, "updated": 0, "removed": 0}
+    models = {}
+    next_index = {}
+    for protocol in sorted(versions.keys() | manifest["models"].keys()):
+        names = dict(manifest["models"].get(protocol, {}))
+        hashes = versions.get(protocol, {})
+
+        # Remove the models that no longer occur
+        for digest in names.keys() - hashes.keys():
+            shutil.rmtree(output_path / protocol / names.pop(digest), True)
+            counts["removed"] += 1
+
+        # Number the new models in a deterministic order. Numbers of removed
+        # models are never reused, as these might still be referenced.
+        index = manifest["next_index"].get(protocol, 1)
+        for digest in sorted(hashes.keys() - names.keys(), key=lambda x: hashes[x]):
+            names[digest] = f"model-{index}"
+            index += 1
+        next_index[protocol] = index
+
+        for digest, name in names.items():
+            status = _update_model(
+                output_path / protocol / name,
+                name,
+                sorted(hashes[digest]),
+                source_paths[digest],
+                write_model,
+            )
+            if status:
+                counts[status] += 1
+
+        if names:
+            models[protocol] = names
+
+    # Write the manifest last, so an interrupted run is redone next time
+    output_path.mkdir(parents=True, exist_ok=True)
+    with open(manifest_path, "w") as f:
+        manifest = {"sources": sources, "models": models, "next_index": next_index}
+        json.dump(manifest, f, indent=4)
+
+    return counts
+
+
+def format_tls_string(version):
+    """Formats a string in the form of "TLS12" to "TLS 1.2" for pretty
+    printing."""
+    version = version.replace("TLS", "TLS ")
+    protocol, number = version.split()
+    return f"{protocol} {int(number) / 10}"
+
+
+def cache_directory():
+    """Return the directory to store the caches of tlsprint in, following the
+    XDG base directory specification."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "tlsprint"
@@ -4,16 +4,149 @@ in order to perform fingerprinting.
 """
 
 import ast
+import concurrent.futures
 import json
+import subprocess
 from pathlib import Path
 
 import networkx
 import pydot
 from networkx.algorithms.traversal.depth_first_search import dfs_tree
 
+from . import instrument
+
 
 class ModelTree(networkx.DiGraph):
-    """Data structure to store an ADG or HDT created from LearnLib models."""
+    """Data structure to store an ADG or HDT created from LearnLib models.
+
+    Nodes are integers, the root is `ModelTree.root`. Every other node has the
+    attribute "message": the id of the input or output leading to the node,
+    in the interned alphabet `messages`. Use `label`, `child`, `path` and
+    `find` to go from nodes to messages and back.
+    """
+
+    root = 0
+
+    def __init__(self, incoming_graph_data=None, **attr):
+        super().__init__(incoming_graph_data, **attr)
+        # The alphabet is stored in the graph attributes, so it is shared
+        # with the subgraph views returned by `subtree`.
+        self.graph.setdefault("messages", [])
+        self.graph.setdefault("message_ids", {})
+        self.graph.setdefault("next_node", self.root + 1)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Trees pickled before the nodes were integers use the paths of
+        # messages as nodes, these are converted when loaded.
+        if "messages" not in self.graph:
+            model_mapping = getattr(self, "model_mapping", None)
+            self.__dict__ = ModelTree.from_paths(self).__dict__
+            if model_mapping is not None:
+                self.model_mapping = model_mapping
+
+    @classmethod
+    def from_paths(cls, graph):
+        """Convert a tree of which the nodes are the paths (tuples of
+        messages) leading to them, the format of trees created by older
+        versions. Node and edge attributes are kept."""
+        tree = cls()
+        if () not in graph:
+            return tree
+
+        tree.add_node(tree.root, **graph.nodes[()])
+        nodes = {(): tree.root}
+        for parent, child in networkx.bfs_edges(graph, ()):
+            nodes[child] = tree.add_child(nodes[parent], child[-1])
+            tree.nodes[nodes[child]].update(graph.nodes[child])
+            tree.edges[nodes[parent], nodes[child]].update(graph.edges[parent, child])
+        return tree
+
+    @property
+    def messages(self):
+        """List of all messages in the tree, indexed by their id."""
+        return self.graph["messages"]
+
+    def intern(self, message):
+        """Return the id of the message, adding it to `messages` if new."""
+        message_ids = self.graph["message_ids"]
+        if message not in message_ids:
+            message_ids[message] = len(self.messages)
+            self.messages.append(message)
+        return message_ids[message]
+
+    def label(self, node):
+        """Return the message leading to the node, None for the root."""
+        message = self.nodes[node].get("message")
+        return None if message is None else self.messages[message]
+
+    def child(self, node, message):
+        """Return the child of the node reached by the message, or None if
+        the tree has no such node."""
+        message = self.graph["message_ids"].get(message)
+        if message is None or node not in self:
+            return None
+        for child in self[node]:
+            if self.nodes[child]["message"] == message:
+                return child
+        return None
+
+    def add_child(self, node, message):
+        """Return the child of the node reached by the message, adding it
+        (with an edge labeled with the message) if it does not exist yet."""
+        child = self.child(node, message)
+        if child is None:
+            child = self.graph["next_node"]
+            self.graph["next_node"] += 1
+            self.add_node(child, message=self.intern(message))
+            self.add_edge(node, child, label=message)
+        return child
+
+    def add_path(self, path, node=None):
+        """Add the messages of the path below the node (by default the root),
+        reusing the existing nodes. Returns the last node of the path."""
+        node = self.root if node is None else node
+        self.add_node(node)
+        for message in path:
+            node = self.add_child(node, message)
+        return node
+
+    def find(self, path, node=None):
+        """Return the node reached by following the messages of the path from
+        the node (by default the root), or None if the tree has no such
+        node."""
+        node = self.root if node is None else node
+        if node not in self:
+            return None
+        for message in path:
+            node = self.child(node, message)
+            if node is None:
+                return None
+        return node
+
+    def path_nodes(self, node):
+        """Return the nodes from the root up to and including the node."""
+        nodes = [node]
+        predecessors = list(self.predecessors(node))
+        while predecessors:
+            nodes.append(predecessors[0])
+            predecessors = list(self.predecessors(predecessors[0]))
+        return nodes[::-1]
+
+    def path(self, node):
+        """Return the messages leading from the root to the node, for example
+        to display the node."""
+        return tuple(self.label(x) for x in self.path_nodes(node)[1:])
+
+    def merge(self, tree):
+        """Merge another tree into this tree, nodes with the same path are
+        combined. Returns a dictionary mapping the nodes of the other tree to
+        the nodes of this tree."""
+        self.add_node(self.root)
+        nodes = {tree.root: self.root}
+        for parent, child in networkx.bfs_edges(tree, tree.root):
+            nodes[child] = self.add_child(nodes[parent], tree.label(child))
+        return nodes
 
     def parent(self, node):
         """Return the parent of the specified node."""
@@ -53,6 +186,7 @@ class ModelTree(networkx.DiGraph):
         # Remove the node from the tree
         self.remove_node(node)
 
+    @instrument.timed("tree.prune_models")
     def prune_models(self, models):
         """Prune the specified models from the tree, removing redundant nodes
         from the tree."""
@@ -67,11 +201,16 @@ class ModelTree(networkx.DiGraph):
             if not self.nodes[leaf]["models"]:
                 self.prune_node(leaf)
 
+    @instrument.timed("tree.condense")
     def condense(self):
         """Make the tree more compact by removing redundant information:
         -   Remove the paths that contains 100% of the models.
         -   Remove inputs that no longer provide distinguishing information.
         """
+        self._condense()
+
+    def _condense(self):
+        """Recursive implementation of `condense`."""
         # Remove the leaves (and their parents) that contain 100% of the
         # models
         models = self.models
@@ -121,28 +260,26 @@ class ModelTree(networkx.DiGraph):
 
         # If the tree has changed, condense it again
         if len(self) != tree_start_size:
-            self.condense()
+            self._condense()
 
-    def draw(self, fmt="dot", path=None):
-        """Draw this tree using Graphviz in a desired output format. This
-        slightly modifies the tree in order to improve the output:
+    def _to_pydot(self):
+        """Convert this tree to a pydot graph, slightly modifying the tree in
+        order to improve the output:
         -   Set the label of all non leafs nodes to blank, as the information
             is already captured by the edges.
         -   Set the label of all leaf nodes to the list of servers, including
             the percentage of how much servers are contained in this leaf,
             compared to all present in the tree.
-
-        Args:
-            tree: The tree to modify and draw.
-            fmt: Any format supported by Graphviz in which to draw to graph.
         """
         try:
             model_count = len(self.models)
         except KeyError:
             pass
 
-        # Relabel all the nodes
+        # Relabel all the nodes, the path leading to the node is shown as
+        # tooltip.
         for node in self.nodes:
+            self.nodes[node]["tooltip"] = " / ".join(self.path(node))
             if self.out_degree(node) == 0:
                 # Leaf node
                 try:
@@ -155,14 +292,50 @@ class ModelTree(networkx.DiGraph):
             else:
                 # Not a leaf node
                 self.nodes[node]["label"] = ""
-        dot = networkx.drawing.nx_pydot.to_pydot(self)
-        result = dot.create(format=fmt)
+        return networkx.drawing.nx_pydot.to_pydot(self)
+
+    @instrument.timed("tree.to_dot")
+    def to_dot(self):
+        """Return the DOT source of this tree, labeled like `draw` does, without
+        running Graphviz. Use `render_dot_files` to render it later."""
+        return self._to_pydot().to_string()
+
+    @instrument.timed("tree.draw")
+    def draw(self, fmt="dot", path=None):
+        """Draw this tree using Graphviz in a desired output format, see
+        `_to_pydot` for the changes made to the tree.
+
+        Args:
+            tree: The tree to modify and draw.
+            fmt: Any format supported by Graphviz in which to draw to graph.
+        """
+        result = self._to_pydot().create(format=fmt)
 
         if path:
             with open(path, "wb") as file:
                 file.write(result)
 
-        return dot.create(format=fmt)
+        return result
+
+
+@instrument.timed("tree.render")
+def render_dot_files(directory, fmt="svg", jobs=None):
+    """Render every DOT file in the directory using Graphviz, writing the
+    result next to the DOT file. As the work is done by Graphviz processes,
+    the files are rendered in parallel using `jobs` threads.
+
+    Returns:
+        The list of rendered files.
+    """
+
+    def render(path):
+        output = path.with_suffix(f".{fmt}")
+        subprocess.run(["dot", f"-T{fmt}", "-o", str(output), str(path)], check=True)
+        return output
+
+    paths = sorted(Path(directory).glob("*.dot"))
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        return list(executor.map(render, paths))
 
 
 def normalize_graph(dot_graph: str, *, max_depth=10) -> ModelTree:
@@ -188,16 +361,15 @@ def normalize_graph(dot_graph: str, *, max_depth=10) -> ModelTree:
 
     # Create the ModelTree that will contain the normalized graph
     tree = ModelTree()
-    tree_root = ()
-    tree.add_node(tree_root)
+    tree.add_node(tree.root)
 
     # Normalize the graph by recursively merging into the tree
-    return _merge_subgraph(tree, tree_root, graph, graph_root, 0, max_depth)
+    return _merge_subgraph(tree, tree.root, graph, graph_root, 0, max_depth)
 
 
 def _merge_subgraph(
     tree: ModelTree,
-    root: tuple,
+    root: int,
     graph: networkx.DiGraph,
     current_node: str,
     current_depth: int,
@@ -242,7 +414,7 @@ def _merge_subgraph(
             # path can be stopped here. This greatly reduces the number
             # of redundant nodes, because of 'ConnectionClosed' edges
             # go to the final node, which always contains many self loops.
-            if "ConnectionClosed" in received_node[-1]:
+            if "ConnectionClosed" in tree.label(received_node):
                 # Do not recurse
                 continue
 
@@ -259,7 +431,7 @@ def _merge_subgraph(
     return tree
 
 
-def _merge_path_from_label(tree: ModelTree, root: tuple, label: str) -> tuple:
+def _merge_path_from_label(tree: ModelTree, root: int, label: str) -> int:
     """Merge a path into the passed tree from a label. The label is assumed to
     have the format "{{ sent }} / {{ received }}", since this is the format
     that StateLearner outputs. The nodes will be added as
@@ -274,8 +446,8 @@ def _merge_path_from_label(tree: ModelTree, root: tuple, label: str) -> tuple:
         label: String of the format "{{ sent }} / {{ received }}"
 
     Returns:
-        The name of the "received" node (which is a tuple), so the caller knows
-        the endpoint of the added path.
+        The "received" node, so the caller knows the endpoint of the added
+        path.
     """
     # We start by extracting the sent and received messages. Split the label
     # in the sent and received message. Remove the double quotes and the excess
@@ -285,12 +457,7 @@ def _merge_path_from_label(tree: ModelTree, root: tuple, label: str) -> tuple:
     ]
 
     # Append the sent and received messages to the tree
-    sent_node = root + (sent,)
-    received_node = root + (sent, received)
-    tree.add_edge(root, sent_node, label=sent)
-    tree.add_edge(sent_node, received_node, label=received)
-
-    return received_node
+    return tree.add_path((sent, received), root)
 
 
 def _dot_to_networkx(dot_graph):
@@ -348,10 +515,9 @@ def _construct_adg(path: Path) -> ModelTree:
     adg_root = [node for node in adg.nodes if adg.in_degree(node) == 0][0]
 
     tree = ModelTree()
-    tree_root = ()
-    tree.add_node(tree_root)
+    tree.add_node(tree.root)
 
-    return _merge_subadg(tree, tree_root, adg, adg_root)
+    return _merge_subadg(tree, tree.root, adg, adg_root)
 
 
 def _merge_subadg(tree, root, adg, current_node):
@@ -377,9 +543,7 @@ def _merge_subadg(tree, root, adg, current_node):
     for neighbor in neighbors:
         for _, edge in adg[current_node][neighbor].items():
             label = edge["label"].replace('"', "")
-            new_node = root + (label,)
-
-            tree.add_edge(root, new_node, label=label)
+            new_node = tree.add_child(root, label)
 
             # Recurse
             tree = _merge_subadg(tree, new_node, adg, neighbor)
@@ -392,19 +556,18 @@ def _construct_hdt(path: Path) -> ModelTree:
     directory.
     """
     tree = ModelTree()
-    tree_root = ()
-    tree.add_node(tree_root)
+    tree.add_node(tree.root)
 
     model_directories = sorted([item for item in path.iterdir() if item.is_dir()])
     for model_dir in model_directories:
         with open(model_dir / "model.gv") as f:
             graph = normalize_graph(f.read())
-            tree.add_edges_from(graph.edges(data=True))
+            nodes = tree.merge(graph)
             for leaf in graph.leaves:
                 try:
-                    tree.nodes[leaf]["models"].add(model_dir.name)
+                    tree.nodes[nodes[leaf]]["models"].add(model_dir.name)
                 except KeyError:
-                    tree.nodes[leaf]["models"] = {model_dir.name}
+                    tree.nodes[nodes[leaf]]["models"] = {model_dir.name}
 
     tree.condense()
     return tree
@@ -0,0 +1,205 @@
+"""Performance benchmarks of tlsprint itself.
+
+Where `benchmark.py` measures the number of probes needed for identification,
+this module measures how fast the code runs. Every case is timed a number of
+times, after which a single extra run measures the memory allocations using
+tracemalloc (which would skew the timings). The results are plain
+dictionaries, to be written as JSON.
+
+The peak resident set size of the process is included as well. This is the
+peak of the whole process so far, it never decreases, so it only tells
+something about the cases that raise it. Use the tracemalloc measurements to
+compare cases.
+"""
+
+import copy
+import statistics
+import time
+import tracemalloc
+from pathlib import Path
+
+from . import learn
+from .identify import INPUT_SELECTORS
+from .identify import MODEL_WEIGHTS
+from .identify import BenchmarkConnector
+from .identify import ResponseIndex
+from .identify import entropy_selector
+from .identify import identify
+from .shared import SharedTree
+from .simulate import Simulator
+from .simulate import SimulatorConnector
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def _process_peak_rss():
+    """Return the peak resident set size of this process since it started, in
+    bytes, or None if this is not supported on the platform."""
+    if resource is None:
+        return None
+    # On Linux ru_maxrss is in kilobytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _identify_all(trees_and_connectors):
+    for tree, model, connector in trees_and_connectors:
+        identify(tree, model, connector=connector)
+
+
+def _tree_cases(tree):
+    """Yield the cases for one of the bundled trees."""
+    weight_function = MODEL_WEIGHTS["usage"]
+    models = sorted(tree.models)
+
+    yield "condense", lambda: copy.deepcopy(tree), lambda x: x.condense()
+    yield (
+        "prune_models",
+        lambda: copy.deepcopy(tree),
+        lambda x: x.prune_models(models[: len(models) // 2]),
+    )
+
+    selectors = dict(INPUT_SELECTORS, entropy=entropy_selector)
+    for name, selector in sorted(selectors.items()):
+        yield (
+            f"selector.{name}",
+            lambda: None,
+            lambda _, selector=selector: selector(tree, tree.root, weight_function),
+        )
+
+    index = ResponseIndex(tree)
+    yield (
+        "identify",
+        lambda: [
+            (copy.deepcopy(tree), model, BenchmarkConnector(model, tree, index))
+            for model in models
+        ],
+        _identify_all,
+    )
+
+    shared_tree = SharedTree.from_tree(tree)
+    yield (
+        "identify.shared",
+        lambda: [
+            (shared_tree.session(), model, BenchmarkConnector(model, tree, index))
+            for model in models
+        ],
+        _identify_all,
+    )
+
+
+def _dedup_cases(path, bundled_trees):
+    """Yield the cases for a TLS version directory from the dedup command,
+    simulating the bundled trees of the same version if available."""
+    model_paths = sorted(p / "model.gv" for p in path.iterdir() if p.is_dir())
+    dot_graphs = [model_path.read_text() for model_path in model_paths]
+
+    yield (
+        "normalize_graph",
+        lambda: None,
+        lambda _: [learn.normalize_graph(dot_graph) for dot_graph in dot_graphs],
+    )
+    yield "construct_hdt", lambda: None, lambda _: learn._construct_hdt(path)
+
+    simulator = Simulator.from_dedup(path)
+    for tree_type, tree in sorted(bundled_trees.items()):
+        models = sorted(set(tree.models) & set(simulator.models))
+        yield (
+            f"identify.simulated.{tree_type}",
+            lambda tree=tree, models=models: [
+                (copy.deepcopy(tree), model, SimulatorConnector(simulator, model))
+                for model in models
+            ],
+            _identify_all,
+        )
+
+
+def _measure(setup, run, repeat):
+    """Time the case `repeat` times, then measure the memory of one more
+    run."""
+    wall_times = []
+    for _ in range(repeat):
+        argument = setup()
+        start = time.perf_counter()
+        run(argument)
+        wall_times.append(time.perf_counter() - start)
+
+    argument = setup()
+    tracemalloc.start()
+    try:
+        baseline, _ = tracemalloc.get_traced_memory()
+        run(argument)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "repeat": repeat,
+        "wall_time": {
+            "min": min(wall_times),
+            "mean": statistics.mean(wall_times),
+            "median": statistics.median(wall_times),
+            "max": max(wall_times),
+        },
+        "peak_memory": peak - baseline,
+        "retained_memory": current - baseline,
+        # Cumulative over all cases run so far, see the module docstring
+        "process_peak_rss": _process_peak_rss(),
+    }
+
+
+def perf_all(dedup_directory=None, repeat=5, name_filter=None):
+    """Run all performance cases and return the results.
+
+    Args:
+        dedup_directory: Optional output directory of the dedup command, to
+            also benchmark the construction of trees and the simulated
+            identification on the learned models.
+        repeat: Number of timed runs per case.
+        name_filter: Only run the cases with this string in their name.
+
+    Returns:
+        A list of dictionaries, one per case, with the name of the case, the
+        tree type and TLS version (if applicable), and the measurements.
+    """
+    from . import trees
+
+    cases = [
+        (
+            "trees.load",
+            None,
+            None,
+            lambda: None,
+            lambda _: trees._read_trees(),
+        )
+    ]
+    for tree_type, tls_versions in sorted(trees.trees.items()):
+        for version, tree in sorted(tls_versions.items()):
+            for name, setup, run in _tree_cases(tree):
+                cases.append((name, tree_type, version, setup, run))
+
+    if dedup_directory:
+        for path in sorted(p for p in Path(dedup_directory).iterdir() if p.is_dir()):
+            bundled_trees = {
+                tree_type: tls_versions[path.name]
+                for tree_type, tls_versions in trees.trees.items()
+                if path.name in tls_versions
+            }
+            for name, setup, run in _dedup_cases(path, bundled_trees):
+                cases.append((name, None, path.name, setup, run))
+
+    results = []
+    for name, tree_type, version, setup, run in cases:
+        if name_filter and name_filter not in name:
+            continue
+        results.append(
+            {
+                "case": name,
+                "type": tree_type,
+                "version": version,
+                **_measure(setup, run, repeat),
+            }
+        )
+    return results
@@ -0,0 +1,551 @@
+"""Distributed scanning of many targets.
+
+A coordinator owns a durable SQLite queue of targets, split into shards.
+Workers, on the same or on other hosts, connect to the coordinator and lease
+a shard at a time. A worker takes the targets of its shard one by one, every
+request renewing the lease. When a worker stops renewing its lease (for
+example because it crashed), the lease expires and the remaining targets of
+the shard are handed out again. Idle workers steal half of the remaining
+targets of the busiest shard, so a slow shard does not hold up the scan.
+
+The results are stored in the queue as well, in the order they were reported,
+and are written by the coordinator as a single stream of JSON lines, and
+optionally to a `store.ResultStore`. As the queue is durable, an interrupted
+scan continues where it left off.
+
+The coordinator and the workers talk newline delimited JSON over TCP, which
+allows running the whole scan on a single machine, for example against
+`tlsprint simulate`.
+"""
+
+import asyncio
+import copy
+import json
+import socket
+import sqlite3
+import time
+
+from . import instrument
+from . import probe
+from . import shared
+from .identify import STATUS_FAILED
+from .identify import _target_result
+from .identify import identify_target
+
+PENDING = "pending"
+RUNNING = "running"
+LEASED = "leased"
+DONE = "done"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    id INTEGER PRIMARY KEY,
+    status TEXT NOT NULL,
+    worker TEXT,
+    expires REAL
+);
+CREATE TABLE IF NOT EXISTS targets (
+    id INTEGER PRIMARY KEY,
+    shard INTEGER NOT NULL REFERENCES shards (id),
+    target TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    status TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS targets_shard ON targets (shard, status);
+CREATE UNIQUE INDEX IF NOT EXISTS targets_unique ON targets (target, port);
+CREATE TABLE IF NOT EXISTS results (
+    sequence INTEGER PRIMARY KEY AUTOINCREMENT,
+    target INTEGER NOT NULL UNIQUE REFERENCES targets (id),
+    worker TEXT,
+    result TEXT NOT NULL
+);
+"""
+
+
+def parse_target(line, default_port=443):
+    """Parse a line with HOST or HOST:PORT into a tuple (host, port). An IPv6
+    address with a port is written as [ADDRESS]:PORT, an address with more
+    than one colon and without brackets is an IPv6 address without a port."""
+    line = line.strip()
+    if line.startswith("["):
+        host, _, port = line[1:].partition("]")
+        port = port[1:] if port.startswith(":") else ""
+        return host, int(port) if port.isdigit() else default_port
+
+    host, _, port = line.rpartition(":")
+    if not host or ":" in host or not port.isdigit():
+        return line, default_port
+    return host, int(port)
+
+
+def format_target(host, port):
+    """Return the target as HOST:PORT, the inverse of `parse_target`."""
+    return f"[{host}]:{port}" if ":" in host else f"{host}:{port}"
+
+
+class ScanQueue:
+    def __init__(self, path, lease_time=600):
+        """Open (or create) the queue stored in the SQLite database at `path`.
+
+        Args:
+            path: Path of the database, ":memory:" for a temporary queue.
+            lease_time: Number of seconds after which a shard that is not
+                renewed by its worker is handed out again. This should be
+                longer than a single identification takes.
+        """
+        self.lease_time = lease_time
+        # The queue can be created in another thread than the event loop of
+        # the coordinator, access is never concurrent.
+        self.connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False
+        )
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def _execute(self, function):
+        """Call the function in a single transaction, and return its result.
+        The transaction is rolled back if the function raises an error."""
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            value = function()
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+        return value
+
+    def add(self, targets, shard_size=16):
+        """Add the targets, a list of (host, port) tuples, to the queue in
+        shards of `shard_size` targets. Targets that are already in the queue
+        are skipped, so adding the same targets again (for example when
+        restarting a scan) does not scan them twice. Returns the number of
+        added targets."""
+
+        def add():
+            # The targets are filtered before splitting them into shards, so
+            # no shard is left empty.
+            queued = [
+                target
+                for target in dict.fromkeys(targets)
+                if not self.connection.execute(
+                    "SELECT 1 FROM targets WHERE target = ? AND port = ?", target
+                ).fetchone()
+            ]
+            for start in range(0, len(queued), shard_size):
+                shard = self.connection.execute(
+                    "INSERT INTO shards (status) VALUES (?)", (PENDING,)
+                ).lastrowid
+                self.connection.executemany(
+                    "INSERT INTO targets (shard, target, port, status)"
+                    " VALUES (?, ?, ?, ?)",
+                    [
+                        (shard, target, port, PENDING)
+                        for target, port in queued[start : start + shard_size]
+                    ],
+                )
+            return len(queued)
+
+        return self._execute(add)
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM targets").fetchone()[0]
+
+    def counts(self):
+        """Return a dictionary with the number of targets per status."""
+        rows = self.connection.execute(
+            "SELECT status, COUNT(*) FROM targets GROUP BY status"
+        )
+        return {PENDING: 0, RUNNING: 0, DONE: 0, **dict(rows)}
+
+    @property
+    def finished(self):
+        """True if every target has a result."""
+        counts = self.counts()
+        return counts[PENDING] == counts[RUNNING] == 0
+
+    def _requeue_expired(self, now):
+        """Hand out the shards with an expired lease again, including the
+        target their worker was working on."""
+        expired = [
+            shard
+            for (shard,) in self.connection.execute(
+                "SELECT id FROM shards WHERE status = ? AND expires < ?",
+                (LEASED, now),
+            )
+        ]
+        for shard in expired:
+            instrument.count("scan.expired_leases")
+            self.connection.execute(
+                "UPDATE shards SET status = ?, worker = NULL, expires = NULL"
+                " WHERE id = ?",
+                (PENDING, shard),
+            )
+            self.connection.execute(
+                "UPDATE targets SET status = ? WHERE shard = ? AND status = ?",
+                (PENDING, shard, RUNNING),
+            )
+
+    def _steal(self, worker, now):
+        """Move half of the pending targets of the leased shard with the most
+        pending targets to a new shard, leased to `worker`. Returns the new
+        shard, or None if there is nothing to steal."""
+        row = self.connection.execute(
+            "SELECT targets.shard, COUNT(*) AS pending FROM targets"
+            " JOIN shards ON shards.id = targets.shard"
+            " WHERE shards.status = ? AND targets.status = ?"
+            " GROUP BY targets.shard ORDER BY pending DESC LIMIT 1",
+            (LEASED, PENDING),
+        ).fetchone()
+        if not row:
+            return None
+
+        victim, pending = row
+        stolen = [
+            target
+            for (target,) in self.connection.execute(
+                "SELECT id FROM targets WHERE shard = ? AND status = ?"
+                " ORDER BY id DESC LIMIT ?",
+                (victim, PENDING, (pending + 1) // 2),
+            )
+        ]
+        instrument.count("scan.stolen_targets", len(stolen))
+
+        shard = self.connection.execute(
+            "INSERT INTO shards (status, worker, expires) VALUES (?, ?, ?)",
+            (LEASED, worker, now + self.lease_time),
+        ).lastrowid
+        self.connection.executemany(
+            "UPDATE targets SET shard = ? WHERE id = ?",
+            [(shard, target) for target in stolen],
+        )
+        return shard
+
+    def lease(self, worker, now=None):
+        """Lease a shard to the worker and return its id. If no shard is
+        pending, targets are stolen from the busiest shard. Returns None if
+        there is nothing left to hand out."""
+        now = time.time() if now is None else now
+
+        def lease():
+            self._requeue_expired(now)
+            row = self.connection.execute(
+                "SELECT id FROM shards WHERE status = ? ORDER BY id LIMIT 1",
+                (PENDING,),
+            ).fetchone()
+            if not row:
+                return self._steal(worker, now)
+
+            self.connection.execute(
+                "UPDATE shards SET status = ?, worker = ?, expires = ? WHERE id = ?",
+                (LEASED, worker, now + self.lease_time, row[0]),
+            )
+            return row[0]
+
+        return self._execute(lease)
+
+    def next_target(self, shard, worker, now=None):
+        """Renew the lease and return the next target of the shard as a tuple
+        (id, host, port). Returns None when the shard is finished, or if the
+        lease of the worker expired."""
+        now = time.time() if now is None else now
+
+        def next_target():
+            owner = self.connection.execute(
+                "SELECT worker FROM shards WHERE id = ? AND status = ?",
+                (shard, LEASED),
+            ).fetchone()
+            if not owner or owner[0] != worker:
+                return None
+
+            row = self.connection.execute(
+                "SELECT id, target, port FROM targets WHERE shard = ? AND status = ?"
+                " ORDER BY id LIMIT 1",
+                (shard, PENDING),
+            ).fetchone()
+            if not row:
+                self.connection.execute(
+                    "UPDATE shards SET status = ?, expires = NULL WHERE id = ?",
+                    (DONE, shard),
+                )
+                return None
+
+            self.connection.execute(
+                "UPDATE targets SET status = ? WHERE id = ?", (RUNNING, row[0])
+            )
+            self.connection.execute(
+                "UPDATE shards SET expires = ? WHERE id = ?",
+                (now + self.lease_time, shard),
+            )
+            return tuple(row)
+
+        return self._execute(next_target)
+
+    def complete(self, target, worker, result):
+        """Store the result of the target. A result reported after the lease
+        expired is kept as well, but only the first result of a target is
+        stored. Returns True if the result was stored."""
+
+        def complete():
+            self.connection.execute(
+                "UPDATE targets SET status = ? WHERE id = ?", (DONE, target)
+            )
+            return self.connection.execute(
+                "INSERT OR IGNORE INTO results (target, worker, result)"
+                " VALUES (?, ?, ?)",
+                (target, worker, json.dumps(result)),
+            ).rowcount
+
+        return bool(self._execute(complete))
+
+    def results(self, after=0):
+        """Return the results stored after the sequence number `after`, as a
+        list of tuples (sequence, result)."""
+        return [
+            (sequence, json.loads(result))
+            for sequence, result in self.connection.execute(
+                "SELECT sequence, result FROM results WHERE sequence > ?"
+                " ORDER BY sequence",
+                (after,),
+            )
+        ]
+
+
+class ScanCoordinator:
+    """Hand out the shards of a `ScanQueue` to workers connecting over TCP.
+
+    Every request is a line of JSON with an "op" key, answered with a line of
+    JSON:
+
+        -   lease: Lease a shard to the "worker", answered with the "shard",
+            which is None if there is nothing to lease. The answer includes
+            whether the scan is "finished", so idle workers know when to
+            stop.
+        -   next: Return the next "target" of the "shard" leased by the
+            "worker", as a list [id, host, port] or None.
+        -   complete: Store the "result" of the "target".
+    """
+
+    def __init__(self, queue, output=None, store=None, output_results=0):
+        """Configure the coordinator, call `start` to start listening.
+
+        Args:
+            queue: The `ScanQueue` with the targets.
+            output: Optional text file to write the results to as JSON lines,
+                in the order they are reported. Results already in the queue
+                are written first.
+            store: Optional `store.ResultStore` to write the results to. The
+                results are buffered by the store, results lost when the
+                coordinator is interrupted are written again from the queue
+                when it is restarted.
+            output_results: Number of results of the queue already in the
+                output, written by an earlier run of the coordinator. These
+                are not written to the output again.
+        """
+        self.queue = queue
+        self.output = output
+        self.store = store
+        self.output_results = output_results
+        self.written = 0
+        self.count = 0
+        self.connections = 0
+        self.finished = None
+
+    def _write_results(self):
+        for sequence, result in self.queue.results(self.written):
+            if self.output and self.count >= self.output_results:
+                self.output.write(json.dumps(result) + "\n")
+            if self.store is not None:
+                self.store.write(result)
+            self.written = sequence
+            self.count += 1
+        if self.output:
+            self.output.flush()
+        if self.queue.finished:
+            if self.store is not None:
+                self.store.flush()
+            self.finished.set()
+
+    def request(self, request):
+        """Handle a single request and return the response."""
+        op = request["op"]
+        if op == "lease":
+            shard = self.queue.lease(request["worker"])
+            return {"shard": shard, "finished": self.queue.finished}
+        elif op == "next":
+            return {
+                "target": self.queue.next_target(request["shard"], request["worker"])
+            }
+        elif op == "complete":
+            stored = self.queue.complete(
+                request["target"], request["worker"], request["result"]
+            )
+            self._write_results()
+            return {"stored": stored}
+        raise ValueError(f"Unknown operation: {op}")
+
+    async def handle(self, reader, writer):
+        """Serve the requests of a worker until it closes the connection."""
+        self.connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = self.request(json.loads(line))
+                except (ValueError, KeyError, TypeError) as e:
+                    response = {"error": repr(e)}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def start(self, host="localhost", port=0):
+        """Start listening and return the `asyncio.Server`. The results
+        already in the queue are written immediately."""
+        # The event is created here, as it has to be bound to the running
+        # event loop.
+        self.finished = asyncio.Event()
+        self._write_results()
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def wait_finished(self, timeout=10):
+        """Wait until the scan is finished, and then until all workers have
+        disconnected (seeing the scan is finished) or the timeout expires."""
+        await self.finished.wait()
+        deadline = time.monotonic() + timeout
+        while self.connections and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+
+
+class ScanClient:
+    def __init__(self, address, timeout=60):
+        """Connection of a worker to a `ScanCoordinator` at `address`, a tuple
+        (host, port)."""
+        self.socket = socket.create_connection(address, timeout=timeout)
+        self.file = self.socket.makefile("rwb")
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def request(self, op, **kwargs):
+        self.file.write((json.dumps({"op": op, **kwargs}) + "\n").encode())
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("Coordinator closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise RuntimeError(f"Coordinator error: {response['error']}")
+        return response
+
+
+def identifier(tree=None, probe_target=True, **kwargs):
+    """Return a function identifying a single target for `run_worker`.
+
+    Args:
+        tree: Tree to use for every target. By default the bundled tree of the
+            highest TLS version supported by the target is used.
+        probe_target: Probe the TLS versions supported by every target, to
+            select the bundled tree. Without probing, TLS 1.2 is used.
+        kwargs: Passed to `identify_target`.
+
+    The result is that of `identify_target`, with the TLS version and the
+    implementations of the models added, so the output of a scan can be
+    interpreted without the trees.
+
+    The trees are condensed once and memory mapped (see `shared.bundled` and
+    `shared.cached`), so all workers on a host share a single copy, and the
+    included trees are not loaded by the workers. Every identification only
+    keeps its own `shared.TreeSession`.
+    """
+    protocol_version = kwargs.pop("protocol_version", None)
+    custom_tree = None
+    if tree is not None:
+        tree = copy.deepcopy(tree)
+        tree.condense()
+        custom_tree = shared.cached(tree)
+    else:
+        shared_trees = shared.bundled()
+
+    def identify(target, target_port):
+        start = time.monotonic()
+        version = protocol_version
+        if custom_tree is None:
+            if probe_target:
+                # Every target is probed once, so there is no use in caching
+                try:
+                    supported = probe.supported_versions(target, target_port)
+                except OSError as error:
+                    return _target_result(
+                        target, target_port, start, STATUS_FAILED, error=repr(error)
+                    )
+                version = probe.select_version(supported, shared_trees)
+                if not version:
+                    return _target_result(
+                        target,
+                        target_port,
+                        start,
+                        STATUS_FAILED,
+                        error="No supported TLS version with a tree",
+                    )
+            version = version or "TLS12"
+            selected = shared_trees[version].session()
+        else:
+            selected = custom_tree.session()
+
+        result = identify_target(
+            selected, target, target_port, protocol_version=version, **kwargs
+        )
+        result["tls_version"] = version
+        result["implementations"] = sorted(
+            set().union(
+                *(selected.model_mapping[model] for model in result["models"] or ())
+            )
+        )
+        return result
+
+    return identify
+
+
+def run_worker(client, worker, identify_function, poll_interval=1.0):
+    """Identify targets handed out by the coordinator, until the scan is
+    finished.
+
+    Args:
+        client: The `ScanClient` connected to the coordinator.
+        worker: Unique name of the worker.
+        identify_function: Called with the host and port of a target, returns
+            the result to report, for example `identify.identify_target`.
+        poll_interval: Seconds to wait before asking again, when all targets
+            are handed out but the scan is not finished yet.
+
+    Returns:
+        The number of targets identified by this worker.
+    """
+    identified = 0
+    while True:
+        response = client.request("lease", worker=worker)
+        if response["shard"] is None:
+            if response["finished"]:
+                return identified
+            # Other workers are still busy, a lease might expire
+            time.sleep(poll_interval)
+            continue
+
+        while True:
+            target = client.request("next", shard=response["shard"], worker=worker)[
+                "target"
+            ]
+            if target is None:
+                break
+            target_id, host, port = target
+            result = identify_function(host, port)
+            client.request("complete", target=target_id, worker=worker, result=result)
+            identified += 1
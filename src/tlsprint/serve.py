@@ -0,0 +1,227 @@
+"""Long running identification daemon.
+
+Every `tlsprint identify` call pays for starting Python and loading the trees.
+The daemon does this once, and identifies the targets submitted to it over a
+small HTTP API, on localhost or on a Unix socket:
+
+    -   POST /identify: Identify a single target, the body is a JSON object
+        with the "target" (HOST or HOST:PORT) and optionally the "port". The
+        response is the result of the identification.
+    -   POST /batch: Identify many targets, the body is a JSON object with a
+        list of "targets". The results are streamed as JSON lines (using
+        chunked encoding) in the order they finish.
+    -   GET /health: Status of the daemon, with the number of queued, running
+        and finished identifications.
+    -   GET /metrics: Totals of the timers and counters of `instrument`, since
+        the daemon started.
+
+The identifications run in a pool of threads, one per connector, which bounds
+the number of connectors (and their JVMs) running at the same time. Every
+connector is started for a single target, so only the trees are kept warm.
+The results are those of `scan.identifier`, as used by the scan workers.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import http
+import json
+import time
+
+from . import instrument
+from .scan import parse_target
+
+
+class IdentifyServer:
+    def __init__(self, identify_function, concurrency=4):
+        """Configure the server, call `start` or `start_unix` to start
+        listening.
+
+        Args:
+            identify_function: Called with the host and port of a target,
+                returns the result, for example the function returned by
+                `scan.identifier`.
+            concurrency: Maximum number of identifications running at the
+                same time, other targets are queued.
+        """
+        self.identify_function = identify_function
+        self.concurrency = concurrency
+        self.executor = concurrent.futures.ThreadPoolExecutor(concurrency)
+        self.metrics = instrument.AggregateSink()
+        self.started = time.time()
+        self.queued = 0
+        self.running = 0
+        self.statuses = collections.Counter()
+        # Futures of the executor, which are cancelled when closing
+        self.futures = set()
+
+    async def identify(self, target):
+        """Identify the target (HOST or HOST:PORT) as soon as a connector is
+        available, and return the result."""
+        host, port = parse_target(target)
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+
+        self.running += 1
+        future = self.executor.submit(self.identify_function, host, port)
+        self.futures.add(future)
+        future.add_done_callback(self.futures.discard)
+        future = asyncio.wrap_future(future)
+        # An identification keeps running in its thread when the request is
+        # cancelled, the connector is only released when it finishes.
+        future.add_done_callback(self._finished)
+        return await asyncio.shield(future)
+
+    def _finished(self, future):
+        self.running -= 1
+        self._semaphore.release()
+        if not future.cancelled() and future.exception() is None:
+            self.statuses[future.result()["status"]] += 1
+
+    def health(self):
+        return {
+            "status": "ok",
+            "uptime": time.time() - self.started,
+            "concurrency": self.concurrency,
+            "queued": self.queued,
+            "running": self.running,
+            "results": dict(self.statuses),
+        }
+
+    async def handle(self, reader, writer):
+        """Serve a single HTTP request, the connection is closed afterwards."""
+        try:
+            method, path, body = await _read_request(reader)
+            await self._route(method, path, body, writer)
+        except (ValueError, KeyError, TypeError, asyncio.IncompleteReadError) as e:
+            _write_response(writer, 400, {"error": repr(e)})
+        except ConnectionError:
+            pass
+        except Exception as e:
+            _write_response(writer, 500, {"error": repr(e)})
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body, writer):
+        routes = {
+            ("GET", "/health"): self._get_health,
+            ("GET", "/metrics"): self._get_metrics,
+            ("POST", "/identify"): self._post_identify,
+            ("POST", "/batch"): self._post_batch,
+        }
+        if (method, path) in routes:
+            await routes[method, path](body, writer)
+        elif path in {path for _, path in routes}:
+            _write_response(writer, 405, {"error": f"{method} not allowed"})
+        else:
+            _write_response(writer, 404, {"error": f"Unknown path: {path}"})
+
+    async def _get_health(self, body, writer):
+        _write_response(writer, 200, self.health())
+
+    async def _get_metrics(self, body, writer):
+        _write_response(
+            writer,
+            200,
+            {"timers": self.metrics.timers(), "counters": self.metrics.counters()},
+        )
+
+    async def _post_identify(self, body, writer):
+        request = json.loads(body)
+        target = _target(request["target"])
+        if "port" in request:
+            target = f"{target}:{int(request['port'])}"
+        _write_response(writer, 200, await self.identify(target))
+
+    async def _post_batch(self, body, writer):
+        targets = json.loads(body)["targets"]
+        if not isinstance(targets, list):
+            raise TypeError("targets must be a list")
+        targets = [_target(target) for target in targets]
+
+        tasks = [asyncio.ensure_future(self.identify(target)) for target in targets]
+        writer.write(_status_line(200, "application/x-ndjson", chunked=True))
+        try:
+            for task in asyncio.as_completed(tasks):
+                data = (json.dumps(await task) + "\n").encode()
+                writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        finally:
+            # The targets that are still queued are dropped when the client
+            # disconnects.
+            for task in tasks:
+                task.cancel()
+
+    def _prepare(self):
+        # The semaphore is created here, as it has to be bound to the running
+        # event loop.
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        instrument.add_sink(self.metrics)
+
+    async def start(self, host="localhost", port=8443):
+        """Start listening on TCP and return the `asyncio.Server`."""
+        self._prepare()
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def start_unix(self, path):
+        """Start listening on a Unix socket and return the `asyncio.Server`."""
+        self._prepare()
+        return await asyncio.start_unix_server(self.handle, path)
+
+    def close(self):
+        """Stop recording metrics, drop the queued identifications and wait
+        for the running ones."""
+        instrument.remove_sink(self.metrics)
+        # `shutdown(cancel_futures=True)` requires Python 3.9
+        for future in list(self.futures):
+            future.cancel()
+        self.executor.shutdown(wait=True)
+
+
+def _target(target):
+    if not isinstance(target, str):
+        raise TypeError(f"Target must be a string: {target!r}")
+    return target
+
+
+async def _read_request(reader):
+    """Read an HTTP request and return the method, path and body."""
+    request_line = await reader.readline()
+    if not request_line:
+        raise ConnectionError("Client closed the connection")
+    method, path, _ = request_line.decode().split(" ", maxsplit=2)
+
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode().strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    # The query string is not used
+    return method, path.split("?")[0], body
+
+
+def _status_line(status, content_type, length=None, chunked=False):
+    lines = [
+        f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}",
+        f"Content-Type: {content_type}",
+        "Connection: close",
+    ]
+    if chunked:
+        lines.append("Transfer-Encoding: chunked")
+    else:
+        lines.append(f"Content-Length: {length}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+def _write_response(writer, status, content):
+    data = (json.dumps(content) + "\n").encode()
+    writer.write(_status_line(status, "application/json", len(data)) + data)
@@ -0,0 +1,556 @@
+"""Read-only model trees shared between processes.
+
+Every identification prunes and condenses its own copy of the tree, which
+means a pool of worker processes holds many copies of the same tree. A
+`SharedTree` stores the tree once, as flat arrays in a single buffer: either
+a `multiprocessing.shared_memory` block or a memory mapped file. Processes
+attach to this buffer without copying it, and every identification uses a
+`TreeSession`, which only keeps track of the removed nodes and the changed
+models of the leaves.
+
+A `TreeSession` supports the operations of `ModelTree` used by the
+identification (`identify` with the default descent and any of the input
+selectors), with the same results.
+
+The included trees are condensed and written to the cache directory of
+tlsprint once per host (see `bundled`), so processes map these files without
+loading the included trees themselves.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy
+import pkg_resources
+
+from . import __version__
+from . import instrument
+from . import util
+from .learn import ModelTree
+
+_HEADER_SIZE = numpy.dtype("<u8").itemsize
+_ARRAYS = ("labels", "parents", "child_offsets", "children", "model_offsets", "models")
+
+
+def pack(tree):
+    """Return the contents of the buffer of a `SharedTree` for the tree.
+
+    The root is node 0, the other nodes are numbered in the order of
+    `tree.nodes`. The children of every node are stored in the order of
+    `tree[node]`, so a session iterates the tree in the same order as the
+    original.
+    """
+    nodes = sorted(tree.nodes, key=lambda node: node != tree.root)
+    ids = {node: index for index, node in enumerate(nodes)}
+    messages = sorted({tree.label(node) for node in nodes[1:]})
+    message_ids = {message: index for index, message in enumerate(messages)}
+    model_names = sorted(
+        {model for node in tree.nodes for model in tree.nodes[node].get("models", ())}
+    )
+    model_ids = {model: index for index, model in enumerate(model_names)}
+
+    arrays = {name: [] for name in _ARRAYS}
+    arrays["child_offsets"].append(0)
+    arrays["model_offsets"].append(0)
+    for node in nodes:
+        label = tree.label(node)
+        arrays["labels"].append(-1 if label is None else message_ids[label])
+        parents = list(tree.predecessors(node))
+        arrays["parents"].append(ids[parents[0]] if parents else -1)
+        arrays["children"] += [ids[child] for child in tree[node]]
+        arrays["child_offsets"].append(len(arrays["children"]))
+        arrays["models"] += sorted(
+            model_ids[model] for model in tree.nodes[node].get("models", ())
+        )
+        arrays["model_offsets"].append(len(arrays["models"]))
+
+    header = {
+        "messages": messages,
+        "models": model_names,
+        "model_mapping": {
+            model: sorted(implementations)
+            for model, implementations in getattr(tree, "model_mapping", {}).items()
+        },
+        "arrays": {},
+    }
+    data = b""
+    for name in _ARRAYS:
+        array = numpy.asarray(arrays[name], dtype="<i4")
+        header["arrays"][name] = [len(data), len(array)]
+        data += array.tobytes()
+
+    encoded = json.dumps(header).encode()
+    # Align the arrays, the header is padded with spaces
+    encoded += b" " * (-(_HEADER_SIZE + len(encoded)) % 8)
+    return len(encoded).to_bytes(_HEADER_SIZE, "little") + encoded + data
+
+
+class SharedTree:
+    def __init__(self, buffer, *, shm=None, path=None):
+        """Wrap a buffer with the contents returned by `pack`, without copying
+        it. Use `publish`, `attach`, `write` or `open` to create one."""
+        self._shm = shm
+        self._path = path
+        self._buffer = buffer
+
+        header_size = int.from_bytes(bytes(buffer[:_HEADER_SIZE]), "little")
+        header = json.loads(bytes(buffer[_HEADER_SIZE : _HEADER_SIZE + header_size]))
+        start = _HEADER_SIZE + header_size
+
+        self.messages = header["messages"]
+        self.message_ids = {
+            message: index for index, message in enumerate(self.messages)
+        }
+        self.model_names = header["models"]
+        self.model_mapping = {
+            model: {tuple(implementation) for implementation in implementations}
+            for model, implementations in header["model_mapping"].items()
+        }
+        for name, (offset, length) in header["arrays"].items():
+            array = numpy.frombuffer(
+                buffer, dtype="<i4", count=length, offset=start + offset
+            )
+            setattr(self, name, array)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def child(self, node_id, message):
+        """Return the id of the child of the node reached by the message, None
+        if there is no such child."""
+        label = self.message_ids.get(message)
+        if label is None:
+            return None
+        start, end = self.child_offsets[node_id : node_id + 2]
+        children = self.children[start:end]
+        matches = children[self.labels[children] == label]
+        return int(matches[0]) if len(matches) else None
+
+    @classmethod
+    def from_tree(cls, tree):
+        """Create a shared tree in a private buffer of this process."""
+        return cls(pack(tree))
+
+    @classmethod
+    def publish(cls, tree, name=None):
+        """Store the tree in a new shared memory block, which other processes
+        can `attach` to by its `name`. The block is removed by `unlink`.
+
+        Shared memory blocks require Python 3.8, on older versions the tree
+        is memory mapped from the cache instead (see `cached`), which is
+        shared the same way when pickled."""
+        shared_memory = _shared_memory()
+        if shared_memory is None:
+            return cached(tree)
+
+        data = pack(tree)
+        shm = shared_memory.SharedMemory(name, create=True, size=len(data))
+        shm.buf[: len(data)] = data
+        return cls(shm.buf[: len(data)], shm=shm)
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to a shared memory block created by `publish`."""
+        from multiprocessing import resource_tracker
+        from multiprocessing import shared_memory
+
+        shm = shared_memory.SharedMemory(name)
+        # Only the publishing process owns the block, an attaching process
+        # would otherwise remove it when exiting.
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm.buf, shm=shm)
+
+    @property
+    def name(self):
+        """Name of the shared memory block, None if not published."""
+        return self._shm.name if self._shm else None
+
+    @staticmethod
+    def write(tree, path):
+        """Write the tree to a file, to be opened with `open`. The file is
+        replaced atomically, so processes can open it at any time."""
+        _write(pack(tree), path)
+
+    @classmethod
+    def open(cls, path):
+        """Memory map a file written by `write`. The pages are shared by all
+        processes mapping the same file."""
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapped, path=path)
+
+    def __reduce__(self):
+        # Passing a published or mapped tree to another process (for example
+        # to a process pool) attaches to the same buffer instead of copying.
+        if self._shm:
+            return SharedTree.attach, (self._shm.name,)
+        if self._path:
+            return SharedTree.open, (self._path,)
+        return SharedTree, (bytes(self._buffer),)
+
+    def close(self):
+        """Release the buffer of this process, the sessions can no longer be
+        used."""
+        for name in _ARRAYS:
+            setattr(self, name, None)
+        buffer, self._buffer = self._buffer, None
+        if isinstance(buffer, memoryview):
+            buffer.release()
+        elif isinstance(buffer, mmap.mmap):
+            buffer.close()
+        if self._shm:
+            self._shm.close()
+
+    def unlink(self):
+        """Remove the shared memory block, after all processes closed it."""
+        if self._shm:
+            self._shm.unlink()
+
+    def session(self):
+        """Return a new `TreeSession`, to be used for a single
+        identification."""
+        return TreeSession(self)
+
+    def to_tree(self):
+        """Return the tree as a `ModelTree`."""
+        return self.session().to_tree()
+
+
+def _shared_memory():
+    """Return the `multiprocessing.shared_memory` module, or None before
+    Python 3.8."""
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:
+        return None
+    return shared_memory
+
+
+def _write(data, path):
+    # A unique temporary file, as other processes might write the same path
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+# Serializes writing the cache within a process, see `cached` and `bundled`
+_cache_lock = threading.Lock()
+
+# Maximum number of trees stored by `cached`, the least recently used trees
+# are removed first.
+CACHED_TREES = 8
+
+
+def _cache_directory():
+    """Return the directory of the cached trees of this version of tlsprint.
+    The trees cached by other versions are removed, as these are no longer
+    used."""
+    root = util.cache_directory() / "trees"
+    directory = root / __version__
+    if not directory.exists():
+        if root.exists():
+            for path in root.iterdir():
+                if path.is_dir():
+                    shutil.rmtree(path, True)
+                else:
+                    path.unlink()
+        directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def cached(tree):
+    """Return the tree as a memory mapped `SharedTree`, stored in the cache
+    directory of tlsprint. All processes using the same tree map the same
+    file. At most `CACHED_TREES` trees are kept."""
+    data = pack(tree)
+    with _cache_lock:
+        directory = _cache_directory()
+        path = directory / f"{hashlib.sha256(data).hexdigest()}.tree"
+        if path.exists():
+            # Mark the tree as recently used
+            os.utime(path)
+        else:
+            _write(data, path)
+            unused = sorted(
+                directory.glob("*.tree"), key=lambda x: x.stat().st_mtime, reverse=True
+            )[CACHED_TREES:]
+            for unused_path in unused:
+                # Processes that mapped the file keep using it
+                unused_path.unlink()
+        return SharedTree.open(path)
+
+
+def bundled_paths(tree_type="adg"):
+    """Return the paths of the included trees of the type, keyed by TLS
+    version, as written by `SharedTree.write`.
+
+    The trees are condensed before writing, so identifications start from a
+    session without condensing it. The files are written to the cache
+    directory by the first process that needs them, other processes only map
+    these, without loading the included trees (see `tlsprint.trees`).
+    """
+    data_path = Path(pkg_resources.resource_filename(__name__, "data")) / tree_type
+    with _cache_lock:
+        directory = _cache_directory() / tree_type
+        paths = {}
+        for source in sorted(data_path.glob("*.p")):
+            path = directory / f"{source.stem}.tree"
+            if not path.exists():
+                with open(source, "rb") as f:
+                    tree = pickle.load(f)
+                tree.condense()
+                directory.mkdir(exist_ok=True)
+                SharedTree.write(tree, path)
+            paths[source.stem] = path
+    return paths
+
+
+def bundled(tree_type="adg"):
+    """Return the included trees of the type as memory mapped, condensed
+    `SharedTree` objects, keyed by TLS version, see `bundled_paths`."""
+    return {
+        version: SharedTree.open(path)
+        for version, path in bundled_paths(tree_type).items()
+    }
+
+
+class _Subtree:
+    def __init__(self, session, node_id):
+        self.session = session
+        self.node_id = node_id
+
+    @property
+    def leaves(self):
+        return [int(x) for x in self.session._leaves_below(self.node_id)]
+
+    @property
+    def models(self):
+        return self.session._models_of(self.session._leaves_below(self.node_id))
+
+
+class _NodeView:
+    def __init__(self, session):
+        self.session = session
+
+    def __getitem__(self, node):
+        if node not in self.session:
+            raise KeyError(node)
+        return {"models": self.session._leaf_models(node)}
+
+    def __iter__(self):
+        return map(int, numpy.flatnonzero(~self.session.removed))
+
+    def __len__(self):
+        return len(self.session)
+
+
+class TreeSession:
+    """Prunable view of a `SharedTree`, with the interface of a `ModelTree`.
+
+    Nodes are the ids of the shared tree, which are not the nodes of the
+    original `ModelTree`, use `path` and `find` to compare them. The session
+    itself only stores which nodes are removed and the models of the leaves
+    that changed, the structure of the tree is read from the shared buffer.
+    """
+
+    root = 0
+
+    def __init__(self, shared):
+        self.shared = shared
+        self.model_mapping = shared.model_mapping
+        self.removed = numpy.zeros(len(shared), dtype=bool)
+        self.changed_models = {}
+        self._size = len(shared)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, node):
+        # The descendants of a removed node are removed as well, so only the
+        # node itself has to be checked.
+        return 0 <= node < len(self.removed) and not self.removed[node]
+
+    def __getitem__(self, node):
+        if node not in self:
+            raise KeyError(node)
+        return [int(x) for x in self._children(node)]
+
+    @property
+    def nodes(self):
+        return _NodeView(self)
+
+    @property
+    def leaves(self):
+        return [int(x) for x in self._leaf_ids()]
+
+    @property
+    def models(self):
+        return self._models_of(self._leaf_ids())
+
+    def out_degree(self, node):
+        return len(self[node])
+
+    def subtree(self, node):
+        """Return a view on the subtree where `node` is the root, providing
+        its leaves and models."""
+        if node not in self:
+            raise KeyError(node)
+        return _Subtree(self, node)
+
+    def label(self, node):
+        """See `ModelTree.label`."""
+        label = self.shared.labels[node]
+        return None if label < 0 else self.shared.messages[label]
+
+    def child(self, node, message):
+        """See `ModelTree.child`."""
+        if node not in self:
+            return None
+        child = self.shared.child(node, message)
+        return child if child is not None and child in self else None
+
+    def find(self, path, node=None):
+        """See `ModelTree.find`."""
+        node = self.root if node is None else node
+        if node not in self:
+            return None
+        for message in path:
+            node = self.child(node, message)
+            if node is None:
+                return None
+        return node
+
+    def path(self, node):
+        """See `ModelTree.path`."""
+        path = []
+        while self.shared.parents[node] >= 0:
+            path.append(self.label(node))
+            node = self.shared.parents[node]
+        return tuple(reversed(path))
+
+    def _children(self, node_id):
+        start, end = self.shared.child_offsets[node_id : node_id + 2]
+        children = self.shared.children[start:end]
+        return children[~self.removed[children]]
+
+    def _leaf_ids(self):
+        parents = self.shared.parents
+        alive = ~self.removed
+        child_count = numpy.bincount(
+            parents[alive & (parents >= 0)], minlength=len(parents)
+        )
+        return numpy.flatnonzero(alive & (child_count == 0))
+
+    def _leaves_below(self, node_id):
+        leaves = []
+        stack = [node_id]
+        while stack:
+            current = stack.pop()
+            children = self._children(current)
+            if len(children):
+                stack.extend(reversed(children))
+            else:
+                leaves.append(current)
+        return leaves
+
+    def _leaf_models(self, node_id):
+        if node_id in self.changed_models:
+            return self.changed_models[node_id]
+        start, end = self.shared.model_offsets[node_id : node_id + 2]
+        names = self.shared.model_names
+        return {names[x] for x in self.shared.models[start:end]}
+
+    def _models_of(self, leaf_ids):
+        models = set()
+        for leaf_id in leaf_ids:
+            models |= self._leaf_models(leaf_id)
+        return models
+
+    def _remove(self, node_id):
+        self.removed[node_id] = True
+        self.changed_models.pop(node_id, None)
+        self._size -= 1
+
+    def _prune_node(self, node_id):
+        """See `ModelTree.prune_node`."""
+        parent = self.shared.parents[node_id]
+        if parent >= 0 and len(self._children(parent)) == 1:
+            self._prune_node(parent)
+        self._remove(node_id)
+
+    @instrument.timed("tree.prune_models")
+    def prune_models(self, models):
+        """See `ModelTree.prune_models`."""
+        models = set(models)
+        for leaf_id in self._leaf_ids():
+            leaf_models = self._leaf_models(leaf_id)
+            # Only the leaves that change are stored in the session
+            if leaf_models.isdisjoint(models):
+                continue
+            remaining = leaf_models - models
+            if remaining:
+                self.changed_models[leaf_id] = remaining
+            else:
+                self._prune_node(leaf_id)
+
+    @instrument.timed("tree.condense")
+    def condense(self):
+        """See `ModelTree.condense`."""
+        self._condense()
+
+    def _condense(self):
+        models = self.models
+        for leaf_id in self._leaf_ids():
+            if self._leaf_models(leaf_id) == models:
+                self._prune_node(leaf_id)
+
+        parents = self.shared.parents
+        ancestors = {parents[parents[x]] for x in self._leaf_ids() if parents[x] > 0}
+
+        start_size = len(self)
+        for node_id in ancestors:
+            leaves = self._leaves_below(node_id)
+            models = self._models_of(leaves)
+
+            redundant = set()
+            for input_id in self._children(node_id):
+                outputs = self._children(input_id)
+                if len(outputs) == 1 and outputs[0] in leaves:
+                    redundant.update([input_id, outputs[0]])
+            for redundant_id in redundant:
+                self._remove(redundant_id)
+
+            if not len(self._children(node_id)):
+                self.changed_models[node_id] = models
+
+        if len(self) != start_size:
+            self._condense()
+
+    def to_tree(self):
+        """Return the current state of the session as a `ModelTree`, for
+        example to draw it."""
+        tree = ModelTree()
+        for node in self.nodes:
+            label = self.label(node)
+            if label is None:
+                tree.add_node(node)
+            else:
+                tree.add_node(node, message=tree.intern(label))
+                tree.add_edge(int(self.shared.parents[node]), node, label=label)
+            if not len(self._children(node)):
+                tree.nodes[node]["models"] = self._leaf_models(node)
+        tree.graph["next_node"] = len(self.shared)
+        tree.model_mapping = self.model_mapping
+        return tree
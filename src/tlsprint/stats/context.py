@@ -0,0 +1,135 @@
+"""Shared input of the stats handlers.
+
+The model and dedup directories are scanned at most once, no matter how many
+stats types are requested. Parsing the models with pydot is by far the most
+expensive part, so the parsed summaries are done in parallel and cached on
+disk, keyed by the hash of the model file.
+"""
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import pathlib
+
+from .. import learn
+from .. import util
+
+
+def default_cache_file():
+    return util.cache_directory() / "stats.json"
+
+
+def _graph_summary(dot_graph: str):
+    graph = learn._dot_to_networkx(dot_graph)
+
+    # Compensate for the dummy __start node
+    return {"nodes": len(graph) - 1, "edges": graph.number_of_edges() - 1}
+
+
+class StatsContext:
+    def __init__(self, *, models_dir=None, dedup_dir=None, cache_file=None, jobs=None):
+        """Lazily scan the directories, the results are kept for the lifetime
+        of the context.
+
+        Args:
+            models_dir: Directory containing the raw models, grouped by
+                implementation, version and TLS version.
+            dedup_dir: Output directory of the dedup command.
+            cache_file: JSON file to cache the graph summaries in, no cache is
+                used if None.
+            jobs: Number of processes used to parse the models.
+        """
+        self.models_dir = models_dir
+        self.dedup_dir = dedup_dir
+        self.cache_file = cache_file
+        self.jobs = jobs
+
+        self._models = None
+        self._dedup = None
+
+    @property
+    def models(self):
+        """Dictionary mapping every implementation to a dictionary, mapping
+        every version of the implementation to its list of TLS versions."""
+        if self._models is None:
+            self._models = {}
+            implementation_paths = [
+                p for p in pathlib.Path(self.models_dir).iterdir() if p.is_dir()
+            ]
+            for implementation_path in sorted(implementation_paths):
+                self._models[implementation_path.name] = {
+                    version_path.name: sorted(x.name for x in version_path.iterdir())
+                    for version_path in sorted(implementation_path.iterdir())
+                    if version_path.is_dir()
+                }
+        return self._models
+
+    @property
+    def dedup(self):
+        """Dictionary mapping every TLS version to a list of the unique models,
+        every model is a dictionary with the keys:
+
+            -   name: Name of the model directory.
+            -   versions: The implementations and versions with this model.
+            -   nodes: Number of states of the model.
+            -   edges: Number of transitions of the model.
+        """
+        if self._dedup is None:
+            self._dedup = self._scan_dedup()
+        return self._dedup
+
+    def _scan_dedup(self):
+        dedup = {}
+        contents = {}
+        tls_paths = [p for p in pathlib.Path(self.dedup_dir).iterdir() if p.is_dir()]
+        for tls_path in sorted(tls_paths):
+            dedup[tls_path.name] = []
+            for model_path in sorted(p for p in tls_path.iterdir() if p.is_dir()):
+                with open(model_path / "versions.json") as f:
+                    versions = json.load(f)
+                with open(model_path / "model.gv", "rb") as f:
+                    content = f.read()
+
+                digest = hashlib.sha256(content).hexdigest()
+                contents[digest] = content
+                dedup[tls_path.name].append(
+                    {"name": model_path.name, "versions": versions, "hash": digest}
+                )
+
+        summaries = self._graph_summaries(contents)
+        for models in dedup.values():
+            for model in models:
+                model.update(summaries[model.pop("hash")])
+        return dedup
+
+    def _graph_summaries(self, contents):
+        """Return the summary of every graph in `contents`, which maps hashes
+        to the contents of the model files. Only the graphs missing from the
+        cache are parsed."""
+        cache = {}
+        if self.cache_file and os.path.exists(self.cache_file):
+            with open(self.cache_file) as f:
+                cache = json.load(f)
+
+        missing = sorted(contents.keys() - cache.keys())
+        if missing:
+            with concurrent.futures.ProcessPoolExecutor(self.jobs) as executor:
+                parsed = executor.map(
+                    _graph_summary, [contents[digest].decode() for digest in missing]
+                )
+                cache.update(zip(missing, parsed))
+
+            if self.cache_file:
+                pathlib.Path(self.cache_file).parent.mkdir(parents=True, exist_ok=True)
+                with open(self.cache_file, "w") as f:
+                    json.dump(cache, f)
+
+        return {digest: cache[digest] for digest in contents}
+
+    @property
+    def trees(self):
+        """The bundled trees, see `tlsprint.trees`."""
+        from .. import trees
+
+        return trees.trees
@@ -1,15 +1,12 @@
 import collections
-import pathlib
 
 
-def _implementation_summary(implementation_path: pathlib.Path):
-    summary = {"Name": implementation_path.name}
-
-    version_paths = [p for p in implementation_path.iterdir() if p.is_dir()]
+def _implementation_summary(name, versions):
+    summary = {"Name": name}
 
     # To count the number of models for a given implementation, we need a list
     # of the supported TLS versions for each implementation version.
-    tls_versions = [x.name for p in version_paths for x in p.iterdir()]
+    tls_versions = [x for tls_versions in versions.values() for x in tls_versions]
     tls_counts = collections.Counter(tls_versions)
 
     # Merge the counts with the existing summary info
@@ -21,16 +18,13 @@ def _implementation_summary(implementation_path: pathlib.Path):
     return summary
 
 
-def summary(*, models_dir: str = None, **kwargs):
+def summary(context):
     """Return a summary of the number of learned models per implementation and
     TLS version as a dictionary. This uses the directory containing the raw
     models.
     """
-    models_path = pathlib.Path(models_dir)
-    implementation_paths = [p for p in models_path.iterdir() if p.is_dir()]
-
     summary = []
-    for path in sorted(implementation_paths):
-        summary.append(_implementation_summary(path))
+    for name, versions in sorted(context.models.items()):
+        summary.append(_implementation_summary(name, versions))
 
     return summary
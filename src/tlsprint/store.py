@@ -0,0 +1,303 @@
+"""Durable store of identification results.
+
+The results of `identify.identify_target` (as reported by `scan.identifier`)
+are stored in an SQLite database, with a row per target. The models and
+candidates of every result are stored in a separate table, keyed on the
+model and the TLS version first, so finding all targets with a model is a
+range scan of the primary key instead of a scan of all results. The models
+are numbered per TLS version (see `dedup`), the same model name in another
+version is an unrelated model.
+
+Results are written in bulk, every transaction storing up to `batch_size`
+results. A target is stored once, a later result of the same target and port
+replaces the earlier one. Scans use `ResultStore.remaining` to skip the
+targets that are already done.
+"""
+
+import json
+import sqlite3
+import time
+
+from .identify import STATUS_FINISHED
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    target TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    tls_version TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    duration REAL,
+    stored REAL NOT NULL,
+    transcript TEXT,
+    result TEXT NOT NULL,
+    UNIQUE (target, port)
+);
+CREATE INDEX IF NOT EXISTS results_status ON results (status);
+CREATE TABLE IF NOT EXISTS models (
+    model TEXT NOT NULL,
+    -- Empty if the TLS version of the tree is not known
+    tls_version TEXT NOT NULL,
+    result INTEGER NOT NULL REFERENCES results (id),
+    matched INTEGER NOT NULL,
+    share REAL,
+    PRIMARY KEY (model, tls_version, result)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS models_result ON models (result);
+"""
+
+
+class ResultStore:
+    def __init__(self, path, batch_size=1000, flush_interval=5.0):
+        """Open (or create) the store in the SQLite database at `path`.
+
+        Args:
+            path: Path of the database, ":memory:" for a temporary store.
+            batch_size: Number of results buffered by `write`, before they
+                are stored in a single transaction.
+            flush_interval: Seconds after which `write` stores the buffered
+                results, even if there are fewer than `batch_size`.
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.flushed = time.monotonic()
+        self.connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False
+        )
+        # The write ahead log allows querying while a scan is storing results
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Store the buffered results and close the database."""
+        self.flush()
+        self.connection.close()
+
+    def write(self, result):
+        """Buffer the result, the buffer is stored when it holds `batch_size`
+        results, after `flush_interval` seconds, or by calling `flush`."""
+        self.buffer.append(result)
+        if (
+            len(self.buffer) >= self.batch_size
+            or time.monotonic() - self.flushed >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.add(self.buffer)
+            self.buffer = []
+        self.flushed = time.monotonic()
+
+    def add(self, results):
+        """Store the results in a single transaction, replacing earlier results
+        of the same targets."""
+        # Only the last result of a target in the batch is kept
+        results = list({(r["target"], r["port"]): r for r in results}.values())
+        keys = [(result["target"], result["port"]) for result in results]
+        stored = time.time()
+
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.executemany(
+                "DELETE FROM models WHERE result IN"
+                " (SELECT id FROM results WHERE target = ? AND port = ?)",
+                keys,
+            )
+            self.connection.executemany(
+                "DELETE FROM results WHERE target = ? AND port = ?", keys
+            )
+            model_rows = []
+            for result in results:
+                result_id = self.connection.execute(
+                    "INSERT INTO results (target, port, tls_version, status, error,"
+                    " duration, stored, transcript, result)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    _result_row(result, stored),
+                ).lastrowid
+                model_rows.extend(
+                    (model, result.get("tls_version") or "", result_id, matched, share)
+                    for model, matched, share in _model_rows(result)
+                )
+            self.connection.executemany(
+                "INSERT INTO models (model, tls_version, result, matched, share)"
+                " VALUES (?, ?, ?, ?, ?)",
+                model_rows,
+            )
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def __len__(self):
+        self.flush()
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def counts(self):
+        """Return a dictionary with the number of results per status."""
+        self.flush()
+        return dict(
+            self.connection.execute(
+                "SELECT status, COUNT(*) FROM results GROUP BY status"
+            )
+        )
+
+    def status(self, target, port=443):
+        """Return the status of the stored result of the target, or None if
+        there is no result."""
+        self.flush()
+        row = self.connection.execute(
+            "SELECT status FROM results WHERE target = ? AND port = ?",
+            (target, port),
+        ).fetchone()
+        return row[0] if row else None
+
+    def remaining(self, targets, retry_failed=False):
+        """Return the targets, tuples (host, port), without a stored result, in
+        the given order. With `retry_failed`, targets of which the
+        identification did not finish are included as well."""
+        self.flush()
+        # The targets are joined with the results in a single query, using a
+        # temporary table.
+        self.connection.execute("BEGIN")
+        try:
+            self.connection.execute(
+                "CREATE TEMP TABLE remaining_targets"
+                " (position INTEGER PRIMARY KEY, target TEXT, port INTEGER)"
+            )
+            self.connection.executemany(
+                "INSERT INTO remaining_targets (target, port) VALUES (?, ?)",
+                targets,
+            )
+            rows = self.connection.execute(
+                "SELECT remaining_targets.target, remaining_targets.port"
+                " FROM remaining_targets LEFT JOIN results"
+                " ON results.target = remaining_targets.target"
+                " AND results.port = remaining_targets.port"
+                " WHERE results.id IS NULL OR (? AND results.status != ?)"
+                " ORDER BY remaining_targets.position",
+                (retry_failed, STATUS_FINISHED),
+            ).fetchall()
+        finally:
+            self.connection.execute("DROP TABLE IF EXISTS temp.remaining_targets")
+            self.connection.execute("COMMIT")
+        return [tuple(row) for row in rows]
+
+    def get(self, target, port=443):
+        """Return the stored result of the target, or None."""
+        self.flush()
+        row = self.connection.execute(
+            "SELECT result, transcript FROM results WHERE target = ? AND port = ?",
+            (target, port),
+        ).fetchone()
+        return _load(*row) if row else None
+
+    def hosts(self, model, tls_version=None, candidates=False):
+        """Return the targets, tuples (host, port), identified as the model, in
+        the order they were stored.
+
+        Args:
+            model: Name of the model.
+            tls_version: TLS version of the tree of the model. Models are
+                numbered per TLS version, without a version the model of
+                every version is included.
+            candidates: Include the targets that have the model as one of
+                the remaining candidates (see `identify
+                --stop-at-confidence`).
+        """
+        self.flush()
+        conditions, parameters = _model_conditions(model, tls_version, candidates)
+        return [
+            tuple(row)
+            for row in self.connection.execute(
+                "SELECT results.target, results.port FROM models"
+                " JOIN results ON results.id = models.result"
+                f" WHERE {' AND '.join(conditions)}"
+                " ORDER BY models.result",
+                parameters,
+            )
+        ]
+
+    def query(
+        self, target=None, model=None, tls_version=None, status=None, candidates=False
+    ):
+        """Yield the stored results in the order they were stored, optionally
+        only those of the target (on any port), the model (see `hosts`), the
+        TLS version or with the status."""
+        self.flush()
+        tables = "results"
+        conditions = []
+        parameters = []
+        if model is not None:
+            tables += " JOIN models ON models.result = results.id"
+            conditions, parameters = _model_conditions(model, tls_version, candidates)
+        elif tls_version is not None:
+            conditions.append("results.tls_version = ?")
+            parameters.append(tls_version)
+        for column, value in [("target", target), ("status", status)]:
+            if value is not None:
+                conditions.append(f"results.{column} = ?")
+                parameters.append(value)
+
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self.connection.execute(
+            f"SELECT results.result, results.transcript FROM {tables}{where}"
+            " ORDER BY results.id",
+            parameters,
+        )
+        for row in rows:
+            yield _load(*row)
+
+
+def _model_conditions(model, tls_version, candidates):
+    """Return the conditions and parameters selecting the rows of the models
+    table, for `hosts` and `query`."""
+    conditions = ["models.model = ?", "models.matched >= ?"]
+    parameters = [model, 0 if candidates else 1]
+    if tls_version is not None:
+        conditions.append("models.tls_version = ?")
+        parameters.append(tls_version)
+    return conditions, parameters
+
+
+def _result_row(result, stored):
+    """Return the values of the columns of the results table. The transcript
+    is stored in its own column, so it is only decoded when needed."""
+    result = dict(result)
+    transcript = result.pop("transcript", None)
+    return (
+        result["target"],
+        result["port"],
+        result.get("tls_version"),
+        result["status"],
+        result.get("error"),
+        result.get("duration"),
+        stored,
+        json.dumps(transcript) if transcript is not None else None,
+        json.dumps(result),
+    )
+
+
+def _model_rows(result):
+    """Yield tuples (model, matched, share) for the models and remaining
+    candidates of the result."""
+    models = set(result.get("models") or ())
+    shares = dict(result.get("candidates") or ())
+    for model in sorted(models | set(shares)):
+        yield model, int(model in models), shares.get(model)
+
+
+def _load(result, transcript):
+    result = json.loads(result)
+    if transcript is not None:
+        result["transcript"] = json.loads(transcript)
+    return result
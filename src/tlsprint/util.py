@@ -1,13 +1,18 @@
+import hashlib
+import json
+import os
+import shutil
 from collections import defaultdict
 from pathlib import Path
 
 import networkx
 
 
-def prefix_nodes(graph, prefix):
-    """Prefix every node of the graph with the specified prefix."""
+def prefix_nodes(graph, prefix, *, copy=True):
+    """Prefix every node of the graph with the specified prefix. If `copy` is
+    False, the graph is relabeled in place instead of returning a copy."""
     mapping = {node: f"{prefix}{node}" for node in graph.nodes}
-    return networkx.relabel_nodes(graph, mapping)
+    return networkx.relabel_nodes(graph, mapping, copy=copy)
 
 
 def add_resets_edges(graph, start):
@@ -18,10 +23,15 @@ def add_resets_edges(graph, start):
             graph.add_edge(node, start, label="RESET / ")
 
 
-def convert_graph(graph, *, add_resets=False):
+def convert_graph(graph, *, add_resets=False, prefix=None):
     """Convert a graph from LearnLib DOT output to dict, with the structure
-    required by adg-finder.
+    required by adg-finder. This modifies the graph, if a `prefix` is given
+    the nodes are prefixed in place, without the copy made by default by
+    `prefix_nodes`.
     # """
+    if prefix:
+        graph = prefix_nodes(graph, prefix, copy=False)
+
     converted = {}
 
     # The first (and only) state connected to the dummy_start, is the actual
@@ -60,43 +70,161 @@ def convert_graph(graph, *, add_resets=False):
     return converted
 
 
-def dedup_model_dir(model_directory):
-    """Read and deduplicate all models found in the directory and return the
-    results."""
+DEDUP_MANIFEST = "manifest.json"
+
+
+def _scan_sources(root, previous_sources):
+    """Return the hash of every `learnedModel.dot` in the models directory,
+    keyed by its path relative to `root`. Files with the same size and mtime
+    as in `previous_sources` are not read again."""
+    sources = {}
+    for path in sorted(root.glob("*/*/*/learnedModel.dot")):
+        key = path.relative_to(root).as_posix()
+        stat = path.stat()
+        previous = previous_sources.get(key)
+        if (
+            previous
+            and previous["mtime"] == stat.st_mtime
+            and previous["size"] == stat.st_size
+        ):
+            sources[key] = previous
+        else:
+            digest = hashlib.sha256(path.read_bytes()).hexdigest()
+            sources[key] = {
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "hash": digest,
+            }
+    return sources
+
+
+def _update_model(model_dir, name, versions, digest, source_path, write_model):
+    """Write the model directory if it is new or its model differs from the
+    source, and its versions if these have changed. Returns "added",
+    "updated" or None if nothing changed."""
+    versions_path = model_dir / "versions.json"
+    model_path = model_dir / "model.gv"
+    if not versions_path.exists():
+        status = "added"
+        write = True
+    else:
+        # The directory might hold another model, for example written by a run
+        # that was interrupted before writing the manifest.
+        write = (
+            not model_path.exists()
+            or hashlib.sha256(model_path.read_bytes()).hexdigest() != digest
+        )
+        if not write:
+            with open(versions_path) as f:
+                if json.load(f) == versions:
+                    return None
+        status = "updated"
+
+    if write:
+        # The versions are written last, so a partially written model is
+        # written again on the next run.
+        model_dir.mkdir(parents=True, exist_ok=True)
+        write_model(model_dir, name, source_path.read_text())
+    with open(versions_path, "w") as f:
+        json.dump(versions, f, indent=4)
+    return status
+
+
+def _read_manifest(output_path):
+    """Return the manifest of the output directory. Without a manifest, the
+    model directories in the output directory are removed (see
+    `dedup_incremental`)."""
+    try:
+        with open(output_path / DEDUP_MANIFEST) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        for model_dir in output_path.glob("*/model-*"):
+            shutil.rmtree(model_dir)
+        return {"sources": {}, "models": {}, "next_index": {}}
+
+
+def dedup_incremental(model_directory, output_directory, write_model):
+    """Deduplicate the models directory into the output directory, only
+    processing the models that changed since the previous run.
+
+    A manifest in the output directory records the size, mtime and hash of
+    every source file, and the name of the model directory for every unique
+    model. Unique models keep their name across runs, new models get a number
+    that was never used before and models that no longer occur are removed.
+    Without a manifest, the model directories already in the output directory
+    (written before dedup was incremental) are removed and written again, as
+    their numbers do not match.
+
+    Args:
+        model_directory: Directory with the path format
+            `implementation/version/tls_version/learnedModel.dot`.
+        output_directory: Output directory, with a directory per TLS version
+            containing a directory per unique model.
+        write_model: Function called with the model directory, the model name
+            and the contents of the DOT file, to write a new model.
+
+    Returns:
+        A dictionary with the number of "added", "updated" (versions or model
+        changed) and "removed" models.
+    """
     root = Path(model_directory)
-    results = defaultdict(lambda: defaultdict(list))
-
-    for implementation_path in root.iterdir():
-        implementation_results = dedup_implementation_dir(implementation_path)
-        for protocol, model_dicts in implementation_results.items():
-            for model, versions in model_dicts.items():
-                results[protocol][model] += versions
-    return results
-
-
-def dedup_implementation_dir(implementation_path):
-    """Perform the deduplication for a single implementation directory."""
-    # Perform a deduplication based on file contents
-    results = defaultdict(lambda: defaultdict(list))
-    implementation = implementation_path.name
-
-    version_path_list = [
-        version_path
-        for version_path in implementation_path.iterdir()
-        if version_path.is_dir()
-    ]
-    for version_path in version_path_list:
-        version = version_path.name
-        for protocol_path in version_path.iterdir():
-            try:
-                with open(protocol_path / "learnedModel.dot") as f:
-                    model = f.read()
-            except OSError:
-                # Skip
-                continue
-            protocol = protocol_path.name
-            results[protocol][model].append((implementation, version))
-    return results
+    output_path = Path(output_directory)
+    manifest_path = output_path / DEDUP_MANIFEST
+    manifest = _read_manifest(output_path)
+
+    sources = _scan_sources(root, manifest["sources"])
+
+    # Group the sources by protocol and hash, keeping track of a source path
+    # for every hash to read new models from.
+    versions = defaultdict(lambda: defaultdict(list))
+    source_paths = {}
+    for key, source in sources.items():
+        implementation, version, protocol, _ = key.split("/")
+        versions[protocol][source["hash"]].append([implementation, version])
+        source_paths[source["hash"]] = root / key
+
+    counts = {"added": 0, "updated": 0, "removed": 0}
+    models = {}
+    next_index = {}
+    for protocol in sorted(versions.keys() | manifest["models"].keys()):
+        names = dict(manifest["models"].get(protocol, {}))
+        hashes = versions.get(protocol, {})
+
+        # Remove the models that no longer occur
+        for digest in names.keys() - hashes.keys():
+            shutil.rmtree(output_path / protocol / names.pop(digest), True)
+            counts["removed"] += 1
+
+        # Number the new models in a deterministic order. Numbers of removed
+        # models are never reused, as these might still be referenced.
+        index = manifest["next_index"].get(protocol, 1)
+        for digest in sorted(hashes.keys() - names.keys(), key=lambda x: hashes[x]):
+            names[digest] = f"model-{index}"
+            index += 1
+        next_index[protocol] = index
+
+        for digest, name in names.items():
+            status = _update_model(
+                output_path / protocol / name,
+                name,
+                sorted(hashes[digest]),
+                digest,
+                source_paths[digest],
+                write_model,
+            )
+            if status:
+                counts[status] += 1
+
+        if names:
+            models[protocol] = names
+
+    # Write the manifest last, so an interrupted run is redone next time
+    output_path.mkdir(parents=True, exist_ok=True)
+    with open(manifest_path, "w") as f:
+        manifest = {"sources": sources, "models": models, "next_index": next_index}
+        json.dump(manifest, f, indent=4)
+
+    return counts
 
 
 def format_tls_string(version):
@@ -105,3 +233,10 @@ def format_tls_string(version):
     version = version.replace("TLS", "TLS ")
     protocol, number = version.split()
     return f"{protocol} {int(number) / 10}"
+
+
+def cache_directory():
+    """Return the directory to store the caches of tlsprint in, following the
+    XDG base directory specification."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "tlsprint"
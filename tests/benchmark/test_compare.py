@@ -0,0 +1,66 @@
+import pytest
+from tlsprint.benchmark import compare
+
+
+def _benchmark_data(inputs, weight=1):
+    return [
+        {
+            "type": "hdt",
+            "version": "TLS12",
+            "selector": "first",
+            "weight": "equal",
+            "benchmark": [
+                {"model": f"model-{i}", "weight": weight, "values": {"inputs": value}}
+                for i, value in enumerate(inputs)
+            ],
+        }
+    ]
+
+
+def test_compare_no_regression():
+    rows = compare(_benchmark_data([2, 4, 6]), _benchmark_data([2, 4, 5]))
+    assert {row["Metric"] for row in rows} == {
+        "inputs mean",
+        "inputs p95",
+        "inputs max",
+    }
+    assert not any(row["Regression"] for row in rows)
+
+
+def test_compare_regression():
+    rows = compare(_benchmark_data([2, 4, 6]), _benchmark_data([2, 4, 10]))
+    regressions = {row["Metric"] for row in rows if row["Regression"]}
+    assert regressions == {"inputs mean", "inputs p95", "inputs max"}
+
+    # A large enough threshold accepts the change
+    rows = compare(_benchmark_data([2, 4, 6]), _benchmark_data([2, 4, 10]), 1)
+    assert not any(row["Regression"] for row in rows)
+
+
+def test_compare_zero_weights():
+    with pytest.raises(ValueError, match="weight of zero"):
+        compare(_benchmark_data([2, 4, 6]), _benchmark_data([2, 4, 6], weight=0))
+
+
+def test_compare_perf():
+    def perf_data(wall_time):
+        return [
+            {
+                "case": "trees.load",
+                "type": None,
+                "version": None,
+                "wall_time": {"min": wall_time, "median": wall_time},
+                "peak_memory": 100,
+            }
+        ]
+
+    rows = compare(perf_data(1.0), perf_data(1.2))
+    assert not any(row["Regression"] for row in rows)
+    rows = compare(perf_data(1.0), perf_data(1.5))
+    assert {row["Metric"] for row in rows if row["Regression"]} == {
+        "wall_time min",
+        "wall_time median",
+    }
+
+    with pytest.raises(ValueError):
+        compare(perf_data(1.0), _benchmark_data([1]))
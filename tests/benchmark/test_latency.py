@@ -0,0 +1,30 @@
+import numpy
+import pytest
+from tlsprint.benchmark import LatencyModel
+
+
+def test_sample():
+    latency_model = LatencyModel(rtt=0.1, rtt_sigma=0, handshake=1, reset=2, startup=3)
+    times = latency_model.sample(inputs=4, resets=1, size=10)
+    assert times == pytest.approx(numpy.full(10, 3 + 1 + 2 + 5 * 0.1))
+
+
+def test_from_timings():
+    events = [
+        {"type": "timer", "name": "connector.start", "value": 4.0},
+        {"type": "timer", "name": "connector.connect", "value": 0.5},
+        {"type": "counter", "name": "connector.messages", "value": 1},
+        {"type": "timer", "name": "connector.round_trip", "value": 0.1},
+        {"type": "counter", "name": "connector.messages", "value": 3},
+        {"type": "timer", "name": "connector.round_trip", "value": 5.0},
+        {"type": "counter", "name": "connector.messages", "value": 1},
+        {"type": "timer", "name": "connector.round_trip", "value": 0.4},
+    ]
+    latency_model = LatencyModel.from_timings(events, reset=0.3)
+
+    # The batch of three messages is ignored
+    assert latency_model.rtt == pytest.approx(0.2)
+    assert latency_model.rtt_sigma == pytest.approx(numpy.log(2))
+    assert latency_model.startup == 4.0
+    assert latency_model.handshake == 0.5
+    assert latency_model.reset == 0.3
@@ -0,0 +1,41 @@
+import numpy
+import pytest
+from tlsprint.benchmark import _weighted_percentile
+from tlsprint.benchmark import read_results
+from tlsprint.benchmark import results_frame
+from tlsprint.benchmark import summarize
+from tlsprint.benchmark import write_results
+
+from .test_compare import _benchmark_data
+
+
+@pytest.mark.parametrize("file_name", ["results.json", "results.npz"])
+def test_write_read(tmp_path, file_name):
+    benchmark_data = _benchmark_data([2, 4, 6])
+    write_results(benchmark_data, tmp_path / file_name)
+
+    frame = read_results(tmp_path / file_name)
+    assert list(frame["value"]) == [2, 4, 6]
+    assert list(frame["model"]) == ["model-0", "model-1", "model-2"]
+    assert set(frame["metric"]) == {"inputs"}
+
+
+def test_weighted_percentile():
+    values = numpy.array([5, 1, 3, 8])
+    weights = numpy.array([2, 0, 7, 1])
+    for q in (0, 25, 50, 95, 100):
+        assert _weighted_percentile(values, weights, q) == pytest.approx(
+            numpy.percentile(numpy.repeat(values, weights), q)
+        )
+
+
+def test_summarize_weighted():
+    benchmark_data = _benchmark_data([2, 4])
+    benchmark_data[0]["benchmark"][1]["weight"] = 3
+
+    summary = summarize(results_frame(benchmark_data))
+    assert summary["hdt TLS12 first equal"]["inputs"] == {
+        "mean": 3.5,
+        "p95": 4.0,
+        "max": 4.0,
+    }
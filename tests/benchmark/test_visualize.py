@@ -0,0 +1,21 @@
+from tlsprint.benchmark import results_frame
+from tlsprint.benchmark import visualize
+from tlsprint.benchmark import visualize_all
+
+from .test_compare import _benchmark_data
+
+
+def test_visualize(tmp_path):
+    frame = results_frame(_benchmark_data([1, 2, 2, 3])).assign(name="HDT first")
+    assert visualize(frame, tmp_path / "plot.pdf", "Inputs")
+    assert (tmp_path / "plot.pdf").exists()
+
+
+def test_visualize_zero_weights(tmp_path):
+    """Groups without models with a positive weight are not plotted."""
+    frame = results_frame(_benchmark_data([1, 2], weight=0)).assign(name="HDT first")
+    assert not visualize(frame, tmp_path / "plot.pdf", "Inputs")
+    assert not (tmp_path / "plot.pdf").exists()
+
+    visualize_all(_benchmark_data([1, 2], weight=0), tmp_path / "plots", jobs=1)
+    assert not list((tmp_path / "plots").iterdir())
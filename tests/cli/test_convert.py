@@ -0,0 +1,52 @@
+import json
+
+from click.testing import CliRunner
+from tlsprint.cli import main
+
+from .test_profile import DOT_GRAPH
+
+
+def test_convert_single(tmp_path):
+    input_path = tmp_path / "model.dot"
+    input_path.write_text(DOT_GRAPH)
+
+    result = CliRunner().invoke(main, ["convert", str(input_path), "-", "--name", "m"])
+    assert result.exit_code == 0
+    assert json.loads(result.output) == {
+        "initial_state": "m_s0",
+        "states": ["m_s0", "m_s1"],
+        "transitions": [
+            [["m_s0", "A"], ["B", "m_s1"]],
+            [["m_s1", "A"], ["ConnectionClosed", "m_s1"]],
+        ],
+        "inputs": ["A"],
+        "outputs": ["B", "ConnectionClosed"],
+    }
+
+
+def test_convert_stdin():
+    result = CliRunner().invoke(main, ["convert", "-", "-"], input=DOT_GRAPH)
+    assert result.exit_code == 0
+    assert json.loads(result.output)["initial_state"] == "s0"
+
+    result = CliRunner().invoke(main, ["convert", "-", "-", "-"], input=DOT_GRAPH)
+    assert result.exit_code == 2
+
+
+def test_convert_batch(tmp_path):
+    for name in ["a", "b", "c"]:
+        (tmp_path / "models" / name).mkdir(parents=True)
+        (tmp_path / "models" / name / "model.gv").write_text(DOT_GRAPH)
+    extra_path = tmp_path / "extra.dot"
+    extra_path.write_text(DOT_GRAPH)
+
+    result = CliRunner().invoke(
+        main, ["convert", str(tmp_path / "models"), str(extra_path), "-", "-j", "2"]
+    )
+    assert result.exit_code == 0
+
+    lines = [json.loads(line) for line in result.output.splitlines()]
+    assert [line["path"] for line in lines] == [
+        str(tmp_path / "models" / name / "model.gv") for name in ["a", "b", "c"]
+    ] + [str(extra_path)]
+    assert all(line["graph"]["initial_state"] == "s0" for line in lines)
@@ -0,0 +1,61 @@
+import json
+
+from click.testing import CliRunner
+from tlsprint.cli import main
+
+DOT_GRAPH = """digraph {
+    __start0 -> s0
+    s0 -> s1 [label="A / B"]
+    s1 -> s1 [label="A / ConnectionClosed"]
+}"""
+
+
+def test_profile(tmp_path):
+    input_path = tmp_path / "model.dot"
+    input_path.write_text(DOT_GRAPH)
+    profile_path = tmp_path / "profile"
+
+    result = CliRunner().invoke(
+        main,
+        [
+            "--profile",
+            str(profile_path),
+            "convert",
+            str(input_path),
+            str(tmp_path / "model.json"),
+        ],
+    )
+    assert result.exit_code == 0
+
+    output_path = profile_path / "convert"
+    summary = json.loads((output_path / "summary.json").read_text())
+    assert summary["command"] == "convert"
+    assert summary["peak_memory"] > 0
+
+    assert "convert_command" in (output_path / "cprofile.txt").read_text()
+    assert (output_path / "cprofile.prof").exists()
+    assert (output_path / "samples.folded").exists()
+    assert "Peak memory" in (output_path / "memory.txt").read_text()
+
+
+def test_profile_subcommands(tmp_path):
+    """Subcommands of a group are profiled to their own directory."""
+    store_path = tmp_path / "results.sqlite"
+    results_path = tmp_path / "results.jsonl"
+    results_path.write_text('{"target": "a", "port": 443, "status": "finished"}\n')
+    profile_path = tmp_path / "profile"
+
+    for command in [
+        ["import", str(store_path), str(results_path)],
+        ["query", str(store_path)],
+    ]:
+        result = CliRunner().invoke(
+            main, ["--profile", str(profile_path), "results", *command]
+        )
+        assert result.exit_code == 0
+
+    for name in ["import", "query"]:
+        summary = json.loads(
+            (profile_path / "results" / name / "summary.json").read_text()
+        )
+        assert summary["command"] == f"results {name}"
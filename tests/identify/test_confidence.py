@@ -0,0 +1,84 @@
+import copy
+
+import pytest
+from tlsprint.identify import MODEL_WEIGHTS
+from tlsprint.identify import BenchmarkConnector
+from tlsprint.identify import _add_candidates
+from tlsprint.identify import candidate_weights
+from tlsprint.identify import identify
+from tlsprint.trees import trees
+
+WEIGHT_FUNCTION = MODEL_WEIGHTS["usage"]
+
+
+def _inputs(connector):
+    return sum(1 for message in connector.messages[0::2] if message != "RESET")
+
+
+def _identify(tree, model, confidence):
+    tree = copy.deepcopy(tree)
+    tree.condense()
+    connector = BenchmarkConnector(model, tree)
+    models = identify(
+        tree,
+        model,
+        connector=connector,
+        weight_function=WEIGHT_FUNCTION,
+        confidence=confidence,
+    )
+    return tree, models, _inputs(connector)
+
+
+@pytest.mark.parametrize("tree_type", ["adg", "hdt"])
+def test_stop_at_confidence(tree_type):
+    tree = trees[tree_type]["TLS12"]
+    for model in sorted(tree.models):
+        _, expected, inputs = _identify(tree, model, None)
+        _, models, full_inputs = _identify(tree, model, 1.0)
+        assert model in models
+        assert models <= expected
+        assert full_inputs <= inputs
+
+        pruned, models, early_inputs = _identify(tree, model, 0.5)
+        assert len(models) == 1
+        assert early_inputs <= full_inputs
+
+        # The result is the model with the largest share of the candidates
+        shares = candidate_weights(
+            pruned, pruned.models if len(pruned) else models, WEIGHT_FUNCTION
+        )
+        (leading,) = models
+        assert shares[leading] == max(shares.values())
+        assert shares[leading] >= 0.5
+
+
+def test_stop_without_inputs():
+    tree = copy.deepcopy(trees["adg"]["TLS12"])
+    connector = BenchmarkConnector(sorted(tree.models)[0], tree)
+
+    # Any model holds at least a tiny share of the weight
+    models = identify(
+        tree,
+        None,
+        connector=connector,
+        weight_function=WEIGHT_FUNCTION,
+        confidence=1e-9,
+    )
+    assert len(models) == 1
+    assert connector.messages == []
+
+
+def test_candidates():
+    tree, models, _ = _identify(
+        trees["adg"]["TLS12"], sorted(trees["adg"]["TLS12"].models)[0], 0.5
+    )
+    kwargs = {"confidence": 0.5, "weight_function": WEIGHT_FUNCTION}
+    result = _add_candidates({}, tree, models, kwargs)
+
+    shares = [share for _, share in result["candidates"]]
+    assert result["candidates"][0][0] in models
+    assert shares == sorted(shares, reverse=True)
+    assert sum(shares) == pytest.approx(1)
+
+    # Candidates are only reported when stopping at a confidence
+    assert _add_candidates({}, tree, models, {}) == {}
@@ -0,0 +1,37 @@
+import copy
+import shutil
+
+import pydot
+import pytest
+from tlsprint.identify import BenchmarkConnector
+from tlsprint.identify import identify
+from tlsprint.learn import render_dot_files
+
+from .test_response_index import _example_tree
+
+
+def _identify_with_graphs(graph_dir):
+    tree = _example_tree()
+    tree.model_mapping = {}
+    connector = BenchmarkConnector("model-3", copy.deepcopy(tree))
+    return identify(tree, "model-3", graph_dir=graph_dir, connector=connector)
+
+
+def test_graph_dir_writes_dot(tmp_path):
+    assert _identify_with_graphs(tmp_path) == {"model-3"}
+
+    paths = sorted(path.name for path in tmp_path.iterdir())
+    assert paths == [
+        "iteration-1.1-pre-prune.dot",
+        "iteration-1.2-post-prune.dot",
+    ]
+    for path in tmp_path.iterdir():
+        assert pydot.graph_from_dot_file(path)
+
+
+@pytest.mark.skipif(not shutil.which("dot"), reason="Graphviz is not installed")
+def test_render_dot_files(tmp_path):
+    _identify_with_graphs(tmp_path)
+    rendered = render_dot_files(tmp_path)
+    assert len(rendered) == 2
+    assert all(path.suffix == ".svg" and path.exists() for path in rendered)
@@ -0,0 +1,46 @@
+import asyncio
+import copy
+
+from tlsprint.identify import AsyncConnector
+from tlsprint.identify import BenchmarkConnector
+from tlsprint.identify import identify
+from tlsprint.identify import identify_async
+from tlsprint.trees import trees
+
+
+class _AsyncBenchmarkConnector(AsyncConnector):
+    """Asynchronous wrapper around the BenchmarkConnector."""
+
+    def __init__(self, target, tree):
+        self.connector = BenchmarkConnector(target, tree)
+
+    async def send(self, message):
+        # Give other identifications the chance to run
+        await asyncio.sleep(0)
+        return self.connector.send(message)
+
+    async def reset(self):
+        self.connector.reset()
+
+
+def test_identify_async():
+    tree = trees["hdt"]["TLS12"]
+    models = sorted(tree.models)
+
+    async def identify_all():
+        return await asyncio.gather(
+            *(
+                identify_async(
+                    copy.deepcopy(tree),
+                    model,
+                    connector=_AsyncBenchmarkConnector(model, tree),
+                )
+                for model in models
+            )
+        )
+
+    results = asyncio.run(identify_all())
+    for model, result in zip(models, results):
+        connector = BenchmarkConnector(model, tree)
+        assert result == identify(copy.deepcopy(tree), model, connector=connector)
+        assert model in result
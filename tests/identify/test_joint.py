@@ -0,0 +1,80 @@
+import copy
+
+from tlsprint.identify import BenchmarkConnector
+from tlsprint.identify import _implementations
+from tlsprint.identify import identify
+from tlsprint.identify import identify_versions
+from tlsprint.trees import trees
+
+
+def _inputs(connector):
+    return sum(1 for message in connector.messages[0::2] if message != "RESET")
+
+
+def _condensed(tree):
+    tree = copy.deepcopy(tree)
+    tree.condense()
+    return tree
+
+
+def test_identify_versions():
+    adg = trees["adg"]
+    implementations = set().union(
+        *(_implementations(tree, tree.models) for tree in adg.values())
+    )
+
+    joint_inputs = separate_inputs = 0
+    for implementation in sorted(implementations):
+        # The model of the implementation for every version it supports
+        models = {
+            version: model
+            for version, tree in adg.items()
+            for model in tree.models
+            if implementation in tree.model_mapping[model]
+        }
+
+        connectors = {}
+
+        def connector_factory(version, models=models, connectors=connectors):
+            connectors[version] = BenchmarkConnector(models[version], adg[version])
+            return connectors[version]
+
+        result = identify_versions(
+            {version: _condensed(adg[version]) for version in models},
+            None,
+            connector_factory=connector_factory,
+        )
+        joint_inputs += sum(map(_inputs, connectors.values()))
+
+        # Identify every version on its own, the implementations have to
+        # match the result of every version.
+        expected = None
+        for version, model in models.items():
+            connector = BenchmarkConnector(model, adg[version])
+            matched = identify(_condensed(adg[version]), None, connector=connector)
+            separate_inputs += _inputs(connector)
+
+            matched = _implementations(adg[version], matched)
+            expected = matched if expected is None else expected & matched
+
+        assert result == expected
+        assert implementation in result
+
+    assert joint_inputs < separate_inputs
+
+
+def test_identify_versions_single_connector():
+    """A connector is only started for the versions that are used."""
+    tree = trees["adg"]["TLS12"]
+    model = sorted(tree.models)[0]
+    started = []
+
+    def connector_factory(version):
+        started.append(version)
+        return BenchmarkConnector(model, tree)
+
+    result = identify_versions(
+        {"TLS12": _condensed(tree)}, None, connector_factory=connector_factory
+    )
+    assert result == tree.model_mapping[model]
+    assert started == ["TLS12"]
@@ -0,0 +1,52 @@
+from tlsprint.identify import BenchmarkConnector
+from tlsprint.identify import ResponseIndex
+from tlsprint.learn import ModelTree
+
+
+def _example_tree():
+    tree = ModelTree()
+    tree.add_path(("A", "B"))
+    tree.add_path(("A", "C", "D", "E"))
+    tree.add_path(("A", "C", "D", "F"))
+    tree.nodes[tree.find(("A", "B"))]["models"] = {"model-1"}
+    tree.nodes[tree.find(("A", "C", "D", "E"))]["models"] = {"model-2"}
+    tree.nodes[tree.find(("A", "C", "D", "F"))]["models"] = {"model-3"}
+    return tree
+
+
+def test_response_index():
+    tree = _example_tree()
+    index = ResponseIndex(tree)
+    assert index.responses == {
+        (tree.find(("A",)), "model-1"): "B",
+        (tree.find(("A",)), "model-2"): "C",
+        (tree.find(("A",)), "model-3"): "C",
+        (tree.find(("A", "C", "D")), "model-2"): "E",
+        (tree.find(("A", "C", "D")), "model-3"): "F",
+    }
+    assert {
+        (tree.path(node), message): tree.path(child)
+        for (node, message), child in index.children.items()
+    } == {
+        ((), "A"): ("A",),
+        (("A",), "B"): ("A", "B"),
+        (("A",), "C"): ("A", "C"),
+        (("A", "C"), "D"): ("A", "C", "D"),
+        (("A", "C", "D"), "E"): ("A", "C", "D", "E"),
+        (("A", "C", "D"), "F"): ("A", "C", "D", "F"),
+    }
+
+
+def test_benchmark_connector():
+    connector = BenchmarkConnector("model-3", _example_tree())
+    assert connector.send("A") == "C"
+    assert connector.send("D") == "F"
+    assert connector.messages == ["A", "C", "D", "F"]
+
+    connector.reset()
+    assert connector.send("A") == "C"
+    assert connector.messages == ["A", "C", "D", "F", "RESET", "", "A", "C"]
+
+    # Inputs outside of the tree have no response
+    assert connector.send("X") is None
+    assert connector.send("D") is None
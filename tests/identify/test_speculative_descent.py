@@ -0,0 +1,31 @@
+import copy
+
+from tlsprint.identify import BenchmarkConnector
+from tlsprint.identify import identify
+from tlsprint.trees import trees
+
+
+class _CountingConnector(BenchmarkConnector):
+    """Benchmark connector that counts the number of batches sent."""
+
+    batches = 0
+
+    def send_sequence(self, messages):
+        self.batches += 1
+        return super().send_sequence(messages)
+
+
+def test_speculative_identify():
+    tree = trees["adg"]["TLS12"]
+    for model in tree.models:
+        tree_copy = copy.deepcopy(tree)
+        expected = identify(tree_copy, model, connector=BenchmarkConnector(model, tree))
+
+        tree_copy = copy.deepcopy(tree)
+        connector = _CountingConnector(model, tree)
+        result = identify(tree_copy, model, connector=connector, speculative=True)
+        assert result == expected
+        assert model in result
+
+        # Multiple inputs are sent per batch
+        assert connector.batches < len(connector.messages) // 2
@@ -0,0 +1,63 @@
+import asyncio
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+from tlsprint import identify
+from tlsprint.identify import TLSAttackerConnector
+from tlsprint.identify import _stop_process
+from tlsprint.identify import _stop_process_async
+
+# A connector that is ready, but ignores being terminated
+STUBBORN = (
+    "import signal, time\n"
+    "signal.signal(signal.SIGTERM, signal.SIG_IGN)\n"
+    "print('ready', flush=True)\n"
+    "time.sleep(60)\n"
+)
+
+
+def test_stop_process(monkeypatch):
+    monkeypatch.setattr(identify, "STOP_TIMEOUT", 0.5)
+    process = subprocess.Popen([sys.executable, "-c", STUBBORN], stdout=subprocess.PIPE)
+    process.stdout.readline()
+
+    _stop_process(process)
+    # The process is killed and reaped
+    assert process.returncode is not None
+    assert process.stdout.closed
+
+
+def test_stop_process_async(monkeypatch):
+    monkeypatch.setattr(identify, "STOP_TIMEOUT", 0.5)
+
+    async def run():
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "-c", STUBBORN, stdout=subprocess.PIPE
+        )
+        await process.stdout.readline()
+        await _stop_process_async(process)
+        return process.returncode
+
+    assert asyncio.run(run()) is not None
+
+
+def test_start_timeout(monkeypatch):
+    """A connector that does not start in time is stopped."""
+    processes = []
+    start_process = subprocess.Popen
+
+    def popen(command, **kwargs):
+        process = start_process(
+            [sys.executable, "-c", "import time; time.sleep(60)"], **kwargs
+        )
+        processes.append(process)
+        return process
+
+    monkeypatch.setattr(identify.subprocess, "Popen", popen)
+    for deadline in [0, time.monotonic() + 0.5]:
+        with pytest.raises(socket.timeout):
+            TLSAttackerConnector._start_process("target", 443, deadline=deadline)
+        assert processes[-1].returncode is not None
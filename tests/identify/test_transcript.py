@@ -0,0 +1,28 @@
+import copy
+
+from tlsprint.identify import BenchmarkConnector
+from tlsprint.identify import identify
+from tlsprint.trees import trees
+
+
+def test_transcript():
+    tree = trees["adg"]["TLS12"]
+    for model in sorted(tree.models):
+        connector = BenchmarkConnector(model, tree)
+        transcript = []
+        models = identify(
+            copy.deepcopy(tree), model, connector=connector, transcript=transcript
+        )
+        assert model in models
+
+        # The transcript holds every input and output, and a reset for every
+        # replay of the connector
+        messages = []
+        for reset, inputs, outputs, seconds in transcript:
+            assert len(inputs) == len(outputs)
+            assert seconds >= 0
+            if reset:
+                messages.extend(["RESET", ""])
+            for message, response in zip(inputs, outputs):
+                messages.extend([message, response])
+        assert messages == connector.messages
@@ -0,0 +1,64 @@
+import copy
+import io
+import json
+
+from tlsprint import instrument
+from tlsprint.identify import identify
+from tlsprint.trees import trees
+
+
+def test_memory_sink():
+    tree = copy.deepcopy(trees["hdt"]["TLS12"])
+    with instrument.recording(instrument.MemorySink()) as sink:
+        identify(tree, "model-1", benchmark=True)
+
+    timers = sink.timers()
+    assert len(timers["identify.total"]) == 1
+    assert len(timers["tree.prune_models"]) == sink.counters()["identify.descents"]
+    assert "tree.condense" in timers
+
+    phases = [row["Phase"] for row in sink.summary()]
+    assert phases[0] == "identify.total"
+
+    counts, _ = sink.histogram("tree.condense", bins=5)
+    assert counts.sum() == len(timers["tree.condense"])
+
+
+def test_json_lines_sink():
+    output = io.StringIO()
+    with instrument.recording(instrument.JSONLinesSink(output)):
+        with instrument.timer("phase"):
+            pass
+        instrument.count("counter", 2)
+
+    events = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [(event["type"], event["name"]) for event in events] == [
+        ("timer", "phase"),
+        ("counter", "counter"),
+    ]
+    assert events[1]["value"] == 2
+
+
+def test_no_sinks():
+    sink = instrument.MemorySink()
+    with instrument.recording(sink):
+        pass
+    with instrument.timer("phase"):
+        instrument.count("counter")
+    assert sink.events == []
+
+
+def test_aggregate_sink():
+    tree = copy.deepcopy(trees["hdt"]["TLS12"])
+    memory = instrument.MemorySink()
+    with instrument.recording(memory), instrument.recording(
+        instrument.AggregateSink()
+    ) as sink:
+        identify(tree, "model-1", benchmark=True)
+
+    timers = sink.timers()
+    for name, durations in memory.timers().items():
+        assert timers[name]["count"] == len(durations)
+        assert timers[name]["total"] == sum(durations)
+        assert timers[name]["max"] == max(durations)
+    assert sink.counters() == memory.counters()
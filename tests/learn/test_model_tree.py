@@ -0,0 +1,85 @@
+import copy
+import pickle
+
+from tlsprint.learn import ModelTree
+from tlsprint.trees import trees
+
+
+def _path_tree():
+    """Tree in the format of older versions, with paths as nodes."""
+    tree = ModelTree()
+    for name in ("messages", "message_ids", "next_node"):
+        del tree.graph[name]
+    tree.add_edge((), ("A",), label="A")
+    tree.add_edge(("A",), ("A", "B"), label="B")
+    tree.add_edge(("A",), ("A", "C"), label="C")
+    tree.nodes[("A", "B")]["models"] = {"model-1"}
+    tree.nodes[("A", "C")]["models"] = {"model-2"}
+    tree.model_mapping = {"model-1": {("x", "1")}, "model-2": {("x", "2")}}
+    return tree
+
+
+def test_paths():
+    tree = ModelTree()
+    node = tree.add_path(("A", "B", "C"))
+    assert tree.add_path(("A", "B", "C")) == node
+    assert tree.add_path(("A", "D")) != node
+
+    assert tree.path(node) == ("A", "B", "C")
+    assert tree.find(("A", "B", "C")) == node
+    assert tree.find(("A", "C")) is None
+    assert tree.find(("C",), tree.find(("A", "B"))) == node
+    assert tree.label(node) == "C"
+    assert tree.label(tree.root) is None
+    assert tree.path_nodes(node) == [
+        tree.root,
+        tree.find(("A",)),
+        tree.find(("A", "B")),
+        node,
+    ]
+
+    # Every message is stored once
+    assert tree.messages == ["A", "B", "C", "D"]
+
+
+def test_merge():
+    tree = ModelTree()
+    tree.add_path(("A", "B"))
+    other = ModelTree()
+    other.add_path(("C",))
+    other.add_path(("A", "D"))
+
+    nodes = tree.merge(other)
+    assert {tree.path(node) for node in tree.nodes} == {
+        (),
+        ("A",),
+        ("A", "B"),
+        ("A", "D"),
+        ("C",),
+    }
+    assert all(tree.path(nodes[node]) == other.path(node) for node in other.nodes)
+
+
+def test_pickled_paths():
+    old = _path_tree()
+    tree = pickle.loads(pickle.dumps(old))
+
+    assert set(tree.nodes) == {0, 1, 2, 3}
+    assert {tree.path(node) for node in tree.nodes} == set(old.nodes)
+    assert tree.nodes[tree.find(("A", "C"))]["models"] == {"model-2"}
+    assert tree.edges[tree.find(("A",)), tree.find(("A", "B"))]["label"] == "B"
+    assert tree.model_mapping == old.model_mapping
+
+    # New nodes do not reuse the converted ids
+    assert tree.add_path(("A", "D")) == 4
+
+
+def test_bundled_trees():
+    for tree_type in trees.values():
+        for tree in tree_type.values():
+            assert all(isinstance(node, int) for node in tree.nodes)
+
+            # Copies and subtrees share the alphabet
+            node = tree.leaves[0]
+            assert copy.deepcopy(tree).path(node) == tree.path(node)
+            assert tree.subtree(tree.parent(node)).label(node) == tree.label(node)
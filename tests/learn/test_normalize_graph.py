@@ -8,7 +8,7 @@ def test_one_edge():
     }"""
     tree = normalize_graph(dot_graph)
     expected = {(), ("A",), ("A", "B")}
-    assert expected == set(tree.nodes)
+    assert expected == {tree.path(node) for node in tree.nodes}
 
 
 def test_multiple_edges():
@@ -27,7 +27,7 @@ def test_multiple_edges():
         ("A", "B", "B"),
         ("A", "B", "B", "C"),
     }
-    assert expected == set(tree.nodes)
+    assert expected == {tree.path(node) for node in tree.nodes}
 
 
 def test_multiple_edges_different_structure():
@@ -46,7 +46,7 @@ def test_multiple_edges_different_structure():
         ("A", "B", "B"),
         ("A", "B", "B", "C"),
     }
-    assert expected == set(tree.nodes)
+    assert expected == {tree.path(node) for node in tree.nodes}
 
 
 def test_final_node_loop():
@@ -66,7 +66,7 @@ def test_final_node_loop():
         ("A", "B", "D"),
         ("A", "B", "D", "B"),
     }
-    assert expected == set(tree.nodes)
+    assert expected == {tree.path(node) for node in tree.nodes}
 
 
 def test_connection_closed():
@@ -86,7 +86,7 @@ def test_connection_closed():
         ("D",),
         ("D", "B|ConnectionClosed"),
     }
-    assert expected == set(tree.nodes)
+    assert expected == {tree.path(node) for node in tree.nodes}
 
 
 def test_single_node_cycle():
@@ -114,7 +114,7 @@ def test_single_node_cycle():
         ("A", "B", "A", "E", "A", "E", "C"),
         ("A", "B", "A", "E", "A", "E", "C", "D"),
     }
-    assert expected == set(tree.nodes)
+    assert expected == {tree.path(node) for node in tree.nodes}
 
 
 def test_multi_node_cycle():
@@ -143,4 +143,4 @@ def test_multi_node_cycle():
         ("A", "B", "C", "D", "A", "E", "C", "D", "F"),
         ("A", "B", "C", "D", "A", "E", "C", "D", "F", "G"),
     }
-    assert expected == set(tree.nodes)
+    assert expected == {tree.path(node) for node in tree.nodes}
@@ -0,0 +1,30 @@
+from tlsprint.perf import perf_all
+
+from ..simulate.test_simulator import MODELS
+
+
+def test_perf_all(tmp_path):
+    for name, dot_graph in MODELS.items():
+        model_dir = tmp_path / "TLS12" / f"test-{name}"
+        model_dir.mkdir(parents=True)
+        (model_dir / "model.gv").write_text(dot_graph)
+
+    cases = set()
+    process_peak_rss = 0
+    for name_filter in ["trees.load", "condense", "_graph", "_hdt", "simulated"]:
+        for result in perf_all(tmp_path, repeat=2, name_filter=name_filter):
+            assert result["repeat"] == 2
+            assert result["wall_time"]["min"] <= result["wall_time"]["max"]
+            assert result["peak_memory"] >= 0
+            cases.add((result["case"], result["type"], result["version"]))
+
+            # The peak of the process never decreases
+            if result["process_peak_rss"] is not None:
+                assert result["process_peak_rss"] >= process_peak_rss
+                process_peak_rss = result["process_peak_rss"]
+
+    assert ("trees.load", None, None) in cases
+    assert ("condense", "hdt", "TLS12") in cases
+    assert ("normalize_graph", None, "TLS12") in cases
+    assert ("construct_hdt", None, "TLS12") in cases
+    assert ("identify.simulated.hdt", None, "TLS12") in cases
@@ -0,0 +1,92 @@
+import contextlib
+import socket
+import threading
+
+from tlsprint.probe import VERSIONS
+from tlsprint.probe import ProbeCache
+from tlsprint.probe import client_hello
+from tlsprint.probe import probe_versions
+from tlsprint.probe import select_version
+from tlsprint.probe import supported_versions
+
+
+def _handle(connection, supported):
+    with connection:
+        header = connection.recv(5)
+        record = b""
+        while len(record) < int.from_bytes(header[3:5], "big"):
+            record += connection.recv(4096)
+
+        version = tuple(record[4:6])
+        if version in supported:
+            # Truncated ServerHello, the probe only reads the version
+            hello = bytes([0x02, 0, 0, 2]) + bytes(version)
+            connection.sendall(bytes([0x16, 3, 1, 0, len(hello)]) + hello)
+        else:
+            # Fatal protocol_version alert
+            connection.sendall(bytes([0x15, 3, 1, 0, 2, 2, 70]))
+
+
+@contextlib.contextmanager
+def _tls_server(supported):
+    listener = socket.create_server(("localhost", 0))
+
+    def serve():
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                return
+            _handle(connection, supported)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    try:
+        yield listener.getsockname()[1]
+    finally:
+        listener.close()
+
+
+def test_client_hello():
+    record = client_hello("TLS11", "example.com")
+    assert record[:3] == bytes([0x16, 3, 1])
+    assert int.from_bytes(record[3:5], "big") == len(record) - 5
+    assert record[5] == 0x01
+    assert int.from_bytes(record[6:9], "big") == len(record) - 9
+    assert tuple(record[9:11]) == VERSIONS["TLS11"]
+    assert b"example.com" in record
+
+
+def test_probe_versions(tmp_path):
+    with _tls_server([VERSIONS["TLS10"], VERSIONS["TLS11"]]) as port:
+        assert probe_versions("localhost", port) == ["TLS10", "TLS11"]
+
+        cache = ProbeCache(tmp_path / "probes.json")
+        assert supported_versions("localhost", port, cache) == ["TLS10", "TLS11"]
+        assert cache.get("localhost", port) == ["TLS10", "TLS11"]
+
+
+def test_corrupt_cache(tmp_path):
+    path = tmp_path / "probes.json"
+    path.write_text('{"localhost:443": {"versions": ["TLS1')
+    cache = ProbeCache(path)
+
+    # A truncated cache is treated as empty, and replaced on the next update
+    assert cache.get("localhost", 443) is None
+    cache.set("localhost", 443, ["TLS12"])
+    assert cache.get("localhost", 443) == ["TLS12"]
+    assert [p.name for p in tmp_path.iterdir()] == ["probes.json"]
+
+
+def test_cache_relative_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = ProbeCache("probes.json")
+    cache.set("localhost", 443, ["TLS12"])
+    assert cache.get("localhost", 443) == ["TLS12"]
+    assert (tmp_path / "probes.json").exists()
+
+
+def test_select_version():
+    assert select_version(["TLS10", "TLS11"], ["TLS10", "TLS11", "TLS12"]) == "TLS11"
+    assert select_version(["TLS10", "TLS12"], ["TLS10", "TLS11"]) == "TLS10"
+    assert select_version([], ["TLS12"]) is None
@@ -0,0 +1,46 @@
+import asyncio
+import io
+import json
+
+from tlsprint.cli import _open_output
+from tlsprint.scan import ScanCoordinator
+from tlsprint.scan import ScanQueue
+
+
+def test_resume_output(tmp_path):
+    path = tmp_path / "results.jsonl"
+    path.write_text('{"target": "a"}\n{"target": "b"}\n{"targ')
+
+    output, results = _open_output(str(path), resume=True)
+    output.close()
+    assert results == 2
+    # The partly written result is removed
+    assert path.read_text() == '{"target": "a"}\n{"target": "b"}\n'
+
+    output, results = _open_output(str(path), resume=False)
+    output.close()
+    assert results == 0
+    assert path.read_text() == ""
+
+
+def test_coordinator_skips_written_results():
+    queue = ScanQueue(":memory:")
+    queue.add([(host, 443) for host in "abc"])
+    shard = queue.lease("worker")
+    for _ in range(3):
+        target_id, host, _ = queue.next_target(shard, "worker")
+        queue.complete(target_id, "worker", {"target": host})
+
+    output = io.StringIO()
+    coordinator = ScanCoordinator(queue, output, output_results=2)
+
+    async def start():
+        # The results already in the queue are written when starting
+        server = await coordinator.start()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(start())
+    assert [json.loads(line) for line in output.getvalue().splitlines()] == [
+        {"target": "c"}
+    ]
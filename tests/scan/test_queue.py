@@ -0,0 +1,113 @@
+from tlsprint.scan import DONE
+from tlsprint.scan import PENDING
+from tlsprint.scan import RUNNING
+from tlsprint.scan import ScanQueue
+from tlsprint.scan import format_target
+from tlsprint.scan import parse_target
+
+
+def _targets(count):
+    return [(f"host-{i}", 443) for i in range(count)]
+
+
+def _drain(queue, shard, worker):
+    """Complete all targets of the shard, return the hosts."""
+    hosts = []
+    while True:
+        target = queue.next_target(shard, worker)
+        if target is None:
+            return hosts
+        target_id, host, _ = target
+        queue.complete(target_id, worker, {"target": host})
+        hosts.append(host)
+
+
+def test_parse_target():
+    assert parse_target("example.com\n") == ("example.com", 443)
+    assert parse_target("example.com:8443") == ("example.com", 8443)
+    assert parse_target("[::1]:8443") == ("::1", 8443)
+    assert parse_target("[::1]") == ("::1", 443)
+    assert parse_target("::1") == ("::1", 443)
+    assert parse_target("2001:db8::1") == ("2001:db8::1", 443)
+    for target in ["example.com:8443", "[2001:db8::1]:443"]:
+        assert format_target(*parse_target(target)) == target
+
+
+def test_lease_and_complete(tmp_path):
+    queue = ScanQueue(tmp_path / "queue.sqlite")
+    queue.add(_targets(10), shard_size=4)
+    assert len(queue) == 10
+
+    hosts = []
+    while True:
+        shard = queue.lease("worker")
+        if shard is None:
+            break
+        hosts += _drain(queue, shard, "worker")
+
+    assert sorted(hosts) == sorted(host for host, _ in _targets(10))
+    assert queue.finished
+    assert [result["target"] for _, result in queue.results()] == hosts
+
+    # The queue is durable
+    queue.close()
+    queue = ScanQueue(tmp_path / "queue.sqlite")
+    assert queue.finished
+    assert len(queue.results(after=5)) == 5
+
+
+def test_add_again(tmp_path):
+    """Restarting a scan with the same targets does not queue them again."""
+    queue = ScanQueue(tmp_path / "queue.sqlite")
+    assert queue.add(_targets(2) + _targets(1)) == 2
+    _drain(queue, queue.lease("worker"), "worker")
+    queue.close()
+
+    queue = ScanQueue(tmp_path / "queue.sqlite")
+    assert queue.add(_targets(3), shard_size=1) == 1
+    assert len(queue) == 3
+    assert queue.counts() == {PENDING: 1, RUNNING: 0, DONE: 2}
+    # Only a shard for the new target is created
+    assert _drain(queue, queue.lease("worker"), "worker") == ["host-2"]
+    assert queue.lease("worker") is None
+
+
+def test_expired_lease():
+    queue = ScanQueue(":memory:", lease_time=10)
+    queue.add(_targets(4), shard_size=4)
+
+    shard = queue.lease("lost", now=0)
+    queue.next_target(shard, "lost", now=0)
+    assert queue.counts() == {PENDING: 3, RUNNING: 1, DONE: 0}
+
+    # After the lease expired, the running target is handed out again and the
+    # lost worker can no longer continue.
+    shard = queue.lease("other", now=20)
+    assert queue.next_target(shard, "lost", now=20) is None
+    assert len(_drain(queue, shard, "other")) == 4
+    assert queue.finished
+
+
+def test_work_stealing():
+    queue = ScanQueue(":memory:")
+    queue.add(_targets(8), shard_size=8)
+
+    slow = queue.lease("slow")
+    queue.next_target(slow, "slow")
+
+    # No pending shards left, half of the remaining targets are stolen
+    fast = queue.lease("fast")
+    assert fast != slow
+    stolen = _drain(queue, fast, "fast")
+    assert len(stolen) == 4
+
+    remaining = _drain(queue, slow, "slow")
+    assert len(remaining) == 3
+    assert not set(stolen) & set(remaining)
+    assert queue.counts() == {PENDING: 0, RUNNING: 1, DONE: 7}
+
+    # A late result is stored once
+    assert queue.complete(1, "slow", {"target": "host-0"})
+    assert not queue.complete(1, "fast", {"target": "host-0"})
+    assert queue.finished
+    assert queue.lease("fast") is None
@@ -0,0 +1,108 @@
+import asyncio
+import copy
+import io
+import json
+import threading
+
+from tlsprint.identify import BenchmarkConnector
+from tlsprint.identify import identify
+from tlsprint.scan import ScanClient
+from tlsprint.scan import ScanCoordinator
+from tlsprint.scan import ScanQueue
+from tlsprint.scan import run_worker
+from tlsprint.store import ResultStore
+from tlsprint.trees import trees
+
+
+def test_scan():
+    """Scan the models of a tree as targets, with a coordinator and several
+    workers on this machine."""
+    tree = trees["adg"]["TLS12"]
+    models = sorted(tree.models)
+
+    def identify_function(target, target_port):
+        # The target is the name of the model to simulate
+        connector = BenchmarkConnector(target, tree)
+        models = identify(copy.deepcopy(tree), target, connector=connector)
+        return {
+            "target": target,
+            "port": target_port,
+            "status": "finished",
+            "models": sorted(models),
+        }
+
+    queue = ScanQueue(":memory:")
+    queue.add([(model, 443) for model in models], shard_size=3)
+    output = io.StringIO()
+    store = ResultStore(":memory:", flush_interval=60)
+    coordinator = ScanCoordinator(queue, output, store)
+
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(coordinator.start())
+    thread = threading.Thread(
+        target=loop.run_until_complete, args=(coordinator.wait_finished(),)
+    )
+    thread.start()
+
+    address = server.sockets[0].getsockname()[:2]
+    counts = []
+
+    def worker(name):
+        client = ScanClient(address)
+        try:
+            counts.append(run_worker(client, name, identify_function, 0.01))
+        finally:
+            client.close()
+
+    workers = [threading.Thread(target=worker, args=(f"worker-{i}",)) for i in range(4)]
+    for thread_ in workers:
+        thread_.start()
+    for thread_ in workers:
+        thread_.join()
+    thread.join()
+    server.close()
+    loop.close()
+
+    assert sum(counts) == len(models)
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert sorted(result["target"] for result in results) == models
+    for result in results:
+        assert result["target"] in result["models"]
+
+    # The store is flushed when the scan is finished
+    assert not store.buffer
+    assert len(store) == len(models)
+    for model in models:
+        assert (model, 443) in store.hosts(model)
+
+
+def test_asyncio_run():
+    """The coordinator can be created before the event loop that runs it."""
+    queue = ScanQueue(":memory:")
+    queue.add([("a", 443), ("b", 443)])
+    output = io.StringIO()
+    coordinator = ScanCoordinator(queue, output)
+
+    def identify_function(target, target_port):
+        return {"target": target, "port": target_port, "status": "finished"}
+
+    def worker(address):
+        client = ScanClient(address)
+        try:
+            return run_worker(client, "worker", identify_function, 0.01)
+        finally:
+            client.close()
+
+    async def run():
+        server = await coordinator.start()
+        address = server.sockets[0].getsockname()[:2]
+        async with server:
+            identified = asyncio.get_running_loop().run_in_executor(
+                None, worker, address
+            )
+            await coordinator.wait_finished()
+            return await identified
+
+    assert asyncio.run(run()) == 2
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [result["target"] for result in results] == ["a", "b"]
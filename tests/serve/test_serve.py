@@ -0,0 +1,211 @@
+import asyncio
+import copy
+import json
+import threading
+
+import pytest
+from tlsprint import instrument
+from tlsprint.identify import BenchmarkConnector
+from tlsprint.identify import identify
+from tlsprint.serve import IdentifyServer
+from tlsprint.trees import trees
+
+TREE = trees["adg"]["TLS12"]
+MODELS = sorted(TREE.models)
+
+
+def identify_function(target, target_port):
+    # The target is the name of the model to simulate
+    with instrument.timer("test.identify"):
+        connector = BenchmarkConnector(target, TREE)
+        models = identify(copy.deepcopy(TREE), target, connector=connector)
+    return {
+        "target": target,
+        "port": target_port,
+        "status": "ok",
+        "models": sorted(models),
+    }
+
+
+async def _request(open_connection, method, path, content=None):
+    reader, writer = await open_connection()
+    body = json.dumps(content).encode() if content is not None else b""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    head, _, body = response.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode().split("\r\n")
+    headers = dict(line.lower().split(": ", maxsplit=1) for line in header_lines)
+    return int(status_line.split()[1]), headers, body
+
+
+def _dechunk(body):
+    data = b""
+    while True:
+        size, _, body = body.partition(b"\r\n")
+        size = int(size, 16)
+        if not size:
+            return data
+        data += body[:size]
+        body = body[size + 2 :]
+
+
+async def _serve(server, test):
+    listener = await server.start("localhost", 0)
+    port = listener.sockets[0].getsockname()[1]
+    try:
+        async with listener:
+            return await test(lambda: asyncio.open_connection("localhost", port))
+    finally:
+        server.close()
+
+
+def test_identify():
+    server = IdentifyServer(identify_function, concurrency=2)
+
+    async def test(open_connection):
+        status, _, body = await _request(open_connection, "GET", "/health")
+        assert status == 200
+        assert json.loads(body)["running"] == 0
+
+        for model in MODELS[:3]:
+            status, headers, body = await _request(
+                open_connection, "POST", "/identify", {"target": model, "port": 4433}
+            )
+            assert status == 200
+            assert headers["content-type"] == "application/json"
+            result = json.loads(body)
+            assert result["target"] == model
+            assert result["port"] == 4433
+            assert model in result["models"]
+
+        status, _, body = await _request(open_connection, "GET", "/health")
+        assert json.loads(body)["results"] == {"ok": 3}
+
+        status, _, body = await _request(open_connection, "GET", "/metrics")
+        assert status == 200
+        assert json.loads(body)["timers"]["test.identify"]["count"] == 3
+
+    asyncio.run(_serve(server, test))
+
+
+def test_batch():
+    server = IdentifyServer(identify_function, concurrency=3)
+
+    async def test(open_connection):
+        status, headers, body = await _request(
+            open_connection, "POST", "/batch", {"targets": MODELS}
+        )
+        assert status == 200
+        assert headers["transfer-encoding"] == "chunked"
+        results = [json.loads(line) for line in _dechunk(body).splitlines()]
+        assert sorted(result["target"] for result in results) == MODELS
+        for result in results:
+            assert result["port"] == 443
+            assert result["target"] in result["models"]
+
+    asyncio.run(_serve(server, test))
+
+
+@pytest.mark.parametrize(
+    "method, path, content, expected",
+    [
+        ("GET", "/unknown", None, 404),
+        ("GET", "/identify", None, 405),
+        ("POST", "/identify", {}, 400),
+        ("POST", "/identify", {"target": 443}, 400),
+        ("POST", "/batch", {"targets": "localhost"}, 400),
+    ],
+)
+def test_errors(method, path, content, expected):
+    server = IdentifyServer(identify_function)
+
+    async def test(open_connection):
+        status, _, body = await _request(open_connection, method, path, content)
+        assert status == expected
+        assert "error" in json.loads(body)
+
+    asyncio.run(_serve(server, test))
+
+
+def test_concurrency():
+    """No more than `concurrency` identifications run at the same time."""
+    lock = threading.Lock()
+    running = []
+    maximum = []
+
+    def slow_identify(target, target_port):
+        with lock:
+            running.append(target)
+            maximum.append(len(running))
+        result = identify_function(target, target_port)
+        with lock:
+            running.remove(target)
+        return result
+
+    server = IdentifyServer(slow_identify, concurrency=2)
+
+    async def test(open_connection):
+        status, _, body = await _request(
+            open_connection, "POST", "/batch", {"targets": MODELS[:8]}
+        )
+        assert status == 200
+        assert len(_dechunk(body).splitlines()) == 8
+
+    asyncio.run(_serve(server, test))
+    assert max(maximum) <= 2
+
+
+def test_unix_socket(tmp_path):
+    path = str(tmp_path / "tlsprint.sock")
+    server = IdentifyServer(identify_function)
+
+    async def run():
+        listener = await server.start_unix(path)
+        try:
+            async with listener:
+                status, _, body = await _request(
+                    lambda: asyncio.open_unix_connection(path),
+                    "POST",
+                    "/identify",
+                    {"target": MODELS[0]},
+                )
+        finally:
+            server.close()
+        assert status == 200
+        assert MODELS[0] in json.loads(body)["models"]
+
+    asyncio.run(run())
+
+
+def test_close_cancels_queued():
+    """Closing the server waits for the running identification, and drops the
+    identifications that did not start yet."""
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def blocking_identify(target, target_port):
+        calls.append(target)
+        started.set()
+        release.wait(10)
+        return identify_function(target, target_port)
+
+    server = IdentifyServer(blocking_identify, concurrency=1)
+    server._prepare()
+    running = server.executor.submit(blocking_identify, MODELS[0], 443)
+    server.futures.add(running)
+    queued = server.executor.submit(blocking_identify, MODELS[1], 443)
+    server.futures.add(queued)
+    started.wait(10)
+
+    threading.Timer(0.1, release.set).start()
+    server.close()
+    assert running.result()["target"] == MODELS[0]
+    assert queued.cancelled()
+    assert calls == [MODELS[0]]
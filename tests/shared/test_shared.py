@@ -0,0 +1,177 @@
+import concurrent.futures
+import copy
+import os
+import pickle
+import subprocess
+import sys
+
+import pytest
+from tlsprint.identify import BenchmarkConnector
+from tlsprint.identify import gini_selector
+from tlsprint.identify import identify
+from tlsprint import __version__
+from tlsprint import shared
+from tlsprint.shared import SharedTree
+from tlsprint.shared import bundled
+from tlsprint.shared import cached
+from tlsprint.trees import trees
+
+
+def _paths(tree):
+    return {tree.path(node): tree.nodes[node].get("models") for node in tree.nodes}
+
+
+def _identify_models(shared_tree, tree_type, version):
+    """Identify every model of the tree using sessions of the shared tree."""
+    tree = trees[tree_type][version]
+    results = {}
+    for model in sorted(tree.models):
+        session = shared_tree.session()
+        session.condense()
+        results[model] = identify(
+            session, model, connector=BenchmarkConnector(model, tree)
+        )
+    return results
+
+
+@pytest.mark.parametrize("tree_type", ["adg", "hdt"])
+@pytest.mark.parametrize("selector", [None, gini_selector])
+def test_session_matches_tree(tree_type, selector):
+    kwargs = {"selector": selector} if selector else {}
+    for tree in trees[tree_type].values():
+        shared_tree = SharedTree.from_tree(tree)
+        assert _paths(shared_tree.to_tree()) == _paths(tree)
+
+        for model in sorted(tree.models):
+            tree_copy = copy.deepcopy(tree)
+            tree_copy.condense()
+            expected_connector = BenchmarkConnector(model, tree)
+            expected = identify(
+                tree_copy, model, connector=expected_connector, **kwargs
+            )
+
+            session = shared_tree.session()
+            session.condense()
+            connector = BenchmarkConnector(model, tree)
+            assert identify(session, model, connector=connector, **kwargs) == expected
+            assert connector.messages == expected_connector.messages
+
+        # The shared tree itself is never modified
+        assert _paths(shared_tree.to_tree()) == _paths(tree)
+
+
+def test_publish_attach():
+    shared_tree = SharedTree.publish(trees["adg"]["TLS12"])
+    try:
+        # The shared tree is pickled by name, the workers attach to it
+        assert len(pickle.dumps(shared_tree)) < 200
+        with concurrent.futures.ProcessPoolExecutor(2) as executor:
+            futures = [
+                executor.submit(_identify_models, shared_tree, "adg", "TLS12")
+                for _ in range(2)
+            ]
+            results = [future.result() for future in futures]
+    finally:
+        shared_tree.close()
+        shared_tree.unlink()
+
+    expected = _identify_models(
+        SharedTree.from_tree(trees["adg"]["TLS12"]), "adg", "TLS12"
+    )
+    assert results == [expected, expected]
+    assert all(model in result for model, result in expected.items())
+
+
+def test_cached(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    tree = trees["adg"]["TLS11"]
+
+    shared_tree = cached(tree)
+    assert cached(tree)._path == shared_tree._path
+    assert len(list((tmp_path / "tlsprint" / "trees" / __version__).iterdir())) == 1
+
+    attached = pickle.loads(pickle.dumps(shared_tree))
+    assert _paths(attached.to_tree()) == _paths(tree)
+    attached.close()
+    shared_tree.close()
+
+
+def test_cached_threads(tmp_path, monkeypatch):
+    """Threads caching the same tree at the same time share a single file."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    tree = trees["adg"]["TLS12"]
+
+    with concurrent.futures.ThreadPoolExecutor(8) as executor:
+        shared_trees = list(executor.map(lambda _: cached(tree), range(16)))
+
+    assert {shared_tree._path for shared_tree in shared_trees} == {
+        shared_trees[0]._path
+    }
+    # No temporary files are left behind
+    assert len(list((tmp_path / "tlsprint" / "trees" / __version__).iterdir())) == 1
+    assert _paths(shared_trees[0].to_tree()) == _paths(tree)
+    for shared_tree in shared_trees:
+        shared_tree.close()
+
+
+def test_cached_bounded(tmp_path, monkeypatch):
+    """The trees of other versions of tlsprint and the least recently used
+    trees are removed from the cache."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    monkeypatch.setattr(shared, "CACHED_TREES", 2)
+    stale = tmp_path / "tlsprint" / "trees" / "0.0.1"
+    stale.mkdir(parents=True)
+    (stale / "tree.tree").write_bytes(b"")
+
+    paths = []
+    for index, version in enumerate(["TLS10", "TLS11", "TLS12"]):
+        shared_tree = cached(trees["adg"][version])
+        paths.append(shared_tree._path)
+        shared_tree.close()
+        # Make sure the modification times differ
+        os.utime(paths[-1], (index, index))
+
+    assert not stale.exists()
+    assert sorted((tmp_path / "tlsprint" / "trees" / __version__).iterdir()) == sorted(
+        paths[1:]
+    )
+
+
+def test_bundled(tmp_path, monkeypatch):
+    """The included trees are condensed once, identifying with a session of a
+    bundled tree gives the same results without condensing it again."""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    shared_trees = bundled()
+    assert sorted(shared_trees) == sorted(trees["adg"])
+
+    tree = trees["adg"]["TLS12"]
+    for model in sorted(tree.models):
+        tree_copy = copy.deepcopy(tree)
+        tree_copy.condense()
+        expected = identify(tree_copy, model, connector=BenchmarkConnector(model, tree))
+        session = shared_trees["TLS12"].session()
+        connector = BenchmarkConnector(model, tree)
+        assert identify(session, model, connector=connector) == expected
+    for shared_tree in shared_trees.values():
+        shared_tree.close()
+
+    # Other processes map the cached files, without loading the included trees
+    code = (
+        "import sys\n"
+        "from tlsprint.scan import identifier\n"
+        "identifier()\n"
+        "assert 'tlsprint.trees' not in sys.modules\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_prune_models_changes():
+    """Pruning models only stores the leaves of which the models changed."""
+    shared_tree = SharedTree.from_tree(trees["adg"]["TLS12"])
+    session = shared_tree.session()
+    model = sorted(session.models)[0]
+    leaves = [leaf for leaf in session.leaves if model in session.nodes[leaf]["models"]]
+
+    session.prune_models({model})
+    assert model not in session.models
+    assert set(session.changed_models) <= set(leaves)
@@ -0,0 +1,167 @@
+import asyncio
+import contextlib
+import json
+import socket
+import threading
+
+import pytest
+from tlsprint.identify import STATUS_FAILED
+from tlsprint.identify import STATUS_FINISHED
+from tlsprint.identify import STATUS_TIMEOUT
+from tlsprint.identify import AsyncTLSAttackerConnector
+from tlsprint.identify import TLSAttackerConnector
+from tlsprint.identify import identify_async
+from tlsprint.identify import identify_target
+from tlsprint.learn import construct_tree_from_dedup
+from tlsprint.simulate import Simulator
+from tlsprint.simulate import SimulatorServer
+
+from .test_simulator import MODELS
+
+MODEL = """digraph {
+    __start0 -> s0
+    s0 -> s1 [label="A / B"]
+    s0 -> s1 [label="C / D"]
+    s1 -> s1 [label="A / ConnectionClosed"]
+    s1 -> s1 [label="C / ConnectionClosed"]
+}"""
+
+
+def test_sessions():
+    server = SimulatorServer(Simulator.from_dot({"model": MODEL}), "model")
+
+    async def session(port, messages):
+        reader, writer = await asyncio.open_connection("localhost", port)
+        responses = []
+        for message in messages:
+            writer.write(f"{message}\n".encode())
+            responses.append((await reader.readline()).decode().strip())
+        writer.close()
+        return responses
+
+    async def run():
+        listener = await server.start("localhost", 0)
+        port = listener.sockets[0].getsockname()[1]
+        results = await asyncio.gather(
+            session(port, ["A", "A", "RESET", "C"]), session(port, ["C", "C"])
+        )
+        listener.close()
+        return results
+
+    assert asyncio.run(run()) == [
+        ["B", "ConnectionClosed", "", "D"],
+        ["D", "ConnectionClosed"],
+    ]
+
+
+@contextlib.contextmanager
+def _running_server(**kwargs):
+    """Run a SimulatorServer in a background thread, yielding its port."""
+    server = SimulatorServer(Simulator.from_dot({"model": MODEL}), "model", **kwargs)
+    loop = asyncio.new_event_loop()
+    listener = loop.run_until_complete(server.start("localhost", 0))
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+
+    try:
+        yield listener.sockets[0].getsockname()[1]
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        listener.close()
+        loop.close()
+
+
+def test_tlsattacker_connector():
+    with _running_server() as port:
+        connector = TLSAttackerConnector(
+            "target", connector_address=("localhost", port)
+        )
+        assert connector.send("A") == "B"
+        assert connector.send("C") == "ConnectionClosed"
+        connector.reset()
+        assert connector.send("C") == "D"
+        connector.close()
+
+
+def test_tlsattacker_connector_pipelined():
+    with _running_server() as port:
+        connector = TLSAttackerConnector(
+            "target", connector_address=("localhost", port)
+        )
+        responses = connector.send_sequence(["A", "A", "RESET", "C"])
+        assert responses == ["B", "ConnectionClosed", "", "D"]
+        connector.close()
+
+
+def test_tlsattacker_connector_timeout():
+    with _running_server(latency=1) as port:
+        connector = TLSAttackerConnector(
+            "target", connector_address=("localhost", port), timeout=0.1
+        )
+        with pytest.raises(socket.timeout):
+            connector.send("A")
+        connector.close()
+
+
+def test_identify_async(tmp_path):
+    for name, model in MODELS.items():
+        model_dir = tmp_path / name
+        model_dir.mkdir()
+        (model_dir / "model.gv").write_text(model)
+        (model_dir / "versions.json").write_text(json.dumps([[name, "1.0"]]))
+    simulator = Simulator.from_dedup(tmp_path)
+
+    async def identify_model(model):
+        server = SimulatorServer(simulator, model, latency=0.01)
+        listener = await server.start("localhost", 0)
+        port = listener.sockets[0].getsockname()[1]
+
+        connector = await AsyncTLSAttackerConnector.start(
+            "target", connector_address=("localhost", port), timeout=1
+        )
+        tree = construct_tree_from_dedup(tmp_path, "hdt")
+        result = await identify_async(tree, model, connector=connector)
+        listener.close()
+        return result
+
+    async def identify_all():
+        return await asyncio.gather(*(identify_model(model) for model in MODELS))
+
+    assert asyncio.run(identify_all()) == [{model} for model in MODELS]
+
+
+def test_identify_target(tmp_path):
+    for name, model in MODELS.items():
+        model_dir = tmp_path / name
+        model_dir.mkdir()
+        (model_dir / "model.gv").write_text(model)
+        (model_dir / "versions.json").write_text(json.dumps([[name, "1.0"]]))
+
+    # The test server runs the same state machine as model-3
+    tree = construct_tree_from_dedup(tmp_path, "hdt")
+    with _running_server() as port:
+        result = identify_target(
+            tree, "target", connector_address=("localhost", port), deadline=5
+        )
+    assert result["status"] == STATUS_FINISHED
+    assert result["models"] == ["model-3"]
+
+    # A slow target exceeds the deadline
+    tree = construct_tree_from_dedup(tmp_path, "hdt")
+    with _running_server(latency=1) as port:
+        result = identify_target(
+            tree, "target", connector_address=("localhost", port), deadline=0.2
+        )
+    assert result["status"] == STATUS_TIMEOUT
+
+    # Nothing is listening on this port, even after retrying
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        port = sock.getsockname()[1]
+    tree = construct_tree_from_dedup(tmp_path, "hdt")
+    result = identify_target(
+        tree, "target", connector_address=("localhost", port), backoff=0.01
+    )
+    assert result["status"] == STATUS_FAILED
+    assert "ConnectionRefusedError" in result["error"]
@@ -0,0 +1,61 @@
+import json
+
+from tlsprint.identify import identify
+from tlsprint.learn import construct_tree_from_dedup
+from tlsprint.simulate import Simulator
+from tlsprint.simulate import SimulatorConnector
+
+MODELS = {
+    "model-1": """digraph {
+        __start0 -> s0
+        s0 -> s1 [label="A / B"]
+        s0 -> s2 [label="C / D"]
+        s1 -> s2 [label="A / B"]
+        s1 -> s2 [label="C / E"]
+        s2 -> s2 [label="A / ConnectionClosed"]
+        s2 -> s2 [label="C / ConnectionClosed"]
+    }""",
+    "model-2": """digraph {
+        __start0 -> s0
+        s0 -> s1 [label="A / B"]
+        s0 -> s2 [label="C / D"]
+        s1 -> s2 [label="A / B"]
+        s1 -> s2 [label="C / F"]
+        s2 -> s2 [label="A / ConnectionClosed"]
+        s2 -> s2 [label="C / ConnectionClosed"]
+    }""",
+    "model-3": """digraph {
+        __start0 -> s0
+        s0 -> s1 [label="A / B"]
+        s0 -> s1 [label="C / D"]
+        s1 -> s1 [label="A / ConnectionClosed"]
+        s1 -> s1 [label="C / ConnectionClosed"]
+    }""",
+}
+
+
+def test_run():
+    simulator = Simulator.from_dot(MODELS)
+    outputs = simulator.run(
+        ["model-1", "model-2", "model-3"],
+        [["A", "C"], ["A", "C", "RESET", "C"], ["A", "A"]],
+    )
+    assert outputs == [
+        ["B", "E"],
+        ["B", "F", "", "D"],
+        ["B", "ConnectionClosed"],
+    ]
+
+
+def test_identify(tmp_path):
+    for name, model in MODELS.items():
+        model_dir = tmp_path / name
+        model_dir.mkdir()
+        (model_dir / "model.gv").write_text(model)
+        (model_dir / "versions.json").write_text(json.dumps([[name, "1.0"]]))
+
+    simulator = Simulator.from_dedup(tmp_path)
+    for model in MODELS:
+        tree = construct_tree_from_dedup(tmp_path, "hdt")
+        connector = SimulatorConnector(simulator, model)
+        assert identify(tree, model, connector=connector) == {model}
@@ -0,0 +1,66 @@
+import json
+
+from tlsprint import stats
+from tlsprint.stats.context import StatsContext
+
+from ..simulate.test_simulator import MODELS
+
+
+def _write_directories(path):
+    models_dir = path / "models"
+    for implementation, version, tls_version in [
+        ("openssl", "1.0.0", "TLS10"),
+        ("openssl", "1.0.0", "TLS12"),
+        ("openssl", "1.1.0", "TLS12"),
+        ("wolfssl", "3.0.0", "TLS12"),
+    ]:
+        (models_dir / implementation / version / tls_version).mkdir(parents=True)
+
+    dedup_dir = path / "dedup"
+    for name, versions in [
+        ("model-1", [["openssl", "1.0.0"]]),
+        ("model-2", [["openssl", "1.1.0"], ["wolfssl", "3.0.0"]]),
+        ("model-3", [["wolfssl", "3.0.0"]]),
+    ]:
+        model_dir = dedup_dir / "TLS12" / name
+        model_dir.mkdir(parents=True)
+        (model_dir / "model.gv").write_text(MODELS[name])
+        (model_dir / "versions.json").write_text(json.dumps(versions))
+
+    return models_dir, dedup_dir
+
+
+def test_stats_context(tmp_path):
+    models_dir, dedup_dir = _write_directories(tmp_path)
+    cache_file = tmp_path / "cache" / "stats.json"
+
+    def summaries():
+        context = StatsContext(
+            models_dir=models_dir, dedup_dir=dedup_dir, cache_file=cache_file
+        )
+        return {
+            type_: handler(context) for type_, handler in stats.TYPE_HANDLERS.items()
+        }
+
+    first = summaries()
+    assert first["total-models"] == [
+        {"Name": "openssl", "TLS10": 1, "TLS12": 2, "Total": 3},
+        {"Name": "wolfssl", "TLS12": 1, "Total": 1},
+    ]
+    assert first["dedup-per-tls"] == [
+        {
+            "TLS version": "TLS12",
+            "Unique models": 3,
+            "Average model size": 2.7,
+            "Largest model": 3,
+            "Smallest model": 2,
+        }
+    ]
+    assert first["dedup-per-implementation"] == [
+        {"Name": "openssl", "TLS12": 2},
+        {"Name": "wolfssl", "TLS12": 2},
+    ]
+
+    # The second run uses the cached graph summaries
+    assert len(json.loads(cache_file.read_text())) == 3
+    assert summaries() == first
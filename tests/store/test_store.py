@@ -0,0 +1,125 @@
+import pytest
+from tlsprint.identify import STATUS_FAILED
+from tlsprint.identify import STATUS_FINISHED
+from tlsprint.store import ResultStore
+
+
+def _result(target, port=443, status=STATUS_FINISHED, models=None, **kwargs):
+    return {
+        "target": target,
+        "port": port,
+        "status": status,
+        "models": models,
+        "error": None,
+        "duration": 1.5,
+        "tls_version": "TLS12",
+        **kwargs,
+    }
+
+
+@pytest.fixture
+def store():
+    with ResultStore(":memory:") as store:
+        yield store
+
+
+def test_add_and_get(store):
+    transcript = [[True, ["ClientHello"], ["ServerHello"], 0.1]]
+    result = _result("a.example", models=["model-1"], transcript=transcript)
+    store.add([result])
+
+    assert len(store) == 1
+    assert store.get("a.example") == result
+    assert store.get("a.example", 8443) is None
+    assert store.status("a.example") == STATUS_FINISHED
+
+
+def test_replace(store):
+    store.add([_result("a.example", models=["model-1"])])
+    store.add([_result("a.example", models=["model-2"])])
+
+    assert len(store) == 1
+    assert store.get("a.example")["models"] == ["model-2"]
+    assert store.hosts("model-1") == []
+    assert store.hosts("model-2") == [("a.example", 443)]
+
+
+def test_models(store):
+    store.add(
+        [
+            _result("a.example", models=["model-1", "model-2"]),
+            _result("b.example", models=["model-2"]),
+            _result("b.example", 8443, models=["model-3"]),
+            _result(
+                "c.example",
+                models=["model-3"],
+                candidates=[["model-3", 0.8], ["model-2", 0.2]],
+            ),
+            _result("d.example", status=STATUS_FAILED, error="refused"),
+        ]
+    )
+
+    assert store.hosts("model-2") == [("a.example", 443), ("b.example", 443)]
+    assert store.hosts("model-2", candidates=True) == [
+        ("a.example", 443),
+        ("b.example", 443),
+        ("c.example", 443),
+    ]
+    assert store.hosts("model-4") == []
+
+    assert [r["port"] for r in store.query(target="b.example")] == [443, 8443]
+    assert [r["target"] for r in store.query(model="model-3")] == [
+        "b.example",
+        "c.example",
+    ]
+    assert [r["target"] for r in store.query(status=STATUS_FAILED)] == ["d.example"]
+    assert store.counts() == {STATUS_FINISHED: 4, STATUS_FAILED: 1}
+
+
+def test_models_per_tls_version(store):
+    """Models are numbered per TLS version, the same name in another version
+    is a different model."""
+    store.add(
+        [
+            _result("a.example", models=["model-7"]),
+            _result("b.example", models=["model-7"], tls_version="TLS13"),
+            _result("c.example", models=["model-7"], tls_version=None),
+        ]
+    )
+
+    assert store.hosts("model-7", "TLS12") == [("a.example", 443)]
+    assert store.hosts("model-7", "TLS13") == [("b.example", 443)]
+    assert len(store.hosts("model-7")) == 3
+    assert [r["target"] for r in store.query(model="model-7", tls_version="TLS13")] == [
+        "b.example"
+    ]
+    assert [r["target"] for r in store.query(tls_version="TLS12")] == ["a.example"]
+
+
+def test_remaining(store):
+    store.add(
+        [
+            _result("a.example", models=["model-1"]),
+            _result("b.example", status=STATUS_FAILED),
+        ]
+    )
+    targets = [("a.example", 443), ("b.example", 443), ("c.example", 443)]
+
+    assert store.remaining(targets) == [("c.example", 443)]
+    assert store.remaining(targets, retry_failed=True) == targets[1:]
+    # The order of the targets is kept
+    assert store.remaining(targets[::-1], retry_failed=True) == targets[:0:-1]
+
+
+def test_buffered_writes(tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    with ResultStore(path, batch_size=3, flush_interval=60) as store:
+        for i in range(4):
+            store.write(_result(f"{i}.example", models=["model-1"]))
+        # The first batch is stored, the last result is still buffered
+        assert len(store.buffer) == 1
+
+    # Closing the store stores the buffer
+    with ResultStore(path) as store:
+        assert len(store) == 4
+        assert len(store.hosts("model-1")) == 4
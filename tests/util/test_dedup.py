@@ -0,0 +1,94 @@
+import json
+
+from tlsprint import util
+
+from ..simulate.test_simulator import MODELS
+
+
+def _write_source(root, implementation, version, protocol, model):
+    path = root / implementation / version / protocol
+    path.mkdir(parents=True, exist_ok=True)
+    (path / "learnedModel.dot").write_text(MODELS[model])
+
+
+def _write_model(model_dir, name, model):
+    (model_dir / "model.gv").write_text(model)
+
+
+def _read_models(output_path):
+    return {
+        path.name: (
+            (path / "model.gv").read_text(),
+            json.loads((path / "versions.json").read_text()),
+        )
+        for path in sorted((output_path / "TLS12").iterdir())
+    }
+
+
+def test_dedup_incremental(tmp_path):
+    root = tmp_path / "models"
+    output_path = tmp_path / "dedup"
+    _write_source(root, "openssl", "1.0.0", "TLS12", "model-1")
+    _write_source(root, "openssl", "1.1.0", "TLS12", "model-1")
+    _write_source(root, "wolfssl", "3.0.0", "TLS12", "model-2")
+
+    counts = util.dedup_incremental(root, output_path, _write_model)
+    assert counts == {"added": 2, "updated": 0, "removed": 0}
+    assert _read_models(output_path) == {
+        "model-1": (MODELS["model-1"], [["openssl", "1.0.0"], ["openssl", "1.1.0"]]),
+        "model-2": (MODELS["model-2"], [["wolfssl", "3.0.0"]]),
+    }
+
+    # Nothing changed
+    counts = util.dedup_incremental(root, output_path, _write_model)
+    assert counts == {"added": 0, "updated": 0, "removed": 0}
+
+    # The wolfssl model changes, and the old model is removed
+    _write_source(root, "wolfssl", "3.0.0", "TLS12", "model-3")
+    _write_source(root, "wolfssl", "3.1.0", "TLS12", "model-1")
+    counts = util.dedup_incremental(root, output_path, _write_model)
+    assert counts == {"added": 1, "updated": 1, "removed": 1}
+    assert _read_models(output_path) == {
+        "model-1": (
+            MODELS["model-1"],
+            [["openssl", "1.0.0"], ["openssl", "1.1.0"], ["wolfssl", "3.1.0"]],
+        ),
+        "model-3": (MODELS["model-3"], [["wolfssl", "3.0.0"]]),
+    }
+
+
+def test_dedup_legacy_output(tmp_path):
+    """An output directory written without a manifest is written again."""
+    root = tmp_path / "models"
+    output_path = tmp_path / "dedup"
+    _write_source(root, "openssl", "1.0.0", "TLS12", "model-1")
+    for name, model, versions in [
+        ("model-1", "model-2", [["wolfssl", "3.0.0"]]),
+        ("model-2", "model-3", [["openssl", "1.0.0"]]),
+    ]:
+        model_dir = output_path / "TLS12" / name
+        model_dir.mkdir(parents=True)
+        _write_model(model_dir, name, MODELS[model])
+        (model_dir / "versions.json").write_text(json.dumps(versions))
+
+    counts = util.dedup_incremental(root, output_path, _write_model)
+    assert counts == {"added": 1, "updated": 0, "removed": 0}
+    assert _read_models(output_path) == {
+        "model-1": (MODELS["model-1"], [["openssl", "1.0.0"]]),
+    }
+
+
+def test_dedup_model_changed(tmp_path):
+    """A model directory that holds another model than its source is written
+    again."""
+    root = tmp_path / "models"
+    output_path = tmp_path / "dedup"
+    _write_source(root, "openssl", "1.0.0", "TLS12", "model-1")
+    util.dedup_incremental(root, output_path, _write_model)
+
+    (output_path / "TLS12" / "model-1" / "model.gv").write_text(MODELS["model-2"])
+    counts = util.dedup_incremental(root, output_path, _write_model)
+    assert counts == {"added": 0, "updated": 1, "removed": 0}
+    assert _read_models(output_path) == {
+        "model-1": (MODELS["model-1"], [["openssl", "1.0.0"]]),
+    }